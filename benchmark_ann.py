@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Measure recall and latency of the local ANN index (chat/ann.py) against exact
+search: build an IVF index over a synthetic clustered corpus (or a copy of an
+existing local index), then run the same queries exactly and at several
+nprobe settings.
+
+Usage: python benchmark_ann.py [--vectors 50000] [--dim 1536] [--nprobe 1,4,16,64]
+       python benchmark_ann.py --index /var/lib/ishema/index --queries 500
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+
+from benchmark_chat import percentile
+from chat.ann import LOCAL_ANN_RERANK
+from chat.local_index import LocalVectorIndex, normalize_rows, write_local_index
+
+
+def synthetic_corpus(count, dim, clusters, spread, rng):
+    """Unit vectors around `clusters` random topics, like chunk embeddings.
+    `spread` is the noise relative to the topic direction; higher overlaps more."""
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    labels = rng.integers(0, clusters, count)
+    vectors = centers[labels] + rng.standard_normal((count, dim), dtype=np.float32) * spread
+    return normalize_rows(vectors)
+
+
+def timed(search, queries):
+    """(results, sorted latencies in ms)"""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(search(query))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--index', help='Existing local index directory to copy vectors from')
+    parser.add_argument('--vectors', type=int, default=50000, help='Synthetic corpus size')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--clusters', type=int, default=500, help='Topics in the synthetic corpus')
+    parser.add_argument('--spread', type=float, default=2.0, help='Noise around each synthetic topic')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--nprobe', default='1,2,4,8,16,32,64', help='Comma-separated nprobe values')
+    parser.add_argument('--rerank', type=int, default=LOCAL_ANN_RERANK, help='Candidates re-scored exactly')
+    parser.add_argument('--lists', type=int, default=0, help='IVF clusters (default: sqrt of the corpus size)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.index:
+        vectors = LocalVectorIndex(args.index).vectors
+        # Queries near stored chunks, as questions are near their answers
+        picked = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+        queries = normalize_rows(picked + rng.standard_normal(picked.shape, dtype=np.float32) / np.sqrt(picked.shape[1]))
+    else:
+        # Held-out points from the same topics, not in the index
+        vectors = synthetic_corpus(args.vectors + args.queries, args.dim, args.clusters, args.spread, rng)
+        vectors, queries = vectors[:args.vectors], vectors[args.vectors:]
+
+    workdir = tempfile.mkdtemp(prefix='ann-benchmark-')
+    try:
+        import chat.ann
+        chat.ann.LOCAL_ANN_LISTS = args.lists
+        started = time.perf_counter()
+        ids = [str(i) for i in range(len(vectors))]
+        write_local_index(workdir, ids, vectors, [{}] * len(ids), ann=True)
+        build_seconds = time.perf_counter() - started
+        index = LocalVectorIndex(workdir)
+        ann = index.ann
+        # Warm the page cache so both searches read from memory
+        np.asarray(index.vectors).sum()
+        np.asarray(ann.codes).sum()
+
+        mib = lambda array: array.nbytes / 2 ** 20
+        print(f"corpus       {len(vectors)} x {vectors.shape[1]}   {len(ann.centroids)} lists   "
+              f"built in {build_seconds:.1f} s")
+        print(f"storage      float32 {mib(index.vectors):.0f} MiB   int8 codes {mib(ann.codes):.0f} MiB")
+
+        exact, latencies = timed(lambda q: index.exact(q, args.top_k)[0], queries)
+        print(f"{'search':<12} {'nprobe':>6} {'recall@' + str(args.top_k):>10} {'scanned':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        print(f"{'exact':<12} {'-':>6} {1:>10.3f} {1:>8.1%} {percentile(latencies, 50):>8.2f} "
+              f"{percentile(latencies, 95):>8.2f}")
+        for nprobe in [int(n) for n in args.nprobe.split(',')]:
+            found, latencies = timed(lambda q: ann.search(q, index.vectors, args.top_k, nprobe, args.rerank)[0], queries)
+            recall = np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(found, exact)])
+            scanned = np.mean([len(ann.candidates(q, nprobe)[0]) for q in queries]) / len(vectors)
+            print(f"{'ivf+int8':<12} {nprobe:>6} {recall:>10.3f} {scanned:>8.1%} {percentile(latencies, 50):>8.2f} "
+                  f"{percentile(latencies, 95):>8.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Load-test /chat-bot/ offline: start the mock OpenAI/Pinecone upstream and the
+app under gunicorn, stream answers at a fixed concurrency and report
+throughput, time-to-first-token percentiles and error rates.
+
+Usage: python benchmark_chat.py [--requests 200] [--concurrency 20] [--mode wsgi|asgi]
+       python benchmark_chat.py --env PIPELINE_CONCURRENT=True --env SKIP_RETRIEVAL_FOR_SMALLTALK=True
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from mock_upstream import start_mock_server, server_url
+
+QUESTIONS = [
+    'How do I play the ISHEMA RYANJYE card game?',
+    'What is family planning?',
+    'Tell me about contraception methods',
+    'How can I talk to my parents about puberty?',
+    'Ni gute nakwirinda inda zitateganyijwe?',
+    'Comment jouer au jeu de cartes Ishema ryanjye?',
+    'What are the signs of depression?',
+    'Muraho',
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+
+
+def start_app(args, upstream_url, workdir):
+    """Run migrations, then start gunicorn the way start.py does; return (process, url)"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY='benchmark',
+        OPENAI_BASE_URL=f'{upstream_url}/v1',
+        PINECONE_API_KEY='benchmark',
+        PINECONE_URL=f'{upstream_url}/query',
+        DATABASE_URL=f'sqlite:///{os.path.join(workdir, "benchmark.db")}',
+        SERVER_MODE=args.mode,
+        # The mock returns one embedding for every text, so the answer cache
+        # would serve everything after the first request
+        ANSWER_CACHE_ENABLED=str(args.answer_cache),
+        CHAT_LOG_LEVEL='WARNING',
+    )
+    env.update(item.split('=', 1) for item in args.env)
+    migrate = subprocess.run([sys.executable, 'manage.py', 'migrate', '--noinput'], env=env,
+                             capture_output=True, text=True)
+    if migrate.returncode:
+        raise Exception(f"Failed to migrate the benchmark database: {migrate.stderr}")
+
+    cmd = ['gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', str(args.workers)]
+    if args.mode == 'asgi':
+        cmd += ['--worker-class', 'uvicorn.workers.UvicornWorker', 'ml_chatbot.asgi:application']
+    else:
+        cmd += ['ml_chatbot.wsgi:application']
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen(cmd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise Exception(f"Server exited with code {process.returncode}, see {log.name}")
+        try:
+            requests.get(f'{url}/chat-bot-config/', timeout=1)
+            return process, url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise Exception("Server did not start within 30 seconds")
+
+
+def send(http, url, payload, timeout):
+    """POST one chat request and read the streamed answer.
+
+    Returns ((outcome, ttft, total, lines), conversation_id); outcome is 'ok'
+    or the kind of error.
+    """
+    start = time.perf_counter()
+    ttft = None
+    lines = 0
+    try:
+        with http.post(url, json=payload, stream=True, timeout=timeout) as response:
+            conversation_id = response.headers.get('X-Conversation-Id')
+            if response.status_code != 200:
+                response.content
+                return (f'http_{response.status_code}', None, time.perf_counter() - start, 0), conversation_id
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                json.loads(line)
+                lines += 1
+    except requests.RequestException as e:
+        return (type(e).__name__, ttft, time.perf_counter() - start, lines), None
+    except ValueError:
+        return ('bad_ndjson', ttft, time.perf_counter() - start, lines), conversation_id
+    if not lines:
+        return ('empty', None, time.perf_counter() - start, 0), conversation_id
+    return ('ok', ttft, time.perf_counter() - start, lines), conversation_id
+
+
+class Client:
+    """One simulated user: a keep-alive session and, in session mode, a conversation"""
+
+    def __init__(self, url, session_mode):
+        self.url = f'{url}/chat-bot/'
+        self.session_mode = session_mode
+        self.http = requests.Session()
+        self.conversation_id = None
+
+    def payload(self, question):
+        if not self.session_mode:
+            return {'messages': [{'role': 'user', 'content': question}]}
+        payload = {'message': question}
+        if self.conversation_id:
+            payload['conversation_id'] = self.conversation_id
+        return payload
+
+    def ask(self, question, timeout):
+        """(outcome, ttft, total, lines) for one streamed answer"""
+        result, conversation_id = send(self.http, self.url, self.payload(question), timeout)
+        self.conversation_id = conversation_id or self.conversation_id
+        return result
+
+
+def run(url, args):
+    clients = [Client(url, args.session) for _ in range(args.concurrency)]
+    local = threading.local()
+    counter = iter(range(args.concurrency))
+    lock = threading.Lock()
+
+    def ask(i):
+        if not hasattr(local, 'client'):
+            with lock:
+                local.client = clients[next(counter)]
+        question = QUESTIONS[i % len(QUESTIONS)]
+        if args.unique:
+            question = f'{question} ({i})'
+        return local.client.ask(question, args.timeout)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(ask, range(args.requests)))
+    elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def report(results, elapsed):
+    outcomes = Counter(outcome for outcome, *_ in results)
+    ok = [r for r in results if r[0] == 'ok']
+    ttfts = sorted(r[1] for r in ok)
+    totals = sorted(r[2] for r in ok)
+    lines = sum(r[3] for r in ok)
+    errors = len(results) - len(ok)
+
+    def row(label, values):
+        print(
+            f"{label:<12} p50 {percentile(values, 50) * 1000:8.1f} ms   "
+            f"p95 {percentile(values, 95) * 1000:8.1f} ms   "
+            f"p99 {percentile(values, 99) * 1000:8.1f} ms"
+        )
+
+    print(f"throughput   {len(ok) / elapsed:8.1f} req/s   {lines / elapsed:8.1f} lines/s   ({elapsed:.1f} s)")
+    row('ttft', ttfts)
+    row('total', totals)
+    print(f"errors       {errors} of {len(results)} ({errors / len(results) * 100:.1f}%)", end='')
+    print(f"   {dict(o for o in outcomes.items() if o[0] != 'ok')}" if errors else '')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--mode', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--url', help='Benchmark an already running server instead (its upstream is up to you)')
+    parser.add_argument('--session', action='store_true', help='Send {"message", "conversation_id"} turns')
+    parser.add_argument('--unique', action='store_true', help='Make every question distinct (defeats the embedding cache)')
+    parser.add_argument('--answer-cache', action='store_true', help='Leave the answer cache enabled')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='Extra server setting')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--latency', type=float, default=0.05, help='Mock delay per upstream POST in seconds')
+    parser.add_argument('--token-rate', type=float, default=50.0, help='Mock streamed tokens per second')
+    parser.add_argument('--answer-tokens', type=int, default=40, help='Mock tokens per answer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of upstream POSTs answered with 429')
+    parser.add_argument('--capacity', type=int, default=0, help='Concurrent upstream POSTs before the mock answers 429')
+    args = parser.parse_args()
+
+    upstream = process = None
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if args.url:
+                url = args.url.rstrip('/')
+            else:
+                upstream = start_mock_server(
+                    latency=args.latency, error_rate=args.error_rate,
+                    token_rate=args.token_rate, answer_tokens=args.answer_tokens, capacity=args.capacity
+                )
+                process, url = start_app(args, server_url(upstream), workdir)
+
+            print(
+                f"=== {args.requests} requests, concurrency {args.concurrency} against {url}/chat-bot/"
+                + ('' if args.url else f" ({args.mode}, {args.workers} workers)") + " ==="
+            )
+            report(*run(url, args))
+            if upstream:
+                print(f"upstream     {dict(sorted(upstream.counts.items()))}")
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+            if upstream:
+                upstream.shutdown()
+
+
+if __name__ == '__main__':
+    main()
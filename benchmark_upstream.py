@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark bare requests.post against the pooled keep-alive sessions in
+chat/upstream.py, using the local mock upstream server.
+
+Usage: python benchmark_upstream.py [--requests 500] [--concurrency 4]
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from chat import upstream
+from mock_upstream import start_mock_server, server_url
+
+
+def run(label, send, total, concurrency):
+    def timed(_):
+        start = time.perf_counter()
+        response = send()
+        response.content
+        return time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = sorted(pool.map(timed, range(total)))
+    elapsed = time.perf_counter() - started
+
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{label:<10} {total / elapsed:8.1f} req/s   "
+        f"mean {statistics.mean(latencies) * 1000:6.2f} ms   "
+        f"p50 {statistics.median(latencies) * 1000:6.2f} ms   "
+        f"p95 {p95 * 1000:6.2f} ms"
+    )
+    return statistics.mean(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.0, help='Server-side delay per request in seconds')
+    args = parser.parse_args()
+
+    server = start_mock_server(latency=args.latency)
+    url = f'{server_url(server)}/v1/embeddings'
+    body = {'model': 'text-embedding-ada-002', 'input': 'Tell me about the ISHEMA RYANJYE card game'}
+
+    print(f"=== {args.requests} requests, concurrency {args.concurrency} against {url} ===")
+    bare = run('bare', lambda: requests.post(url, json=body, timeout=30), args.requests, args.concurrency)
+    pooled = run('pooled', lambda: upstream.post('openai', url, json=body), args.requests, args.concurrency)
+    print(f"Mean latency saved per call: {(bare - pooled) * 1000:.2f} ms ({(1 - pooled / bare) * 100:.0f}%)")
+
+    upstream.close_sessions()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
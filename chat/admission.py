@@ -0,0 +1,229 @@
+# chat/admission.py
+#
+# Per-process admission control for upstream calls on the chat path. Each
+# (upstream, model) pair gets a concurrency limit with a bounded FIFO wait
+# queue: a call takes a slot when one is free, waits in line for up to
+# ADMISSION_QUEUE_TIMEOUT otherwise, and fails fast with UpstreamBusy when the
+# queue is full or the wait runs out. A burst then turns into queueing and
+# quick 503s instead of a wall of 429s and retries.
+#
+# Limits apply per process; with N workers the upstream sees at most N times
+# the configured concurrency. Threads (sync views, background summaries) and
+# asyncio tasks share the same limiter.
+
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from decouple import AutoConfig, Csv
+config = AutoConfig()
+
+ADMISSION_ENABLED = config('ADMISSION_ENABLED', default=True, cast=bool)
+ADMISSION_MAX_CONCURRENT = config('ADMISSION_MAX_CONCURRENT', default=32, cast=int)
+ADMISSION_MAX_QUEUE = config('ADMISSION_MAX_QUEUE', default=64, cast=int)
+ADMISSION_QUEUE_TIMEOUT = config('ADMISSION_QUEUE_TIMEOUT', default=5.0, cast=float)
+# Seconds suggested to clients in the Retry-After header of busy responses
+ADMISSION_RETRY_AFTER = config('ADMISSION_RETRY_AFTER', default=2, cast=int)
+# Per-key overrides: "openai:gpt-4o=16/32,pinecone=64" (concurrent/queue)
+ADMISSION_LIMITS = config('ADMISSION_LIMITS', default='', cast=Csv())
+
+
+class UpstreamBusy(Exception):
+    """No upstream slot became free in time; answer with a busy response"""
+
+    def __init__(self, key, reason):
+        super().__init__(f"{':'.join(filter(None, key))} busy ({reason})")
+        self.key = key
+        self.reason = reason
+
+
+def parse_limits(items):
+    """{(name, model or None): (max_concurrent, max_queue)} from ADMISSION_LIMITS"""
+    limits = {}
+    for item in items:
+        key, _, value = item.partition('=')
+        name, _, model = key.strip().partition(':')
+        concurrent, _, queued = value.partition('/')
+        limits[(name, model or None)] = (int(concurrent), int(queued) if queued else ADMISSION_MAX_QUEUE)
+    return limits
+
+
+class _Waiter:
+    def __init__(self, loop=None):
+        self.granted = False
+        self.loop = loop
+        if loop:
+            self.future = loop.create_future()
+        else:
+            self.event = threading.Event()
+
+    def wake(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._resolve)
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class Permit:
+    """A held slot; release it exactly once (extra calls are ignored)"""
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.released = limiter is None
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter.release()
+
+    def __del__(self):
+        # A response generator that was never started never runs its finally
+        self.release()
+
+
+class Limiter:
+    def __init__(self, key, max_concurrent, max_queue, timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.key = key
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        # Reentrant: Permit.__del__ may run while this thread holds the lock
+        self._lock = threading.RLock()
+
+    def _enter(self, wait, loop=None):
+        """A Permit, or a queued _Waiter; raises UpstreamBusy when full"""
+        with self._lock:
+            if self.active < self.max_concurrent and not self.waiters:
+                self.active += 1
+                self.admitted += 1
+                return Permit(self)
+            if not wait or len(self.waiters) >= self.max_queue:
+                self.rejected += 1
+                raise UpstreamBusy(self.key, 'queue full' if wait else 'no free slot')
+            waiter = _Waiter(loop)
+            self.waiters.append(waiter)
+            return waiter
+
+    def _leave(self, waiter):
+        """Give up waiting; return True if a slot was granted meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return True
+            self.waiters.remove(waiter)
+            return False
+
+    def _granted(self):
+        with self._lock:
+            self.admitted += 1
+        return Permit(self)
+
+    def _timed_out(self):
+        with self._lock:
+            self.rejected += 1
+        return UpstreamBusy(self.key, 'queue timeout')
+
+    def acquire(self, wait=True):
+        entered = self._enter(wait)
+        if isinstance(entered, Permit):
+            return entered
+        if entered.event.wait(self.timeout) or self._leave(entered):
+            return self._granted()
+        raise self._timed_out()
+
+    async def aacquire(self, wait=True):
+        entered = self._enter(wait, asyncio.get_running_loop())
+        if isinstance(entered, Permit):
+            return entered
+        try:
+            await asyncio.wait_for(asyncio.shield(entered.future), self.timeout)
+        except asyncio.TimeoutError:
+            if not self._leave(entered):
+                raise self._timed_out()
+        except asyncio.CancelledError:
+            if self._leave(entered):
+                self.release()
+            raise
+        return self._granted()
+
+    def release(self):
+        with self._lock:
+            if self.waiters:
+                # Hand the slot straight to the next in line
+                waiter = self.waiters.popleft()
+                waiter.granted = True
+                waiter.wake()
+            else:
+                self.active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'active': self.active,
+                'queued': len(self.waiters),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+            }
+
+
+class AdmissionController:
+    def __init__(self, enabled=ADMISSION_ENABLED, max_concurrent=ADMISSION_MAX_CONCURRENT,
+                 max_queue=ADMISSION_MAX_QUEUE, limits=None):
+        self.enabled = enabled
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.limits = parse_limits(ADMISSION_LIMITS) if limits is None else limits
+        self.limiters = {}
+        self._lock = threading.Lock()
+
+    def limiter(self, name, model=None):
+        key = (name, model)
+        limiter = self.limiters.get(key)
+        if limiter is None:
+            with self._lock:
+                limiter = self.limiters.get(key)
+                if limiter is None:
+                    concurrent, queued = self.limits.get(key) or self.limits.get((name, None)) or (
+                        self.max_concurrent, self.max_queue)
+                    limiter = self.limiters[key] = Limiter(key, concurrent, queued)
+        return limiter
+
+    def acquire(self, name, model=None, wait=True):
+        if not self.enabled:
+            return Permit(None)
+        return self.limiter(name, model).acquire(wait)
+
+    async def aacquire(self, name, model=None, wait=True):
+        if not self.enabled:
+            return Permit(None)
+        return await self.limiter(name, model).aacquire(wait)
+
+    @contextmanager
+    def slot(self, name, model=None, wait=True):
+        permit = self.acquire(name, model, wait)
+        try:
+            yield permit
+        finally:
+            permit.release()
+
+    @asynccontextmanager
+    async def aslot(self, name, model=None, wait=True):
+        permit = await self.aacquire(name, model, wait)
+        try:
+            yield permit
+        finally:
+            permit.release()
+
+    def stats(self):
+        return {key: limiter.stats() for key, limiter in list(self.limiters.items())}
+
+
+admission = AdmissionController()
@@ -0,0 +1,138 @@
+# chat/ann.py
+#
+# Inverted-file (IVF) index for the local vector backend. Vectors are
+# clustered around LOCAL_ANN_LISTS centroids (spherical k-means) and stored
+# grouped by cluster as int8 codes with one float32 scale per row, a quarter
+# of the float32 matrix. A query scores the centroids, scans the codes of the
+# LOCAL_ANN_NPROBE closest clusters, and re-scores the best LOCAL_ANN_RERANK
+# candidates exactly against the float32 vectors.
+#
+# Built offline with the index and stored as sections of its snapshot
+# (chat/snapshot.py), memory-mapped when read, so workers share the pages and
+# a query only touches the probed clusters and the re-scored rows. See
+# benchmark_ann.py for recall vs latency.
+
+import numpy as np
+from decouple import AutoConfig
+config = AutoConfig()
+
+LOCAL_ANN = config('LOCAL_ANN', default=True, cast=bool)
+# Indexes smaller than this are searched exactly; a scan is fast enough
+LOCAL_ANN_MIN_VECTORS = config('LOCAL_ANN_MIN_VECTORS', default=20000, cast=int)
+# Clusters; 0 picks sqrt(vectors)
+LOCAL_ANN_LISTS = config('LOCAL_ANN_LISTS', default=0, cast=int)
+LOCAL_ANN_NPROBE = config('LOCAL_ANN_NPROBE', default=16, cast=int)
+LOCAL_ANN_RERANK = config('LOCAL_ANN_RERANK', default=200, cast=int)
+
+KMEANS_ITERATIONS = 10
+# k-means trains on a sample of this many vectors per cluster
+KMEANS_SAMPLE = 64
+BATCH_SIZE = 8192
+
+
+def assign_lists(matrix, centroids):
+    """Nearest centroid for every row, in batches to bound memory"""
+    return np.concatenate([
+        np.argmax(matrix[start:start + BATCH_SIZE] @ centroids.T, axis=1)
+        for start in range(0, len(matrix), BATCH_SIZE)
+    ]) if len(matrix) else np.zeros(0, dtype=np.int64)
+
+
+def train_centroids(matrix, lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on a sample of the (normalized) rows"""
+    rng = np.random.default_rng(seed)
+    size = min(len(matrix), lists * KMEANS_SAMPLE)
+    sample = np.asarray(matrix[np.sort(rng.choice(len(matrix), size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=lists)
+        empty = counts == 0
+        # Reseed empty clusters from random sample rows
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+    return centroids
+
+
+def build_ivf(matrix, lists=None, seed=0):
+    """IVF arrays for `matrix` (normalized rows), keyed by snapshot section"""
+    lists = lists or LOCAL_ANN_LISTS
+    lists = min(lists or max(1, int(np.sqrt(len(matrix)))), len(matrix))
+    centroids = train_centroids(matrix, lists, seed=seed)
+    assign = assign_lists(matrix, centroids)
+    rows = np.argsort(assign, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=lists))]).astype(np.int64)
+
+    codes = np.empty(matrix.shape, dtype=np.int8)
+    scales = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(rows), BATCH_SIZE):
+        batch = np.asarray(matrix[rows[start:start + BATCH_SIZE]], dtype=np.float32)
+        batch_scales = np.abs(batch).max(axis=1) / 127
+        batch_scales[batch_scales == 0] = 1.0
+        codes[start:start + len(batch)] = np.round(batch / batch_scales[:, None]).astype(np.int8)
+        scales[start:start + len(batch)] = batch_scales
+
+    return {
+        'ann_centroids': centroids.astype(np.float32),
+        'ann_offsets': offsets,
+        'ann_rows': rows.astype(np.int32),
+        'ann_scales': scales,
+        'ann_codes': codes,
+    }
+
+
+class IvfIndex:
+    def __init__(self, arrays, size):
+        self.centroids = arrays['ann_centroids']
+        self.offsets = arrays['ann_offsets']
+        self.rows = arrays['ann_rows']
+        self.scales = arrays['ann_scales']
+        self.codes = arrays['ann_codes']
+        if len(self.rows) != size or len(self.codes) != size:
+            raise ValueError(f'ANN index does not match its {size} vectors')
+
+    @classmethod
+    def load(cls, arrays, size):
+        """The index stored in a snapshot's arrays, or None when there is none"""
+        if 'ann_codes' not in arrays:
+            return None
+        return cls(arrays, size)
+
+    def candidates(self, query, nprobe):
+        """(row numbers, approximate scores) from the `nprobe` closest clusters"""
+        nprobe = min(nprobe, len(self.centroids))
+        probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        positions, scores = [], []
+        for cluster in probed:
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            if start == end:
+                continue
+            positions.append(np.arange(start, end))
+            scores.append((self.codes[start:end].astype(np.float32) @ query) * self.scales[start:end])
+        if not positions:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        positions = np.concatenate(positions)
+        return self.rows[positions], np.concatenate(scores)
+
+    def search(self, query, vectors, top_k, nprobe=LOCAL_ANN_NPROBE, rerank=LOCAL_ANN_RERANK, mask=None):
+        """(row numbers, exact scores) of the best `top_k` rows, best first.
+
+        `query` must be normalized; `vectors` is the float32 matrix used for
+        re-scoring and `mask` an optional boolean filter over its rows.
+        """
+        rows, approximate = self.candidates(query, nprobe)
+        if mask is not None:
+            keep = mask[rows]
+            rows, approximate = rows[keep], approximate[keep]
+        count = min(max(rerank, top_k), len(rows))
+        if not count:
+            return rows, approximate
+        best = np.sort(rows[np.argpartition(-approximate, count - 1)[:count]])
+        # Sorted row numbers read the memory-mapped matrix in file order
+        exact = vectors[best] @ query
+        k = min(top_k, count)
+        top = np.argpartition(-exact, k - 1)[:k]
+        top = top[np.argsort(-exact[top])]
+        return best[top], exact[top]
@@ -0,0 +1,121 @@
+# chat/answer_cache.py
+#
+# Semantic cache of complete streamed answers. An answer is reused when a
+# new question embeds close enough to a cached one and retrieval returned the
+# same context for the same model and conversation so far. Because the lookup
+# happens after retrieval, a knowledge base change that alters the retrieved
+# context misses the cache on its own.
+
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+ANSWER_CACHE_ENABLED = config('ANSWER_CACHE_ENABLED', default=True, cast=bool)
+ANSWER_CACHE_SIZE = config('ANSWER_CACHE_SIZE', default=512, cast=int)
+ANSWER_CACHE_TTL = config('ANSWER_CACHE_TTL', default=86400, cast=int)
+ANSWER_CACHE_THRESHOLD = config('ANSWER_CACHE_THRESHOLD', default=0.97, cast=float)
+# Bump to drop every cached answer, e.g. after editing the system prompt
+KNOWLEDGE_BASE_VERSION = config('KNOWLEDGE_BASE_VERSION', default='1')
+
+
+def fingerprint(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _unit(vector):
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class AnswerCache:
+    def __init__(self, max_size=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL, threshold=ANSWER_CACHE_THRESHOLD,
+                 version=KNOWLEDGE_BASE_VERSION, enabled=ANSWER_CACHE_ENABLED):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.version = version
+        self.enabled = enabled
+        # (bucket, entry id) -> (unit embedding, stream lines, expires at), oldest first
+        self._entries = OrderedDict()
+        # bucket -> set of entry ids, so a lookup only scans answers for the same context
+        self._buckets = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bucket(self, model, context, history):
+        """Key for everything but the question itself"""
+        return fingerprint(self.version, model, context, history)
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        ids = self._buckets.get(key[0])
+        if ids is not None:
+            ids.discard(key[1])
+            if not ids:
+                del self._buckets[key[0]]
+
+    def get(self, bucket, embedding):
+        """Return the stored stream lines for a near-duplicate question, or None"""
+        if not self.enabled:
+            return None
+        query = _unit(embedding)
+        now = time.time()
+        with self._lock:
+            best_key, best_score = None, self.threshold
+            for entry_id in list(self._buckets.get(bucket, ())):
+                key = (bucket, entry_id)
+                vector, lines, expires_at = self._entries[key]
+                if expires_at < now:
+                    self._drop(key)
+                    continue
+                score = sum(a * b for a, b in zip(query, vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key][1]
+
+    def set(self, bucket, embedding, lines):
+        if not self.enabled or not lines:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            key = (bucket, entry_id)
+            self._entries[key] = (_unit(embedding), list(lines), time.time() + self.ttl)
+            self._buckets.setdefault(bucket, set()).add(entry_id)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+            }
+
+
+answer_cache = AnswerCache()
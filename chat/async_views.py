@@ -0,0 +1,272 @@
+# chat/async_views.py
+#
+# Async version of the chat endpoint for ASGI deployments. A stream waits on
+# the event loop instead of holding a worker, so one process can serve many
+# concurrent conversations. Output is identical to views.handle_chat_bot_request.
+
+import asyncio
+import json
+import logging
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from . import metrics, upstream
+from .admission import UpstreamBusy, admission
+from .answer_cache import answer_cache
+from .breakers import CircuitOpen, breakers
+from .degraded import template
+from .history import history_manager
+from .lexical import lexical_search
+from .tagging import query_filter
+from .warmup import warm_set
+from .vectorstore import get_vector_store
+from .openai_api import OPENAI_BASE_URL, OPENAI_CHAT_URL, aget_embedding, openai_headers
+from .pipeline import (
+    PIPELINE_CONCURRENT,
+    SKIP_RETRIEVAL_FOR_SMALLTALK,
+    StageTimer,
+    atimed_stream,
+    is_smalltalk,
+    peek_last_message,
+)
+from .views import (
+    ERROR_MESSAGE,
+    build_enhanced_messages,
+    busy_response,
+    completion_body,
+    degraded_stream,
+    extract_context,
+    lexical_fallback,
+    ndjson,
+    no_content_message,
+    parse_stream_line,
+    request_payload,
+    save_turn,
+    session_request,
+    streaming_response,
+    turn_messages,
+    usable,
+    validate_messages,
+)
+
+logger = logging.getLogger(__name__)
+
+# The event loop only keeps weak references to tasks
+_background_tasks = set()
+
+
+def background(coroutine):
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def discard(task):
+    """Cancel a task whose result will not be used, and consume its outcome
+    so an exception it already raised is not reported as never retrieved"""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+async def aretrieve_context(query_embedding, timer=None, lexical=None, filter=None):
+    try:
+        with breakers['vector'].guard(), metrics.VECTOR_QUERY_SECONDS.time():
+            matches = await get_vector_store().aquery(query_embedding, top_k=50, filter=filter)
+            if filter and not usable(matches):
+                matches = await get_vector_store().aquery(query_embedding, top_k=50)
+                if timer:
+                    timer.fields['filter_fallback'] = True
+        return extract_context({'matches': matches, 'lexical': lexical}, timer)
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to query vector store: {str(e)}")
+
+
+async def aprepare_context(last_message, timer):
+    """Async counterpart of views.prepare_context"""
+    warm = warm_set.lookup(last_message)
+    if warm:
+        timer.fields['retrieval'] = 'warm'
+        return warm, warm['embedding'], warm['context']
+    if SKIP_RETRIEVAL_FOR_SMALLTALK and is_smalltalk(last_message):
+        timer.fields['retrieval'] = 'skipped'
+        return None, None, None
+    timer.fields['retrieval'] = 'vector'
+    filter = query_filter(last_message)
+    if filter:
+        timer.fields['filter'] = filter
+    with timer.stage('lexical'):
+        lexical = lexical_search.search(last_message, filter=filter)
+    try:
+        with timer.stage('embed'):
+            embedding = await aget_embedding(last_message)
+        with timer.stage('retrieve'):
+            context = await aretrieve_context(embedding, timer, lexical, filter)
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        if not lexical:
+            raise
+        return None, None, lexical_fallback(e, lexical, timer)
+    return None, embedding, context
+
+
+async def areplay(lines):
+    for line in lines:
+        yield line
+
+
+async def arecord_turn(stream, conversation_id, message):
+    """Async counterpart of views.record_turn"""
+    lines = []
+    completed = False
+    try:
+        async for line in stream:
+            lines.append(line)
+            yield line
+        completed = True
+    finally:
+        await sync_to_async(save_turn)(conversation_id, turn_messages(message, lines) if completed else [message])
+
+
+async def agenerate_stream(model, enhanced_messages, pinecone_context, on_complete=None, question=None, permit=None):
+    """Async counterpart of views.generate_stream"""
+    try:
+        async for line in _agenerate_stream(model, enhanced_messages, pinecone_context, on_complete, question):
+            yield line
+    finally:
+        if permit:
+            permit.release()
+
+
+async def _agenerate_stream(model, enhanced_messages, pinecone_context, on_complete, question):
+    streamed = []
+    completed = False
+    try:
+        with breakers['completion'].guard() as call:
+            async with upstream.astream(
+                'openai',
+                OPENAI_CHAT_URL,
+                json=completion_body(model, enhanced_messages),
+                headers=openai_headers()
+            ) as response:
+                if response.status_code != 200:
+                    call.fail()
+                    logger.warning('OpenAI completion error: %s', response.status_code)
+                    metrics.ERRORS.inc(stage='completion_status')
+                else:
+                    async for line in response.aiter_lines():
+                        if line:
+                            content = parse_stream_line(line)
+                            if content:
+                                streamed.append(ndjson(content))
+                                yield streamed[-1]
+                    completed = True
+
+    except CircuitOpen:
+        pass
+    except Exception as e:
+        logger.warning('OpenAI completion stream failed: %s', e)
+        metrics.ERRORS.inc(stage='completion_stream')
+
+    if completed and streamed:
+        if on_complete:
+            on_complete(streamed)
+    elif completed:
+        yield ndjson(no_content_message(pinecone_context))
+    elif streamed:
+        metrics.DEGRADED.inc(kind='interrupted')
+        yield ndjson(f"\n\n{template('interrupted', question)}")
+    else:
+        for line in degraded_stream(question, pinecone_context):
+            yield line
+
+
+@csrf_exempt
+@require_POST
+async def handle_chat_bot_request_async(request):
+    try:
+        timer = StageTimer()
+        with timer.stage('parse'):
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+
+        # Concurrent pipeline: retrieval and the OpenAI warm-up run as tasks
+        # while the conversation is loaded
+        retrieval = None
+        peeked_message = peek_last_message(data) if PIPELINE_CONCURRENT else None
+        if peeked_message:
+            background(upstream.apreconnect('openai', OPENAI_BASE_URL))
+            retrieval = asyncio.create_task(aprepare_context(peeked_message, timer))
+
+        _, last_message, error = validate_messages(request_payload(data))
+        if retrieval and (error or last_message != peeked_message):
+            # Not used (bad request, or prefetched for another message): stop it
+            discard(retrieval)
+            retrieval = None
+        if error:
+            metrics.REQUESTS.inc(outcome='bad_request')
+            return JsonResponse({'error': error}, status=400)
+
+        with timer.stage('session'):
+            conversation_id, data = await sync_to_async(session_request)(data)
+        messages = data['messages']
+        model = data.get('model', 'gpt-4o')
+        timer.fields.update(model=model, messages=len(messages))
+
+        def respond(stream, outcome):
+            timer.fields['outcome'] = outcome
+            if conversation_id:
+                stream = arecord_turn(stream, conversation_id, messages[-1])
+            response = streaming_response(atimed_stream(stream, timer), conversation_id)
+            response['Server-Timing'] = timer.header()
+            return response
+
+        try:
+            if retrieval:
+                warm, embedding, pinecone_context = await retrieval
+            else:
+                warm, embedding, pinecone_context = await aprepare_context(last_message, timer)
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            logger.warning('Retrieval failed: %s', e)
+            metrics.ERRORS.inc(stage='retrieval')
+            return respond(areplay(list(degraded_stream(last_message))), 'degraded')
+        if warm and warm['lines'] and len(messages) == 1 and model == warm['model']:
+            return respond(areplay(warm['lines']), 'warm')
+
+        if embedding is not None:
+            cache_bucket = answer_cache.bucket(model, pinecone_context, messages[:-1])
+            cached_lines = answer_cache.get(cache_bucket, embedding)
+            if cached_lines:
+                return respond(areplay(cached_lines), 'answer_cache')
+            on_complete = lambda lines: answer_cache.set(cache_bucket, embedding, lines)
+        else:
+            on_complete = None
+
+        if breakers['completion'].is_open():
+            return respond(areplay(list(degraded_stream(last_message, pinecone_context))), 'degraded')
+
+        enhanced_messages = build_enhanced_messages(history_manager.window(messages, model), pinecone_context)
+
+        permit = await admission.aacquire('openai', model)
+        return respond(agenerate_stream(
+            model, enhanced_messages, pinecone_context,
+            on_complete=on_complete, question=last_message, permit=permit
+        ), 'generated')
+
+    except UpstreamBusy as busy:
+        return busy_response(busy)
+    except Exception as error:
+        logger.exception('Chat request failed')
+        metrics.ERRORS.inc(stage='request')
+        metrics.REQUESTS.inc(outcome='error')
+        return JsonResponse({'content': ERROR_MESSAGE}, status=500)
@@ -0,0 +1,120 @@
+# chat/breakers.py
+#
+# Circuit breakers for the embedding, vector search and completion upstreams.
+# After BREAKER_FAILURE_THRESHOLD consecutive failures a breaker opens and
+# calls fail at once with CircuitOpen, so the chat view can answer from local
+# templates (chat/degraded.py) instead of waiting on a broken upstream. After
+# BREAKER_RECOVERY_SECONDS it lets a single probe call through (half-open):
+# success closes the breaker, failure opens it for another period.
+#
+# Breakers are per process, like the admission limiters.
+
+import threading
+import time
+from contextlib import contextmanager
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+from .admission import UpstreamBusy
+
+BREAKER_ENABLED = config('BREAKER_ENABLED', default=True, cast=bool)
+BREAKER_FAILURE_THRESHOLD = config('BREAKER_FAILURE_THRESHOLD', default=5, cast=int)
+BREAKER_RECOVERY_SECONDS = config('BREAKER_RECOVERY_SECONDS', default=30.0, cast=float)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name):
+        super().__init__(f"{name} circuit open")
+        self.name = name
+
+
+class _Call:
+    def __init__(self):
+        self.failed = False
+
+    def fail(self):
+        """Count this call as failed without raising (e.g. an error status)"""
+        self.failed = True
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 recovery_seconds=BREAKER_RECOVERY_SECONDS, enabled=BREAKER_ENABLED):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.enabled = enabled
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go out now; in half-open, only one probe at a time"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.recovery_seconds:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def is_open(self):
+        """Read-only check, for deciding on a degraded path up front"""
+        with self._lock:
+            return self.enabled and self.state != CLOSED and (
+                self.probing or time.monotonic() - self.opened_at < self.recovery_seconds)
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release(self):
+        """End a call with no verdict (cancelled, or shed by admission control)"""
+        with self._lock:
+            self.probing = False
+
+    @contextmanager
+    def guard(self):
+        """Run one upstream call: raise CircuitOpen when not allowed, then
+        record the outcome. Exceptions count as failures, as does call.fail()."""
+        if not self.allow():
+            raise CircuitOpen(self.name)
+        call = _Call()
+        try:
+            yield call
+        except UpstreamBusy:
+            self.release()
+            raise
+        except Exception:
+            self.failure()
+            raise
+        except BaseException:
+            # GeneratorExit, CancelledError: the client went away
+            self.release()
+            raise
+        if call.failed:
+            self.failure()
+        else:
+            self.success()
+
+
+breakers = {name: CircuitBreaker(name) for name in ('embedding', 'vector', 'completion')}
@@ -0,0 +1,214 @@
+# chat/capture.py
+#
+# Opt-in traffic capture for replay benchmarks (see replay_requests.py). With
+# CAPTURE_ENABLED, CaptureMiddleware appends one JSON line per chat request
+# to CAPTURE_PATH: arrival time, the anonymized request body, status, time to
+# first streamed byte, total time and response size.
+#
+# Anonymization: conversation IDs are replaced by a salted hash (which still
+# groups the turns of a conversation), e-mail addresses, URLs, phone numbers
+# and long digit runs are masked, and message text is replaced by filler of
+# the same length unless CAPTURE_TEXT opts in to keeping it. No headers or
+# client addresses are kept. Names and other free-form details are not
+# detected, so treat capture files with text as sensitive.
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from decouple import AutoConfig, Csv
+config = AutoConfig()
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_ENABLED = config('CAPTURE_ENABLED', default=False, cast=bool)
+CAPTURE_PATH = config('CAPTURE_PATH', default='captures/requests.jsonl')
+CAPTURE_PATHS = config('CAPTURE_PATHS', default='/chat-bot/', cast=Csv())
+# Fraction of stateless requests / whole conversations to record
+CAPTURE_SAMPLE_RATE = config('CAPTURE_SAMPLE_RATE', default=1.0, cast=float)
+# Keep (masked) message text; off by default, only lengths are kept
+CAPTURE_TEXT = config('CAPTURE_TEXT', default=False, cast=bool)
+CAPTURE_SALT = config('CAPTURE_SALT', default='')
+
+REDACTIONS = [
+    (re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+'), '[email]'),
+    (re.compile(r'(?:https?://|www\.)\S*[^\s.,;:!?)\]]'), '[url]'),
+    (re.compile(r'\+?\d[\d\s().-]{6,}\d'), '[phone]'),
+    (re.compile(r'\d{5,}'), '[number]'),
+]
+FILLER = 'lorem ipsum dolor sit amet '
+
+
+def anonymize_text(text):
+    if not isinstance(text, str):
+        return text
+    if not CAPTURE_TEXT:
+        return (FILLER * (len(text) // len(FILLER) + 1))[:len(text)]
+    for pattern, replacement in REDACTIONS:
+        text = pattern.sub(replacement, text)
+    return text
+
+
+def anonymize_message(message):
+    if isinstance(message, dict):
+        return {'role': message.get('role'), 'content': anonymize_text(message.get('content'))}
+    return anonymize_text(message)
+
+
+def anonymize_payload(data):
+    """The parts of a chat request body needed to replay it"""
+    payload = {}
+    if isinstance(data.get('messages'), list):
+        payload['messages'] = [anonymize_message(m) for m in data['messages']]
+    if 'message' in data:
+        payload['message'] = anonymize_message(data['message'])
+    if isinstance(data.get('model'), str):
+        payload['model'] = data['model']
+    return payload
+
+
+def conversation_key(conversation_id):
+    salt = CAPTURE_SALT or settings.SECRET_KEY
+    return hashlib.sha256(f'{salt}:{conversation_id}'.encode('utf-8')).hexdigest()[:16]
+
+
+def sampled(key):
+    """Sample conversations as a whole, by their hashed key"""
+    if CAPTURE_SAMPLE_RATE >= 1:
+        return True
+    if key:
+        return int(key[:8], 16) / 0x100000000 < CAPTURE_SAMPLE_RATE
+    return random.random() < CAPTURE_SAMPLE_RATE
+
+
+class CaptureWriter:
+    """Appends records from a background thread so requests never wait on disk"""
+
+    def __init__(self, path=CAPTURE_PATH):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='capture-writer', daemon=True)
+                self._thread.start()
+        self.queue.put(record)
+
+    def _run(self):
+        while True:
+            records = [self.queue.get()]
+            while not self.queue.empty():
+                records.append(self.queue.get())
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                # One write per batch of whole lines keeps workers from interleaving
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in records))
+            except OSError as e:
+                logger.warning('Failed to write %d captured requests: %s', len(records), e)
+
+
+capture_writer = CaptureWriter()
+
+
+class CaptureMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not CAPTURE_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        record = self.start(request)
+        response = self.get_response(request)
+        return self.finish(record, response) if record else response
+
+    async def __acall__(self, request):
+        record = self.start(request)
+        response = await self.get_response(request)
+        return self.finish(record, response) if record else response
+
+    def start(self, request):
+        if request.method != 'POST' or request.path not in CAPTURE_PATHS:
+            return None
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            data = None
+        return {
+            'ts': round(time.time(), 3),
+            'started': time.perf_counter(),
+            'path': request.path,
+            'payload': anonymize_payload(data) if isinstance(data, dict) else None,
+        }
+
+    def finish(self, record, response):
+        conversation_id = response.get('X-Conversation-Id')
+        record['conversation'] = conversation_key(conversation_id) if conversation_id else None
+        if not sampled(record['conversation']):
+            return response
+        record['status'] = response.status_code
+        if not response.streaming:
+            self.save(record, len(response.content), 1, None)
+            return response
+        if response.is_async:
+            response.streaming_content = self.awrap(record, response.streaming_content)
+        else:
+            response.streaming_content = self.wrap(record, response.streaming_content)
+        return response
+
+    def save(self, record, size, chunks, first_byte):
+        started = record.pop('started')
+        record.update(
+            ttft_ms=round((first_byte - started) * 1000, 1) if first_byte else None,
+            total_ms=round((time.perf_counter() - started) * 1000, 1),
+            bytes=size,
+            chunks=chunks,
+        )
+        capture_writer.write(record)
+
+    def wrap(self, record, content):
+        size = chunks = 0
+        first_byte = None
+        try:
+            for chunk in content:
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                size += len(chunk)
+                chunks += 1
+                yield chunk
+        finally:
+            self.save(record, size, chunks, first_byte)
+
+    async def awrap(self, record, content):
+        size = chunks = 0
+        first_byte = None
+        try:
+            async for chunk in content:
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                size += len(chunk)
+                chunks += 1
+                yield chunk
+        finally:
+            self.save(record, size, chunks, first_byte)
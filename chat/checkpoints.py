@@ -0,0 +1,157 @@
+# chat/checkpoints.py
+#
+# On-disk state of one document's ingestion run, so a crash (rate limit,
+# network drop) resumes from the last completed batch instead of starting
+# over. Every stage writes to its own append-only file:
+#
+#   chunks.jsonl     parse + chunk output, complete once chunks.done exists
+#   embeddings.f32   float32 rows, one per embedded chunk
+#   embeddings.ids   chunk ID of each row, appended after the row is written
+#   upserted.ids     chunk IDs confirmed by the vector store
+#
+# A checkpoint is tied to a fingerprint of the source (size, mtime, chunking
+# settings); if the source changes, the stale state is discarded. Writes
+# torn by a crash are cut off once, when the checkpoint is opened; after that
+# the files are only appended to.
+
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+INGEST_WORK_DIR = config('INGEST_WORK_DIR', default='.ingest')
+
+
+def source_fingerprint(path, *settings):
+    """Cheap identity of a source file plus the settings that shape its chunks"""
+    stat = os.stat(path)
+    return json.dumps([stat.st_size, int(stat.st_mtime), *settings])
+
+
+class Checkpoint:
+    def __init__(self, name, fingerprint, work_dir=INGEST_WORK_DIR):
+        self.dir = os.path.join(work_dir, name)
+        self._lock = threading.Lock()
+        os.makedirs(self.dir, exist_ok=True)
+        self._dimension = None
+        meta = self._read_meta()
+        if meta.get('fingerprint') != fingerprint:
+            self.clear()
+            os.makedirs(self.dir, exist_ok=True)
+            self._write_meta({'fingerprint': fingerprint})
+        else:
+            self._repair(meta)
+
+    def _repair(self, meta):
+        """Cut the files back to what was committed before a crash"""
+        self._dimension = meta.get('dimension')
+        rows = len(self.embedded_ids())
+        if self._dimension and os.path.exists(self._path('embeddings.f32')):
+            with open(self._path('embeddings.f32'), 'ab') as f:
+                f.truncate(rows * 4 * self._dimension)
+        self._truncate_ids('embeddings.ids', rows)
+        self._truncate_ids('upserted.ids')
+
+    def _path(self, name):
+        return os.path.join(self.dir, name)
+
+    def _read_meta(self):
+        try:
+            with open(self._path('meta.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, meta):
+        with open(self._path('meta.json.tmp'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(self._path('meta.json.tmp'), self._path('meta.json'))
+
+    def _append(self, name, data, mode='a'):
+        with open(self._path(name), mode) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _read_ids(self, name):
+        try:
+            with open(self._path(name), encoding='utf-8') as f:
+                # A torn last line (no newline) was never committed
+                return [line[:-1] for line in f if line.endswith('\n')]
+        except FileNotFoundError:
+            return []
+
+    # Stage 1: parse + chunk
+
+    def has_chunks(self):
+        return os.path.exists(self._path('chunks.done'))
+
+    def save_chunks(self, chunks):
+        """Persist (text, metadata) pairs and mark the stage complete"""
+        with open(self._path('chunks.jsonl'), 'w', encoding='utf-8') as f:
+            for text, metadata in chunks:
+                f.write(json.dumps({'text': text, 'metadata': metadata or {}}, ensure_ascii=False) + '\n')
+        self._append('chunks.done', '')
+
+    def load_chunks(self):
+        with open(self._path('chunks.jsonl'), encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                yield record['text'], record['metadata']
+
+    # Stage 2: embed
+
+    def embedded_ids(self):
+        ids = self._read_ids('embeddings.ids')
+        dimension = self._read_meta().get('dimension')
+        if not dimension or not os.path.exists(self._path('embeddings.f32')):
+            return []
+        rows = os.path.getsize(self._path('embeddings.f32')) // (4 * dimension)
+        return ids[:rows]
+
+    def append_embeddings(self, ids, vectors):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if not self._dimension:
+                self._dimension = int(matrix.shape[1])
+                self._write_meta({**self._read_meta(), 'dimension': self._dimension})
+            # Rows first: an ID is only committed once its row is on disk
+            self._append('embeddings.f32', matrix.tobytes(), mode='ab')
+            self._append('embeddings.ids', ''.join(f'{i}\n' for i in ids))
+
+    def _truncate_ids(self, name, count=None):
+        """Drop a torn last line and any IDs past `count`"""
+        ids = self._read_ids(name)[:count]
+        clean = ''.join(f'{i}\n' for i in ids)
+        path = self._path(name)
+        size = os.path.getsize(path) if os.path.exists(path) else -1
+        if size != len(clean.encode('utf-8')):
+            self._append(name, clean, mode='w')
+
+    def iter_embeddings(self):
+        """Yield (id, vector) for every committed row"""
+        ids = self.embedded_ids()
+        if not ids:
+            return
+        dimension = self._read_meta()['dimension']
+        matrix = np.fromfile(self._path('embeddings.f32'), dtype=np.float32, count=len(ids) * dimension)
+        for vector_id, row in zip(ids, matrix.reshape(len(ids), dimension)):
+            yield vector_id, row.tolist()
+
+    # Stage 3: upsert
+
+    def upserted_ids(self):
+        return set(self._read_ids('upserted.ids'))
+
+    def append_upserted(self, ids):
+        with self._lock:
+            self._append('upserted.ids', ''.join(f'{i}\n' for i in ids))
+
+    def clear(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self._dimension = None
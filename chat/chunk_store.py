@@ -0,0 +1,90 @@
+# chat/chunk_store.py
+#
+# Local copy of chunk texts and metadata, keyed by vector ID. With
+# VECTOR_QUERY_IDS_ONLY, Pinecone queries ask for IDs and scores only
+# (includeMetadata false), and the matches get their metadata from here: the
+# query response shrinks from up to 50 chunk texts to a few hundred bytes.
+#
+# Ingestion writes every chunk it syncs, before the vectors are upserted, so
+# a match never arrives ahead of its text; `manage.py build_chunk_store`
+# copies an index that was filled some other way. The store is one SQLite
+# file in WAL mode: workers read it concurrently with an ingestion run, and
+# looking up 50 IDs by primary key takes well under a millisecond.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+logger = logging.getLogger(__name__)
+
+CHUNK_STORE_PATH = config('CHUNK_STORE_PATH', default='')
+VECTOR_QUERY_IDS_ONLY = config('VECTOR_QUERY_IDS_ONLY', default=False, cast=bool)
+
+# Below SQLite's limit on parameters per statement
+LOOKUP_BATCH_SIZE = 500
+
+
+class ChunkStore:
+    def __init__(self, path=CHUNK_STORE_PATH):
+        self.path = path
+        # sqlite3 connections belong to the thread (and process) that opened them
+        self._local = threading.local()
+
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, metadata TEXT NOT NULL) WITHOUT ROWID'
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def put(self, chunks):
+        """Store chunks ({'id', 'metadata'}), replacing those with the same ID"""
+        rows = [
+            (chunk['id'], json.dumps(chunk.get('metadata') or {}, ensure_ascii=False, separators=(',', ':')))
+            for chunk in chunks
+        ]
+        with self.connection() as connection:
+            connection.executemany('INSERT OR REPLACE INTO chunks (id, metadata) VALUES (?, ?)', rows)
+        return len(rows)
+
+    def delete(self, ids):
+        with self.connection() as connection:
+            connection.executemany('DELETE FROM chunks WHERE id = ?', [(vector_id,) for vector_id in ids])
+
+    def get(self, ids):
+        """{id: metadata} for the stored IDs among `ids`"""
+        ids = list(ids)
+        found = {}
+        connection = self.connection()
+        for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+            batch = ids[start:start + LOOKUP_BATCH_SIZE]
+            rows = connection.execute(
+                f"SELECT id, metadata FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch
+            )
+            found.update((vector_id, json.loads(metadata)) for vector_id, metadata in rows)
+        return found
+
+    def ids(self):
+        return {row[0] for row in self.connection().execute('SELECT id FROM chunks')}
+
+    def __len__(self):
+        return self.connection().execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+
+    def fill(self, matches):
+        """(`matches` with their metadata, IDs missing from the store)"""
+        found = self.get(m['id'] for m in matches)
+        missing = [m['id'] for m in matches if m['id'] not in found]
+        return [{**m, 'metadata': found[m['id']]} for m in matches if m['id'] in found], missing
+
+
+chunk_store = ChunkStore()
@@ -0,0 +1,108 @@
+# chat/context.py
+#
+# Builds the "Relevant info" text from vector store matches. Matches above the
+# score threshold are taken best-first; exact and near-duplicate chunks (the
+# same text ingested twice, or heavily overlapping neighbours) are dropped,
+# the overlap a chunk shares with an already selected neighbour is trimmed,
+# and assembly stops once the token budget is spent.
+
+import re
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+from .embedding_cache import normalize_text
+from .tokens import count_tokens
+
+CONTEXT_TOKEN_BUDGET = config('CONTEXT_TOKEN_BUDGET', default=1500, cast=int)
+# Word-shingle similarity above which a chunk counts as a near-duplicate
+CONTEXT_DUPLICATE_THRESHOLD = config('CONTEXT_DUPLICATE_THRESHOLD', default=0.8, cast=float)
+# Shortest shared prefix/suffix trimmed as chunk overlap
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 200
+
+
+def match_text(match):
+    metadata = match.get('metadata') or {}
+    content = metadata.get('text') or metadata.get('content') or metadata.get('page_content')
+    return str(content).strip() if content else None
+
+
+def shingles(text, size=3):
+    words = re.findall(r'\w+', normalize_text(text))
+    if len(words) <= size:
+        return {tuple(words)}
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def similarity(a, b):
+    """Overlap of two shingle sets relative to the smaller one, so a chunk
+    contained in another counts as a duplicate"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / min(len(a), len(b))
+
+
+def overlap(left, right):
+    """Length of the longest suffix of `left` that starts `right`"""
+    tail = left[-MAX_OVERLAP_CHARS:]
+    start = tail.find(right[:MIN_OVERLAP_CHARS])
+    while start != -1 and len(right) >= MIN_OVERLAP_CHARS:
+        # The earliest start is the longest overlap
+        if right.startswith(tail[start:]):
+            return len(tail) - start
+        start = tail.find(right[:MIN_OVERLAP_CHARS], start + 1)
+    return 0
+
+
+def trim_overlap(text, selected):
+    """Remove the part of `text` already covered by a selected neighbour"""
+    for other in selected:
+        size = overlap(other, text)
+        if size:
+            text = text[size:].lstrip()
+        size = overlap(text, other)
+        if size:
+            text = text[:-size].rstrip()
+    return text
+
+
+def build_context(matches, threshold, budget=CONTEXT_TOKEN_BUDGET, model='gpt-4o'):
+    """Return (context text or None, stats) for Pinecone-style matches.
+
+    stats counts the chunks used, tokens used, duplicates dropped and chunks
+    left out because the budget was spent.
+    """
+    stats = {'chunks': 0, 'tokens': 0, 'duplicates': 0, 'over_budget': 0}
+    ranked = sorted(
+        (m for m in matches if m.get('score', 0) >= threshold),
+        key=lambda m: m.get('score', 0),
+        reverse=True
+    )
+
+    selected, selected_shingles, seen = [], [], set()
+    for match in ranked:
+        text = match_text(match)
+        if not text:
+            continue
+        key = normalize_text(text)
+        text_shingles = shingles(text)
+        if key in seen or any(similarity(text_shingles, s) >= CONTEXT_DUPLICATE_THRESHOLD for s in selected_shingles):
+            stats['duplicates'] += 1
+            continue
+        seen.add(key)
+
+        text = trim_overlap(text, selected)
+        if not text:
+            stats['duplicates'] += 1
+            continue
+        tokens = count_tokens(text, model) + 1  # joining newline
+        if stats['tokens'] + tokens > budget:
+            stats['over_budget'] += 1
+            continue
+        selected.append(text)
+        selected_shingles.append(text_shingles)
+        stats['chunks'] += 1
+        stats['tokens'] += tokens
+
+    return ('\n'.join(selected) or None), stats
@@ -0,0 +1,118 @@
+# chat/conversations.py
+#
+# Session mode for /chat-bot/: the server keeps each conversation's messages
+# so clients only send the new one. Conversations live in the database
+# (chat.models.Conversation) with a per-process LRU in front; a cached copy
+# is used after a cheap check that the row's updated_at has not moved (another
+# worker may have appended since). Conversations idle for longer than
+# CONVERSATION_TTL are treated as gone and deleted periodically.
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+from .models import Conversation
+
+CONVERSATION_TTL = config('CONVERSATION_TTL', default=7 * 24 * 3600, cast=int)
+CONVERSATION_CACHE_SIZE = config('CONVERSATION_CACHE_SIZE', default=1024, cast=int)
+CONVERSATION_CLEANUP_INTERVAL = config('CONVERSATION_CLEANUP_INTERVAL', default=3600, cast=int)
+
+
+def parse_conversation_id(value):
+    try:
+        return uuid.UUID(str(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class ConversationStore:
+    def __init__(self, ttl=CONVERSATION_TTL, max_entries=CONVERSATION_CACHE_SIZE,
+                 cleanup_interval=CONVERSATION_CLEANUP_INTERVAL):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.cleanup_interval = cleanup_interval
+        self.entries = OrderedDict()
+        self.last_cleanup = 0.0
+        self._lock = threading.Lock()
+
+    def _cache(self, conversation):
+        with self._lock:
+            self.entries[conversation.id] = (list(conversation.messages), conversation.updated_at)
+            self.entries.move_to_end(conversation.id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _forget(self, conversation_id):
+        with self._lock:
+            self.entries.pop(conversation_id, None)
+
+    def _expired(self, updated_at):
+        return updated_at < timezone.now() - timedelta(seconds=self.ttl)
+
+    def get(self, conversation_id):
+        """Stored messages, or None for unknown and expired conversations"""
+        conversation_id = parse_conversation_id(conversation_id)
+        if conversation_id is None:
+            return None
+        updated_at = Conversation.objects.filter(pk=conversation_id).values_list('updated_at', flat=True).first()
+        if updated_at is None or self._expired(updated_at):
+            self._forget(conversation_id)
+            return None
+        with self._lock:
+            cached = self.entries.get(conversation_id)
+            if cached and cached[1] == updated_at:
+                self.entries.move_to_end(conversation_id)
+                return list(cached[0])
+        conversation = Conversation.objects.filter(pk=conversation_id).first()
+        if conversation is None:
+            return None
+        self._cache(conversation)
+        return list(conversation.messages)
+
+    def create(self):
+        self.maybe_cleanup()
+        conversation = Conversation.objects.create()
+        self._cache(conversation)
+        return str(conversation.id)
+
+    def load(self, conversation_id):
+        """(conversation_id, messages); starts a new conversation when the ID
+        is missing, unknown or expired"""
+        messages = self.get(conversation_id)
+        if messages is None:
+            return self.create(), []
+        return str(parse_conversation_id(conversation_id)), messages
+
+    def append(self, conversation_id, messages):
+        with transaction.atomic():
+            conversation = Conversation.objects.select_for_update().filter(pk=conversation_id).first()
+            if conversation is None:
+                conversation = Conversation(id=conversation_id)
+            conversation.messages = [*conversation.messages, *messages]
+            conversation.save()
+        self._cache(conversation)
+
+    def cleanup(self):
+        """Delete expired conversations; return how many were removed"""
+        self.last_cleanup = time.time()
+        cutoff = timezone.now() - timedelta(seconds=self.ttl)
+        deleted, _ = Conversation.objects.filter(updated_at__lt=cutoff).delete()
+        with self._lock:
+            for conversation_id in [k for k, (_, updated_at) in self.entries.items() if updated_at < cutoff]:
+                del self.entries[conversation_id]
+        return deleted
+
+    def maybe_cleanup(self):
+        if time.time() - self.last_cleanup >= self.cleanup_interval:
+            self.cleanup()
+
+
+conversation_store = ConversationStore()
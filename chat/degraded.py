@@ -0,0 +1,64 @@
+# chat/degraded.py
+#
+# Replies served without any network call when an upstream is unavailable
+# (see chat/breakers.py). With retrieved context but no completion backend,
+# the best-matching passages are returned as a context-only answer; otherwise
+# a fixed message in the user's language.
+
+import re
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+from .language import DEFAULT_LANGUAGE, detect_language
+
+# Longest context-only answer, cut at a sentence end where possible
+DEGRADED_CONTEXT_CHARS = config('DEGRADED_CONTEXT_CHARS', default=600, cast=int)
+
+TEMPLATES = {
+    'en': {
+        'unavailable': "I'm having trouble reaching my information sources right now. Please try again in a few minutes.",
+        'context_intro': "I can't write a full answer right now, but here is what I found in our resources:",
+        'interrupted': '(My answer was interrupted. Please ask again.)',
+    },
+    'rw': {
+        'unavailable': 'Mfite ikibazo cyo kugera ku makuru yanjye muri aka kanya. Mwongere mugerageze mu minota mike.',
+        'context_intro': 'Sinshoboye gutanga igisubizo cyuzuye muri aka kanya, ariko dore ibyo nabonye mu makuru yacu:',
+        'interrupted': '(Igisubizo cyanjye cyahagaze. Mwongere mubaze.)',
+    },
+    'fr': {
+        'unavailable': "J'ai du mal à accéder à mes sources d'information pour le moment. Veuillez réessayer dans quelques minutes.",
+        'context_intro': "Je ne peux pas rédiger une réponse complète pour le moment, mais voici ce que j'ai trouvé dans nos ressources :",
+        'interrupted': '(Ma réponse a été interrompue. Veuillez reposer la question.)',
+    },
+}
+
+
+def template(key, text=None):
+    return TEMPLATES[detect_language(text) if text else DEFAULT_LANGUAGE][key]
+
+
+def excerpt(context, limit=DEGRADED_CONTEXT_CHARS):
+    """Leading passages of the context, at most `limit` characters"""
+    context = context.strip()
+    if len(context) <= limit:
+        return context
+    cut = context[:limit]
+    end = max((m.end() for m in re.finditer(r'[.!?](?=\s)', cut)), default=0)
+    return cut[:end] if end > limit // 2 else cut.rsplit(' ', 1)[0] + '…'
+
+
+def degraded_reply(text, context=None):
+    """Context-only answer when there is context, otherwise the unavailable message"""
+    if context:
+        return f"{template('context_intro', text)}\n\n{excerpt(context)}"
+    return template('unavailable', text)
+
+
+def is_degraded(reply):
+    """Whether a streamed reply came from here (and should not be kept in history)"""
+    reply = reply.strip()
+    return any(
+        reply == t['unavailable'] or reply.startswith(t['context_intro']) or reply.endswith(t['interrupted'])
+        for t in TEMPLATES.values()
+    )
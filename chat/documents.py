@@ -0,0 +1,143 @@
+# chat/documents.py
+#
+# Ingestion front end: parse PDFs and text files into pages and split them
+# into overlapping chunks. Parsing runs in a process pool, with large PDFs
+# cut into page ranges, so wall-clock time scales with the number of cores.
+# The chunker is a generator with the same size/overlap semantics as
+# langchain's RecursiveCharacterTextSplitter, without importing langchain.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+CHUNK_SIZE = config('CHUNK_SIZE', default=500, cast=int)
+CHUNK_OVERLAP = config('CHUNK_OVERLAP', default=50, cast=int)
+PARSE_WORKERS = config('PARSE_WORKERS', default=os.cpu_count() or 1, cast=int)
+# PDF pages handed to a worker at a time
+PARSE_PAGES_PER_TASK = config('PARSE_PAGES_PER_TASK', default=16, cast=int)
+
+SEPARATORS = ('\n\n', '\n', ' ', '')
+
+
+# Chunking
+
+def _split_keep(text, separator):
+    """Split on `separator`, keeping it at the start of the following piece"""
+    if not separator:
+        return list(text)
+    parts = text.split(separator)
+    pieces = [parts[0]] + [separator + part for part in parts[1:]]
+    return [piece for piece in pieces if piece]
+
+
+def _merge(pieces, chunk_size, chunk_overlap):
+    """Join small pieces into chunks of at most `chunk_size`, carrying up to
+    `chunk_overlap` characters of trailing pieces into the next chunk"""
+    current, total = [], 0
+    for piece in pieces:
+        if current and total + len(piece) > chunk_size:
+            chunk = ''.join(current).strip()
+            if chunk:
+                yield chunk
+            while current and (total > chunk_overlap or total + len(piece) > chunk_size):
+                total -= len(current.pop(0))
+        current.append(piece)
+        total += len(piece)
+    chunk = ''.join(current).strip()
+    if chunk:
+        yield chunk
+
+
+def split_text(text, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, separators=SEPARATORS):
+    """Yield chunks of `text`, splitting on the coarsest separator present
+    (paragraphs, then lines, then words, then characters)"""
+    separator, finer = separators[-1], ()
+    for i, candidate in enumerate(separators):
+        if not candidate or candidate in text:
+            separator, finer = candidate, separators[i + 1:]
+            break
+
+    small = []
+    for piece in _split_keep(text, separator):
+        if len(piece) < chunk_size:
+            small.append(piece)
+            continue
+        if small:
+            yield from _merge(small, chunk_size, chunk_overlap)
+            small = []
+        if finer:
+            yield from split_text(piece, chunk_size, chunk_overlap, finer)
+        else:
+            yield piece
+    if small:
+        yield from _merge(small, chunk_size, chunk_overlap)
+
+
+def chunk_pages(pages, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
+    """Yield (text, metadata) chunks from (text, metadata) pages; each chunk
+    keeps its page's metadata"""
+    for text, metadata in pages:
+        for chunk in split_text(text, chunk_size, chunk_overlap):
+            yield chunk, dict(metadata)
+
+
+# Parsing
+
+def is_pdf(path):
+    return path.lower().endswith('.pdf')
+
+
+def pdf_page_count(path):
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def iter_pages(path, start=0, stop=None):
+    """Yield (text, metadata) per page; text files are a single page"""
+    if is_pdf(path):
+        from pypdf import PdfReader
+
+        reader = PdfReader(path)
+        for number in range(start, min(stop or len(reader.pages), len(reader.pages))):
+            text = reader.pages[number].extract_text() or ''
+            if text.strip():
+                yield text, {'source': path, 'page': number + 1}
+    else:
+        with open(path, encoding='utf-8') as f:
+            yield f.read(), {'source': path}
+
+
+def _parse_task(task):
+    path, start, stop, chunk_size, chunk_overlap = task
+    return path, list(chunk_pages(iter_pages(path, start, stop), chunk_size, chunk_overlap))
+
+
+def _tasks(paths, chunk_size, chunk_overlap, pages_per_task):
+    for path in paths:
+        if is_pdf(path):
+            count = pdf_page_count(path)
+            for start in range(0, max(count, 1), pages_per_task):
+                yield path, start, start + pages_per_task, chunk_size, chunk_overlap
+        else:
+            yield path, 0, None, chunk_size, chunk_overlap
+
+
+def parse_documents(paths, workers=PARSE_WORKERS, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
+                    pages_per_task=PARSE_PAGES_PER_TASK):
+    """Yield (path, chunks) per document, in the order given, as soon as each
+    document is fully parsed. Chunks are (text, metadata) pairs."""
+    tasks = _tasks(paths, chunk_size, chunk_overlap, pages_per_task)
+    if workers <= 1:
+        yield from _by_document(map(_parse_task, tasks))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from _by_document(pool.map(_parse_task, tasks))
+
+
+def _by_document(results):
+    for path, parts in groupby(results, key=lambda result: result[0]):
+        yield path, [chunk for _, chunks in parts for chunk in chunks]
@@ -0,0 +1,179 @@
+# chat/embedding_cache.py
+#
+# Two-tier cache for query embeddings: a bounded in-memory LRU per process
+# and an optional SQLite file that every gunicorn worker on the host shares.
+# The async API (aget/aset) runs the SQLite tier in a thread, so a lookup
+# waiting on another worker's write lock never stalls the event loop.
+
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_SIZE = config('EMBEDDING_CACHE_SIZE', default=2048, cast=int)
+# Empty disables the shared on-disk tier
+EMBEDDING_CACHE_PATH = config('EMBEDDING_CACHE_PATH', default='')
+EMBEDDING_CACHE_DISK_MAX = config('EMBEDDING_CACHE_DISK_MAX', default=100000, cast=int)
+# Writes by one process between trims of the on-disk tier to EMBEDDING_CACHE_DISK_MAX
+DISK_TRIM_INTERVAL = 256
+
+
+def normalize_text(text):
+    return ' '.join(unicodedata.normalize('NFKC', text).casefold().split())
+
+
+def cache_key(text, model):
+    return hashlib.sha256(f'{model}\0{normalize_text(text)}'.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_size=EMBEDDING_CACHE_SIZE, path=EMBEDDING_CACHE_PATH, disk_max=EMBEDDING_CACHE_DISK_MAX):
+        self.max_size = max_size
+        self.path = path
+        self.disk_max = disk_max
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    def _connection(self):
+        # sqlite connections must not cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'key TEXT PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, used_at REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS embeddings_used_at ON embeddings (used_at)')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _remember(self, key, embedding):
+        # float32 array: about 6 KB per 1536-d embedding, a Python list is 50 KB
+        if not isinstance(embedding, array):
+            embedding = array('f', embedding)
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+    def _memory_get(self, key):
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is None:
+                return None
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+        return embedding.tolist()
+
+    def _disk_get(self, key):
+        try:
+            conn = self._connection()
+            row = conn.execute('SELECT vector FROM embeddings WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            conn.execute('UPDATE embeddings SET used_at = ? WHERE key = ?', (time.time(), key))
+        except sqlite3.Error as e:
+            logger.warning('Embedding disk cache read failed: %s', e)
+            return None
+        embedding = array('f', row[0])
+        self._remember(key, embedding)
+        with self._lock:
+            self.disk_hits += 1
+        return embedding.tolist()
+
+    def _miss(self):
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get(self, text, model):
+        """Return the cached embedding for `text` or None"""
+        key = cache_key(text, model)
+        embedding = self._memory_get(key)
+        if embedding is None and self.path:
+            embedding = self._disk_get(key)
+        return embedding if embedding is not None else self._miss()
+
+    async def aget(self, text, model):
+        key = cache_key(text, model)
+        embedding = self._memory_get(key)
+        if embedding is None and self.path:
+            embedding = await asyncio.to_thread(self._disk_get, key)
+        return embedding if embedding is not None else self._miss()
+
+    def _disk_set(self, key, model, embedding):
+        try:
+            conn = self._connection()
+            conn.execute(
+                'INSERT OR REPLACE INTO embeddings (key, model, vector, used_at) VALUES (?, ?, ?, ?)',
+                (key, model, array('f', embedding).tobytes(), time.time())
+            )
+            with self._lock:
+                self._writes += 1
+                trim = self._writes % DISK_TRIM_INTERVAL == 0
+            if trim:
+                self._trim_disk(conn)
+        except sqlite3.Error as e:
+            logger.warning('Embedding disk cache write failed: %s', e)
+
+    def set(self, text, model, embedding):
+        key = cache_key(text, model)
+        self._remember(key, embedding)
+        if self.path:
+            self._disk_set(key, model, embedding)
+
+    async def aset(self, text, model, embedding):
+        key = cache_key(text, model)
+        self._remember(key, embedding)
+        if self.path:
+            await asyncio.to_thread(self._disk_set, key, model, embedding)
+
+    def _trim_disk(self, conn):
+        count = conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        if count > self.disk_max:
+            conn.execute(
+                'DELETE FROM embeddings WHERE key IN '
+                '(SELECT key FROM embeddings ORDER BY used_at LIMIT ?)',
+                (count - self.disk_max,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            self._connection().execute('DELETE FROM embeddings')
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_size': len(self._memory),
+            }
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,167 @@
+# chat/history.py
+#
+# Keeps the prompt flat for long conversations. The most recent messages are
+# forwarded verbatim (at most HISTORY_MAX_MESSAGES, within
+# HISTORY_TOKEN_BUDGET); everything older is replaced by a rolling summary.
+#
+# Older messages are folded in steps of HISTORY_SUMMARY_STEP so the fold
+# points stay stable from turn to turn, and summaries are cached by a hash of
+# the conversation prefix they cover. A new summary extends the previous one
+# and is computed in a background thread: the request never waits for it and
+# meanwhile uses the latest cached summary plus the unsummarized messages, or
+# only the recent messages when that would exceed the budget.
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+from . import upstream
+from .admission import admission
+from .openai_api import OPENAI_CHAT_URL, openai_headers
+from .tokens import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+HISTORY_MAX_MESSAGES = config('HISTORY_MAX_MESSAGES', default=8, cast=int)
+HISTORY_TOKEN_BUDGET = config('HISTORY_TOKEN_BUDGET', default=1500, cast=int)
+HISTORY_SUMMARY_ENABLED = config('HISTORY_SUMMARY_ENABLED', default=True, cast=bool)
+HISTORY_SUMMARY_STEP = config('HISTORY_SUMMARY_STEP', default=4, cast=int)
+HISTORY_SUMMARY_MODEL = config('HISTORY_SUMMARY_MODEL', default='gpt-4o-mini')
+HISTORY_SUMMARY_CACHE_SIZE = config('HISTORY_SUMMARY_CACHE_SIZE', default=1024, cast=int)
+
+SUMMARY_PROMPT = """
+Summarize this conversation between a user and ISHEMA RYANJYE, a sexual and reproductive health, mental health and card game support chatbot.
+Keep what the user shared about their situation, the questions they asked, the answers already given and anything still open.
+Write in the language of the conversation, in at most 120 words.
+"""
+
+
+def prefix_keys(messages, stop, step):
+    """Hash of messages[:c] for every fold point c = step, 2*step, ... and c = stop"""
+    digest = hashlib.sha256()
+    keys = {}
+    for i, message in enumerate(messages[:stop], 1):
+        digest.update(json.dumps([message.get('role'), message.get('content')], ensure_ascii=False).encode('utf-8'))
+        if i % step == 0 or i == stop:
+            keys[i] = digest.hexdigest()
+    return keys
+
+
+class HistoryManager:
+    def __init__(self, max_messages=HISTORY_MAX_MESSAGES, token_budget=HISTORY_TOKEN_BUDGET,
+                 step=HISTORY_SUMMARY_STEP, summarize=HISTORY_SUMMARY_ENABLED, max_entries=HISTORY_SUMMARY_CACHE_SIZE):
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.step = max(step, 1)
+        self.summarize = summarize
+        self.max_entries = max_entries
+        self.summaries = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='history-summary')
+
+    def fold_point(self, messages, model='gpt-4o'):
+        """Number of leading messages to replace by a summary"""
+        cut = max(0, len(messages) - self.max_messages)
+        cut -= cut % self.step
+        last = len(messages) - 1
+        while cut < last and count_message_tokens(messages[cut:], model) > self.token_budget:
+            cut = min(cut + self.step, last)
+        return cut
+
+    def _cached(self, keys, cut):
+        """Latest cached (summary, covered) at or before `cut`"""
+        with self._lock:
+            for covered in sorted((c for c in keys if c <= cut), reverse=True):
+                summary = self.summaries.get(keys[covered])
+                if summary is not None:
+                    self.summaries.move_to_end(keys[covered])
+                    return summary, covered
+        return None, 0
+
+    def _store(self, key, summary):
+        with self._lock:
+            self.summaries[key] = summary
+            self.summaries.move_to_end(key)
+            while len(self.summaries) > self.max_entries:
+                self.summaries.popitem(last=False)
+
+    def window(self, messages, model='gpt-4o'):
+        """Messages to send upstream: a summary message (when one is cached)
+        followed by the messages it does not cover. Without a summary, or
+        when the cached one lags too far behind, only the messages after the
+        fold point are sent, so the prompt stays bounded even if summarizing
+        keeps failing."""
+        cut = self.fold_point(messages, model)
+        if not cut:
+            return messages
+        if not self.summarize:
+            return messages[cut:]
+
+        keys = prefix_keys(messages, cut, self.step)
+        summary, covered = self._cached(keys, cut)
+        if covered < cut:
+            self._schedule(messages[:cut], keys)
+        if not summary:
+            return messages[cut:]
+        recent = messages[covered:]
+        if covered < cut and count_message_tokens(recent, model) > self.token_budget:
+            recent = messages[cut:]
+        return [
+            {'role': 'system', 'content': f'Summary of the earlier conversation: {summary}'},
+            *recent
+        ]
+
+    def _schedule(self, older, keys):
+        key = keys[len(older)]
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._executor.submit(self._summarize, older, keys)
+
+    def _summarize(self, older, keys):
+        key = keys[len(older)]
+        try:
+            summary, covered = self._cached(keys, len(older) - 1)
+            self._store(key, summarize_messages(older[covered:], summary))
+        except Exception as e:
+            logger.warning('History summary failed: %s', e)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+
+def summarize_messages(messages, previous_summary=None):
+    """Extend `previous_summary` with `messages` using HISTORY_SUMMARY_MODEL"""
+    transcript = '\n'.join(f"{m.get('role')}: {m.get('content')}" for m in messages)
+    if previous_summary:
+        transcript = f'Summary so far: {previous_summary}\n\nLater messages:\n{transcript}'
+    # Summaries can wait for a later turn: never queue behind chat traffic
+    with admission.slot('openai', HISTORY_SUMMARY_MODEL, wait=False):
+        response = upstream.post(
+            'openai',
+            OPENAI_CHAT_URL,
+            json={
+                'model': HISTORY_SUMMARY_MODEL,
+                'messages': [
+                    {'role': 'system', 'content': SUMMARY_PROMPT},
+                    {'role': 'user', 'content': transcript}
+                ],
+                'temperature': 0.1,
+                'max_tokens': 200
+            },
+            headers=openai_headers()
+        )
+    if response.status_code != 200:
+        raise Exception(f"OpenAI summary error: {response.status_code}")
+    return response.json()['choices'][0]['message']['content'].strip()
+
+
+history_manager = HistoryManager()
@@ -0,0 +1,283 @@
+# chat/ingestion.py
+#
+# Bulk embedding and upsert for the ingestion scripts. Records stream through
+# in embedding batches (many inputs per OpenAI call) processed by a bounded
+# thread pool, and each batch is upserted in chunks of UPSERT_BATCH_SIZE, so
+# memory stays flat however large the corpus is.
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+from .chunk_store import CHUNK_STORE_PATH, ChunkStore
+from .lexical import LEXICAL_INDEX_PATH, update_lexical_index
+from .openai_api import embed_batch
+from .tagging import chunk_tags
+from .vectorstore import UPSERT_BATCH_SIZE, batched, get_vector_store
+
+EMBED_BATCH_SIZE = config('EMBED_BATCH_SIZE', default=100, cast=int)
+INGEST_CONCURRENCY = config('INGEST_CONCURRENCY', default=4, cast=int)
+# Seconds between throughput lines
+PROGRESS_INTERVAL = 5
+
+
+def to_chunk(record):
+    return {
+        'id': record['id'],
+        'metadata': {**(record.get('metadata') or {}), 'text': record['text']},
+    }
+
+
+def to_vector(record, values):
+    return {**to_chunk(record), 'values': values}
+
+
+def ingest(records, store=None, namespace=None, embed_batch_size=EMBED_BATCH_SIZE,
+           upsert_batch_size=UPSERT_BATCH_SIZE, concurrency=INGEST_CONCURRENCY, log=print,
+           checkpoint=None, flush=True):
+    """Embed and upsert `records` ({'id', 'text', 'metadata'}); return the count.
+
+    At most 2 x `concurrency` embedding batches are in flight at a time. With a
+    `checkpoint` (chat/checkpoints.py), every embedded and upserted batch is
+    recorded and a rerun skips the work already done. `flush=False` leaves
+    the store's buffered writes for the caller to flush.
+    """
+    store = store or get_vector_store()
+
+    def upsert(vectors):
+        for chunk in batched(vectors, upsert_batch_size):
+            store.upsert(chunk, namespace=namespace)
+            if checkpoint:
+                checkpoint.append_upserted([v['id'] for v in chunk])
+
+    def process(batch):
+        values = embed_batch([r['text'] for r in batch])
+        if checkpoint:
+            checkpoint.append_embeddings([r['id'] for r in batch], values)
+        upsert([to_vector(r, v) for r, v in zip(batch, values)])
+        return len(batch)
+
+    if checkpoint:
+        records = resume(records, checkpoint, upsert, log)
+
+    started = last_log = time.perf_counter()
+    done = 0
+
+    def collect(futures):
+        nonlocal done, last_log
+        for future in futures:
+            done += future.result()
+        now = time.perf_counter()
+        if now - last_log >= PROGRESS_INTERVAL:
+            last_log = now
+            log(f"  {done} chunks embedded and upserted ({done / (now - started):.1f} chunks/s)")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = set()
+        for batch in batched(records, embed_batch_size):
+            if len(pending) >= concurrency * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending.add(pool.submit(process, batch))
+        if pending:
+            collect(wait(pending)[0])
+
+    if flush:
+        store.flush()
+    elapsed = time.perf_counter() - started
+    log(f"Ingested {done} chunks in {elapsed:.2f}s ({done / elapsed if elapsed else 0:.1f} chunks/s)")
+    return done
+
+
+def resume(records, checkpoint, upsert, log=print):
+    """Upsert vectors embedded by an interrupted run; return the records still to embed"""
+    records = {record['id']: record for record in records}
+    upserted = checkpoint.upserted_ids()
+    embedded = set()
+    leftover = []
+    for vector_id, values in checkpoint.iter_embeddings():
+        embedded.add(vector_id)
+        if vector_id in records and vector_id not in upserted:
+            leftover.append(to_vector(records[vector_id], values))
+    if embedded:
+        log(f"Resuming: {len(embedded)} chunks already embedded, {len(leftover)} of them still to upsert")
+    if leftover:
+        upsert(leftover)
+    return [record for vector_id, record in records.items() if vector_id not in embedded]
+
+
+# Incremental sync
+#
+# Chunk IDs are derived from the document name and a hash of the chunk text,
+# so re-ingesting an unchanged chunk produces the same ID. A local manifest
+# records which IDs each document has in each store; a sync only embeds the
+# IDs that are new and deletes the ones that disappeared.
+
+INGEST_MANIFEST_PATH = config('INGEST_MANIFEST_PATH', default='ingest_manifest.json')
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def document_key(document):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', os.path.basename(document)) or 'document'
+
+
+def chunk_id(document, text):
+    return f'{document_key(document)}-{content_hash(text)[:24]}'
+
+
+class Manifest:
+    def __init__(self, path=INGEST_MANIFEST_PATH):
+        self.path = path
+        self.data = {'version': 1, 'stores': {}}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def _documents(self, store, namespace):
+        store_key = f'{store.key()}#{namespace or ""}'
+        return self.data['stores'].setdefault(store_key, {'documents': {}})['documents']
+
+    def ids(self, store, namespace, document):
+        return set(self._documents(store, namespace).get(document, {}).get('ids', []))
+
+    def documents(self, store, namespace):
+        return list(self._documents(store, namespace))
+
+    def record(self, store, namespace, document, ids):
+        with self._lock:
+            documents = self._documents(store, namespace)
+            if ids:
+                documents[document] = {'ids': sorted(ids), 'updated_at': time.time()}
+            else:
+                documents.pop(document, None)
+            self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class SyncBatch:
+    """Writes that syncing several documents does once at the end rather than
+    per document: the store flush (a full snapshot write for the local
+    backend) and the lexical index rewrite, then the chunk store deletions,
+    manifest entries and checkpoint cleanup that must follow them."""
+
+    def __init__(self, store, manifest, namespace=None, lexical_path=LEXICAL_INDEX_PATH,
+                 chunk_path=CHUNK_STORE_PATH):
+        self.store = store
+        self.manifest = manifest
+        self.namespace = namespace
+        self.lexical_path = lexical_path
+        self.chunks = ChunkStore(chunk_path) if chunk_path else None
+        self._reset()
+
+    def _reset(self):
+        self.lexical = {}
+        self.removed = set()
+        self.documents = {}
+        self.checkpoints = []
+
+    def add(self, document, records, removed, checkpoint=None):
+        self.documents[document] = set(records)
+        self.lexical.update((vector_id, to_chunk(record)) for vector_id, record in records.items())
+        self.removed.update(removed)
+        if checkpoint:
+            self.checkpoints.append(checkpoint)
+
+    def finish(self):
+        self.store.flush()
+        removed = self.removed - set(self.lexical)
+        if self.lexical_path and (self.lexical or removed):
+            update_lexical_index(self.lexical_path, list(self.lexical.values()), removed)
+        if self.chunks is not None and removed:
+            self.chunks.delete(removed)
+        # Only once everything is stored, so an interrupted run redoes the work
+        for document, ids in self.documents.items():
+            self.manifest.record(self.store, self.namespace, document, ids)
+        for checkpoint in self.checkpoints:
+            checkpoint.clear()
+        self._reset()
+
+
+def sync_document(document, chunks, store=None, manifest=None, namespace=None, log=print,
+                  checkpoint=None, lexical_path=LEXICAL_INDEX_PATH, chunk_path=CHUNK_STORE_PATH, batch=None,
+                  **ingest_options):
+    """Bring `document`'s chunks ((text, metadata) pairs) up to date in the store.
+
+    The manifest is only updated once everything is stored, so an interrupted
+    sync recomputes the same work and `checkpoint` lets it skip what is done.
+    With `lexical_path`, the lexical index (chat/lexical.py) gets all of the
+    document's chunks, unchanged ones included, so it fills on the first sync;
+    the same goes for the chunk store (chat/chunk_store.py) with `chunk_path`.
+    With a `batch` (SyncBatch), its store, manifest and paths are used and the
+    final writes wait for batch.finish(). Returns (added, removed, unchanged) counts.
+    """
+    if batch is None:
+        store = store or get_vector_store()
+        manifest = manifest if manifest is not None else Manifest()
+        own_batch = SyncBatch(store, manifest, namespace, lexical_path, chunk_path)
+    else:
+        store, manifest, namespace, own_batch = batch.store, batch.manifest, batch.namespace, None
+    batch = batch or own_batch
+
+    records = {}
+    for text, metadata in chunks:
+        vector_id = chunk_id(document, text)
+        records.setdefault(vector_id, {
+            'id': vector_id,
+            'text': text,
+            'metadata': {**chunk_tags(text), **(metadata or {}), 'source': document},
+        })
+
+    known = manifest.ids(store, namespace, document)
+    added = [record for vector_id, record in records.items() if vector_id not in known]
+    removed = sorted(known - set(records))
+
+    if batch.chunks is not None:
+        # Before the upsert: ID-only queries must find the text of every match
+        batch.chunks.put(to_chunk(r) for r in records.values())
+    if added:
+        ingest(added, store=store, namespace=namespace, log=log, checkpoint=checkpoint, flush=False,
+               **ingest_options)
+    if removed:
+        store.delete(removed, namespace=namespace)
+    batch.add(document, records, removed, checkpoint)
+    if own_batch:
+        own_batch.finish()
+
+    unchanged = len(records) - len(added)
+    log(f"{document}: {len(added)} added, {len(removed)} removed, {unchanged} unchanged")
+    return len(added), len(removed), unchanged
+
+
+def sync_documents(documents, store=None, manifest=None, namespace=None, prune=False, log=print, **ingest_options):
+    """Sync several documents ({name: chunks}); with `prune`, documents that are
+    in the manifest but not in `documents` are removed from the store."""
+    store = store or get_vector_store()
+    manifest = manifest if manifest is not None else Manifest()
+    batch = SyncBatch(store, manifest, namespace)
+    totals = [0, 0, 0]
+    for document, chunks in documents.items():
+        for i, count in enumerate(sync_document(document, chunks, log=log, batch=batch, **ingest_options)):
+            totals[i] += count
+    if prune:
+        for document in set(manifest.documents(store, namespace)) - set(documents):
+            totals[1] += sync_document(document, [], log=log, batch=batch)[1]
+    batch.finish()
+    return tuple(totals)
@@ -0,0 +1,40 @@
+# chat/language.py
+#
+# Cheap language guess for the three languages the bot serves (English,
+# Kinyarwanda, French), used where no model call is wanted: picking a
+# degraded-response template, tagging chunks at ingestion and filtering
+# retrieval (chat/tagging.py). Counts common function words per language.
+
+import re
+
+from .embedding_cache import normalize_text
+
+LANGUAGES = ('en', 'rw', 'fr')
+DEFAULT_LANGUAGE = 'en'
+
+MARKERS = {
+    'en': {
+        'the', 'is', 'are', 'what', 'how', 'why', 'when', 'where', 'who', 'do', 'does', 'can', 'i', 'you',
+        'my', 'to', 'and', 'of', 'in', 'it', 'a', 'an', 'about', 'with', 'for', 'hello', 'hi', 'please',
+    },
+    'rw': {
+        'ni', 'iki', 'ibiki', 'gute', 'kuki', 'ryari', 'he', 'nde', 'kandi', 'cyangwa', 'ariko', 'muri',
+        'mu', 'ku', 'na', 'nka', 'ese', 'ndashaka', 'nshaka', 'nabwirwa', 'nakora', 'amakuru', 'muraho',
+        'mwaramutse', 'mwiriwe', 'murakoze', 'urakoze', 'yego', 'oya', 'ubuzima', 'imyororokere', 'umukino',
+        'amakarita', 'ndi', 'mfite', 'ufite', 'afite', 'byose', 'cyane', 'neza', 'iyi', 'uyu', 'aya', 'izi',
+        'nigute', 'niki', 'ninde', 'kubera', 'bite', 'nkeneye', 'nshobora', 'ushobora', 'nakoresha',
+    },
+    'fr': {
+        'le', 'la', 'les', 'est', 'sont', 'que', 'quoi', 'comment', 'pourquoi', 'quand', 'où', 'qui', 'je',
+        'vous', 'tu', 'nous', 'mon', 'ma', 'mes', 'des', 'une', 'un', 'du', 'et', 'pour', 'avec', 'dans',
+        'bonjour', 'salut', 'merci', 'jeu', 'cartes', 'santé', 'ce', 'cette', 'pas', 'qu',
+    },
+}
+
+
+def detect_language(text, default=DEFAULT_LANGUAGE):
+    """'en', 'rw' or 'fr' by marker-word count; `default` when nothing matches"""
+    words = re.findall(r"[^\W\d_]+", normalize_text(text or ''))
+    scores = {lang: sum(word in MARKERS[lang] for word in words) for lang in LANGUAGES}
+    best = max(LANGUAGES, key=lambda lang: scores[lang])
+    return best if scores[best] else default
@@ -0,0 +1,228 @@
+# chat/lexical.py
+#
+# BM25 inverted index over the ingested chunks, searched next to the vector
+# store. Dense retrieval often scores exact Kinyarwanda terms (card names,
+# game rules) under the similarity cutoff; a lexical match on the rare words
+# of the question finds those chunks anyway, and still works when the
+# embedding call is slow or down.
+#
+# The index is written at ingestion time (chat/ingestion.py) or exported from
+# the vector store (manage.py build_lexical_index) into LEXICAL_INDEX_PATH:
+# lexical.npz holds the postings as flat arrays (document numbers and term
+# frequencies, sliced per term by an offsets table) and lexical.json holds
+# the vocabulary and the chunks. Workers reload it when the files change.
+
+import json
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+from decouple import AutoConfig
+config = AutoConfig()
+
+from .embedding_cache import normalize_text
+from .metrics import LEXICAL_QUERY_SECONDS
+from .tagging import filter_key, matches_filter
+
+logger = logging.getLogger(__name__)
+
+LEXICAL_INDEX_PATH = config('LEXICAL_INDEX_PATH', default='')
+# Share of the question's IDF weight a chunk must match to be used as context
+LEXICAL_THRESHOLD = config('LEXICAL_THRESHOLD', default=0.5, cast=float)
+LEXICAL_TOP_K = config('LEXICAL_TOP_K', default=20, cast=int)
+# Reciprocal rank fusion constant: higher flattens the rank differences
+HYBRID_RRF_K = config('HYBRID_RRF_K', default=60, cast=int)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+POSTINGS_FILE = 'lexical.npz'
+TERMS_FILE = 'lexical.json'
+
+
+def tokenize(text):
+    return re.findall(r'[^\W_]+', normalize_text(text or ''))
+
+
+def chunk_text(chunk):
+    metadata = chunk.get('metadata') or {}
+    return metadata.get('text') or metadata.get('content') or metadata.get('page_content') or ''
+
+
+def write_lexical_index(path, chunks):
+    """Write an index for `chunks` ({'id', 'metadata'} with the text in metadata)"""
+    os.makedirs(path, exist_ok=True)
+    chunks = [{'id': c['id'], 'metadata': c.get('metadata') or {}} for c in chunks]
+
+    postings = {}
+    lengths = np.zeros(len(chunks), dtype=np.uint32)
+    for doc, chunk in enumerate(chunks):
+        tokens = tokenize(chunk_text(chunk))
+        lengths[doc] = len(tokens)
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            postings.setdefault(token, []).append((doc, count))
+
+    terms = sorted(postings)
+    offsets = np.zeros(len(terms) + 1, dtype=np.uint32)
+    for i, term in enumerate(terms):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    flat = [posting for term in terms for posting in postings[term]]
+    docs = np.array([doc for doc, _ in flat], dtype=np.min_scalar_type(max(len(chunks) - 1, 0)))
+    tfs = np.array([min(count, 0xFFFF) for _, count in flat], dtype=np.uint16)
+
+    tmp_postings = os.path.join(path, f'.{POSTINGS_FILE}.tmp')
+    with open(tmp_postings, 'wb') as f:
+        np.savez(f, offsets=offsets, docs=docs, tfs=tfs, lengths=lengths)
+    tmp_terms = os.path.join(path, f'.{TERMS_FILE}.tmp')
+    with open(tmp_terms, 'w', encoding='utf-8') as f:
+        json.dump({'terms': terms, 'chunks': chunks}, f, ensure_ascii=False)
+
+    os.replace(tmp_postings, os.path.join(path, POSTINGS_FILE))
+    os.replace(tmp_terms, os.path.join(path, TERMS_FILE))
+
+
+def update_lexical_index(path, records, deleted=()):
+    """Add or replace chunks ({'id', 'metadata'}) and drop `deleted` IDs, then rewrite"""
+    try:
+        chunks = {c['id']: c for c in LexicalIndex(path).chunks}
+    except FileNotFoundError:
+        chunks = {}
+    for record in records:
+        chunks[record['id']] = record
+    for chunk_id in deleted:
+        chunks.pop(chunk_id, None)
+    write_lexical_index(path, list(chunks.values()))
+    return len(chunks)
+
+
+class LexicalIndex:
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(path, POSTINGS_FILE)) as arrays:
+            self.offsets = arrays['offsets']
+            self.docs = arrays['docs']
+            self.tfs = arrays['tfs'].astype(np.float32)
+            lengths = arrays['lengths'].astype(np.float32)
+        with open(os.path.join(path, TERMS_FILE), encoding='utf-8') as f:
+            data = json.load(f)
+        self.chunks = data['chunks']
+        if len(self.chunks) != len(lengths) or len(data['terms']) + 1 != len(self.offsets):
+            raise ValueError(f'Lexical index at {path} is inconsistent')
+        self.vocabulary = {term: i for i, term in enumerate(data['terms'])}
+
+        # Per-term IDF and per-document length norm, so a query only adds up
+        df = np.diff(self.offsets).astype(np.float32)
+        n = len(self.chunks)
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+        self.mean_idf = float(self.idf.mean()) if len(self.idf) else 0.0
+        average = lengths.mean() if n else 1.0
+        self.norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (average or 1.0))
+        self._masks = {}
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def mask(self, filter):
+        """Which chunks match `filter`, computed once per filter"""
+        key = filter_key(filter)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = self._masks[key] = np.array(
+                [matches_filter(c['metadata'], filter) for c in self.chunks], dtype=bool)
+        return mask
+
+    def search(self, text, top_k=LEXICAL_TOP_K, include_metadata=True, filter=None):
+        """Pinecone-style matches by BM25, scored as a share of the question's
+        total IDF (about 1.0 when every term occurs once in an average chunk)"""
+        words = set(tokenize(text))
+        terms = [self.vocabulary[t] for t in words if t in self.vocabulary]
+        if not terms:
+            return []
+        # Words missing from the corpus weigh as much as a typical word, so
+        # a few common words alone ("how do I ...") do not make a match
+        total_idf = self.idf[terms].sum() + (len(words) - len(terms)) * self.mean_idf
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term in terms:
+            start, end = self.offsets[term], self.offsets[term + 1]
+            docs, tfs = self.docs[start:end], self.tfs[start:end]
+            # A term appears once per document, so fancy-index += is safe
+            scores[docs] += self.idf[term] * tfs * (BM25_K1 + 1) / (tfs + self.norms[docs])
+        scores /= total_idf
+        if filter:
+            scores[~self.mask(filter)] = 0
+
+        hits = np.flatnonzero(scores)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        hits = hits[np.argsort(-scores[hits])]
+
+        matches = []
+        for i in hits:
+            match = {'id': self.chunks[i]['id'], 'score': float(scores[i])}
+            if include_metadata:
+                match['metadata'] = self.chunks[i]['metadata']
+            matches.append(match)
+        return matches
+
+
+class LexicalSearch:
+    """The index at LEXICAL_INDEX_PATH, reloaded when it is rewritten"""
+
+    def __init__(self, path=LEXICAL_INDEX_PATH):
+        self.path = path
+        self._index = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def index(self):
+        if not self.path:
+            return None
+        try:
+            mtime = os.stat(os.path.join(self.path, TERMS_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    try:
+                        self._index = LexicalIndex(self.path)
+                    except (OSError, ValueError, KeyError) as e:
+                        # Caught mid-rewrite; the next query retries
+                        logger.warning('Failed to load lexical index: %s', e)
+                        return self._index
+                    self._mtime = mtime
+        return self._index
+
+    def search(self, text, top_k=LEXICAL_TOP_K, filter=None):
+        """Matches at or above LEXICAL_THRESHOLD, or None without an index.
+        A `filter` that leaves nothing falls back to the whole index."""
+        index = self.index()
+        if index is None:
+            return None
+        with LEXICAL_QUERY_SECONDS.time():
+            matches = [m for m in index.search(text, top_k, filter=filter) if m['score'] >= LEXICAL_THRESHOLD]
+            if filter and not matches:
+                matches = [m for m in index.search(text, top_k) if m['score'] >= LEXICAL_THRESHOLD]
+        return matches
+
+
+lexical_search = LexicalSearch()
+
+
+def fuse(vector_matches, lexical_matches, k=HYBRID_RRF_K):
+    """Merge two ranked match lists by reciprocal rank fusion.
+
+    Both lists should already be cut to their own thresholds; the returned
+    matches carry the fused score instead of the similarity.
+    """
+    fused = {}
+    for matches in (vector_matches, lexical_matches):
+        for rank, match in enumerate(sorted(matches, key=lambda m: m.get('score', 0), reverse=True)):
+            entry = fused.setdefault(match['id'], {**match, 'score': 0.0})
+            entry['score'] += 1 / (k + rank + 1)
+    return sorted(fused.values(), key=lambda m: m['score'], reverse=True)
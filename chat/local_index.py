@@ -0,0 +1,201 @@
+# chat/local_index.py
+#
+# In-process replacement for the Pinecone query. The index is a single-file
+# snapshot (chat/snapshot.py) of float32 vectors, normalized when written,
+# and the chunks; it is memory-mapped when read, so workers share the pages
+# and a query is one matrix-vector product. Large indexes also get an IVF
+# index with int8 codes (chat/ann.py) and are only scanned in part.
+#
+# Rows are stored grouped by their language/topic tags, with the group
+# boundaries in the snapshot, so a filtered scan reads a few contiguous
+# slices of the shared mapping instead of the whole matrix.
+
+import json
+import logging
+import os
+import threading
+from collections import Counter
+
+import numpy as np
+
+from .ann import LOCAL_ANN, LOCAL_ANN_MIN_VECTORS, IvfIndex, build_ivf
+from .snapshot import Snapshot, read_current, write_snapshot
+from .tagging import TAG_FIELDS, filter_key, matches_filter
+
+logger = logging.getLogger(__name__)
+
+# Layout written before snapshots; still readable so an upgrade keeps working
+LEGACY_VECTORS_FILE = 'vectors.npy'
+LEGACY_CHUNKS_FILE = 'chunks.json'
+LEGACY_FILES = (LEGACY_VECTORS_FILE, LEGACY_CHUNKS_FILE, 'ann_codes.npy', 'ann_lists.npz')
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def group_rows(metadatas):
+    """(row order that makes each tag group contiguous, group sections)"""
+    keys = [tuple(str((metadata or {}).get(field) or '') for field in TAG_FIELDS) for metadata in metadatas]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    counts = Counter(keys)
+    groups = sorted(counts)
+    arrays = {'group_offsets': np.concatenate([[0], np.cumsum([counts[g] for g in groups])]).astype(np.int64)}
+    for i, field in enumerate(TAG_FIELDS):
+        arrays[f'group_{field}'] = np.array([g[i] for g in groups], dtype=str)
+    return order, arrays
+
+
+def write_local_index(path, ids, vectors, metadatas, ann=None):
+    """Write and publish a new snapshot of the index in `path`; return its version.
+
+    `ann` builds the IVF index; by default when LOCAL_ANN is on and there
+    are at least LOCAL_ANN_MIN_VECTORS vectors.
+    """
+    order, groups = group_rows(metadatas)
+    if len(ids):
+        matrix = normalize_rows(vectors).reshape(len(ids), -1)[order]
+    else:
+        # Every vector was deleted: publish an empty index
+        matrix = np.zeros((0, 0), dtype=np.float32)
+        ann = False
+    if ann is None:
+        ann = LOCAL_ANN and len(ids) >= LOCAL_ANN_MIN_VECTORS
+    arrays = {'vectors': matrix, **groups}
+    if ann:
+        arrays.update(build_ivf(matrix))
+    chunks = [{'id': ids[i], 'metadata': metadatas[i] or {}} for i in order]
+    version = write_snapshot(path, arrays, chunks)
+    for name in LEGACY_FILES:
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    return version
+
+
+class LocalVectorIndex:
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        arrays = {}
+        if read_current(path) or not os.path.exists(os.path.join(path, LEGACY_VECTORS_FILE)):
+            snapshot = Snapshot.current(path)
+            self.version = snapshot.version
+            arrays = snapshot.arrays
+            self.vectors = arrays['vectors']
+            self.chunks = snapshot.records
+        else:
+            self.vectors = np.load(os.path.join(path, LEGACY_VECTORS_FILE), mmap_mode='r')
+            with open(os.path.join(path, LEGACY_CHUNKS_FILE), encoding='utf-8') as f:
+                self.chunks = json.load(f)
+        if len(self.chunks) != len(self.vectors):
+            raise ValueError(f'Local index at {path} is inconsistent: '
+                             f'{len(self.vectors)} vectors, {len(self.chunks)} chunks')
+        self.groups = None
+        if 'group_offsets' in arrays:
+            tags = zip(*(arrays[f'group_{field}'] for field in TAG_FIELDS))
+            # Untagged rows are stored under '' and match like a missing field
+            self.groups = (arrays['group_offsets'],
+                           [{field: value or None for field, value in zip(TAG_FIELDS, values)} for values in tags])
+        self.ann = None
+        if LOCAL_ANN:
+            try:
+                self.ann = IvfIndex.load(arrays, len(self.chunks))
+            except (KeyError, ValueError) as e:
+                logger.warning('Ignoring the ANN index, searching exactly: %s', e)
+        self._masks = {}
+        self._ranges = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def ranges(self, filter):
+        """(row ranges, row numbers) matching `filter`, computed once per
+        filter; None for indexes written before rows were grouped"""
+        if self.groups is None:
+            return None
+        key = filter_key(filter)
+        cached = self._ranges.get(key)
+        if cached is None:
+            offsets, tags = self.groups
+            ranges = []
+            for i, group in enumerate(tags):
+                start, end = int(offsets[i]), int(offsets[i + 1])
+                if start == end or not matches_filter(group, filter):
+                    continue
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1] = (ranges[-1][0], end)
+                else:
+                    ranges.append((start, end))
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges]) if ranges else \
+                np.zeros(0, dtype=np.int64)
+            cached = (ranges, rows)
+            with self._lock:
+                self._ranges[key] = cached
+        return cached
+
+    def mask(self, filter):
+        """Which rows match `filter`, computed once per filter"""
+        key = filter_key(filter)
+        mask = self._masks.get(key)
+        if mask is None:
+            ranges = self.ranges(filter)
+            if ranges is None:
+                mask = np.array([matches_filter(c['metadata'], filter) for c in self.chunks], dtype=bool)
+            else:
+                mask = np.zeros(len(self.chunks), dtype=bool)
+                mask[ranges[1]] = True
+            with self._lock:
+                self._masks[key] = mask
+        return mask
+
+    def exact(self, query, top_k, filter=None):
+        """(row numbers, scores) of the best `top_k` rows by a full scan.
+
+        A filtered scan reads the matching slices of the mapped matrix; older
+        indexes without row groups score everything and keep the matching rows.
+        """
+        rows = None
+        if filter:
+            grouped = self.ranges(filter)
+            if grouped is None:
+                rows = np.flatnonzero(self.mask(filter))
+                scores = (self.vectors @ query)[rows] if len(rows) else np.zeros(0, dtype=np.float32)
+            else:
+                ranges, rows = grouped
+                scores = np.concatenate([self.vectors[start:end] @ query for start, end in ranges]) if ranges else \
+                    np.zeros(0, dtype=np.float32)
+        else:
+            scores = self.vectors @ query
+        if not len(scores):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return (top if rows is None else rows[top]), scores[top]
+
+    def search(self, query, top_k, filter=None):
+        """(row numbers, scores), through the ANN index when there is one"""
+        if self.ann is not None:
+            rows, scores = self.ann.search(query, self.vectors, top_k, mask=self.mask(filter) if filter else None)
+            # Too few candidates in the probed clusters (e.g. a narrow filter)
+            if len(rows) >= min(top_k, len(self.chunks)):
+                return rows, scores
+        return self.exact(query, top_k, filter)
+
+    def query(self, vector, top_k=50, include_metadata=True, filter=None):
+        """Return Pinecone-style matches ordered by cosine similarity"""
+        if not len(self.chunks):
+            return []
+        rows, scores = self.search(normalize_rows(vector), top_k, filter)
+
+        matches = []
+        for i, score in zip(rows, scores):
+            match = {'id': self.chunks[i]['id'], 'score': float(score)}
+            if include_metadata:
+                match['metadata'] = self.chunks[i]['metadata']
+            matches.append(match)
+        return matches
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.chunk_store import CHUNK_STORE_PATH, ChunkStore
+from chat.vectorstore import VECTOR_BACKEND, batched, get_vector_store
+
+
+class Command(BaseCommand):
+    help = 'Copy chunk texts and metadata from the vector store into the local chunk store (VECTOR_QUERY_IDS_ONLY)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=CHUNK_STORE_PATH,
+                            help='SQLite file to write (default: CHUNK_STORE_PATH)')
+        parser.add_argument('--source', choices=['pinecone', 'local'], default=None,
+                            help='Vector store to copy from (default: VECTOR_BACKEND)')
+        parser.add_argument('--namespace', default=None)
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Pass --output or set CHUNK_STORE_PATH')
+        store = get_vector_store(options['source'] or VECTOR_BACKEND)
+        if not hasattr(store, 'iter_vectors'):
+            raise CommandError(f'Cannot list the vectors of {type(store).__name__}')
+
+        chunks = ChunkStore(options['output'])
+        seen = set()
+        try:
+            vectors = store.iter_vectors(options['namespace'], options['page_size'])
+            for batch in batched(vectors, 1000):
+                chunks.put({'id': v['id'], 'metadata': v.get('metadata') or {}} for v in batch)
+                seen.update(v['id'] for v in batch)
+                self.stdout.write(f'  copied {len(seen)} chunks')
+        except Exception as e:
+            raise CommandError(str(e))
+
+        stale = chunks.ids() - seen
+        chunks.delete(stale)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(seen)} chunks to {options['output']} ({len(stale)} stale chunks removed)"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.lexical import LEXICAL_INDEX_PATH, write_lexical_index
+from chat.local_index import LocalVectorIndex
+from chat.vectorstore import LOCAL_INDEX_PATH, VECTOR_BACKEND, PineconeRestStore
+
+
+class Command(BaseCommand):
+    help = 'Build the lexical (BM25) index from the chunks already in the vector store'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=LEXICAL_INDEX_PATH,
+                            help='Index directory to write (default: LEXICAL_INDEX_PATH)')
+        parser.add_argument('--source', choices=['pinecone', 'local'], default=None,
+                            help='Where to read the chunks from (default: VECTOR_BACKEND)')
+        parser.add_argument('--namespace', default=None)
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Pass --output or set LEXICAL_INDEX_PATH')
+
+        source = options['source'] or VECTOR_BACKEND
+        try:
+            if source == 'local':
+                chunks = LocalVectorIndex(LOCAL_INDEX_PATH).chunks
+            elif source == 'pinecone':
+                chunks = [
+                    {'id': vector['id'], 'metadata': vector.get('metadata') or {}}
+                    for vector in PineconeRestStore().iter_vectors(options['namespace'], options['page_size'])
+                ]
+            else:
+                raise CommandError(f"Cannot read chunks from the '{source}' backend")
+        except CommandError:
+            raise
+        except Exception as e:
+            raise CommandError(str(e))
+
+        if not chunks:
+            raise CommandError('No chunks found in the vector store')
+        write_lexical_index(options['output'], chunks)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {len(chunks)} chunks into {options['output']}"))
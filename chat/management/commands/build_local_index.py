@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.vectorstore import LOCAL_INDEX_PATH, LocalStore, PineconeRestStore
+
+
+class Command(BaseCommand):
+    help = 'Export the Pinecone index into a local index snapshot (VECTOR_BACKEND=local)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=LOCAL_INDEX_PATH,
+                            help='Index directory to write (default: LOCAL_INDEX_PATH)')
+        parser.add_argument('--namespace', default=None)
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        if not options['output']:
+            raise CommandError('Pass --output or set LOCAL_INDEX_PATH')
+
+        vectors = []
+        try:
+            for vector in PineconeRestStore().iter_vectors(options['namespace'], options['page_size']):
+                vectors.append(vector)
+                if len(vectors) % 1000 == 0:
+                    self.stdout.write(f'  fetched {len(vectors)} vectors')
+        except Exception as e:
+            raise CommandError(str(e))
+
+        if not vectors:
+            raise CommandError('No vectors found in the Pinecone index')
+        store = LocalStore(options['output'])
+        store.replace(vectors)
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {len(vectors)} vectors to {options['output']} (snapshot {store.index().version})"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from chat.conversations import CONVERSATION_TTL, conversation_store
+
+
+class Command(BaseCommand):
+    help = 'Delete session-mode conversations idle for longer than CONVERSATION_TTL'
+
+    def handle(self, *args, **options):
+        deleted = conversation_store.cleanup()
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} conversations idle for more than {CONVERSATION_TTL} seconds'
+        ))
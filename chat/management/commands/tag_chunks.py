@@ -0,0 +1,70 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.chunk_store import CHUNK_STORE_PATH, ChunkStore
+from chat.context import match_text
+from chat.lexical import LEXICAL_INDEX_PATH, LexicalIndex, write_lexical_index
+from chat.tagging import chunk_tags
+from chat.vectorstore import VECTOR_BACKEND, batched, get_vector_store
+
+
+def tagged(chunk, retag):
+    """`chunk` with language/topic tags added, or None if it needs no update"""
+    metadata = chunk.get('metadata') or {}
+    if not retag and 'language' in metadata and 'topic' in metadata:
+        return None
+    tags = chunk_tags(match_text(chunk) or '')
+    if not retag:
+        tags = {key: value for key, value in tags.items() if key not in metadata}
+    return {**chunk, 'metadata': {**metadata, **tags}}
+
+
+class Command(BaseCommand):
+    help = 'Add language and topic tags to chunks ingested before tagging (needed for RETRIEVAL_FILTERS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=['pinecone', 'local'], default=None,
+                            help='Vector store to update (default: VECTOR_BACKEND)')
+        parser.add_argument('--namespace', default=None)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--retag', action='store_true', help='Recompute tags that are already set')
+        parser.add_argument('--dry-run', action='store_true', help='Count the tags without writing them')
+
+    def handle(self, *args, **options):
+        store = get_vector_store(options['source'] or VECTOR_BACKEND)
+        if not hasattr(store, 'iter_vectors'):
+            raise CommandError(f'Cannot list the vectors of {type(store).__name__}')
+
+        languages, topics, updates = Counter(), Counter(), []
+        try:
+            for vector in store.iter_vectors(options['namespace'], options['page_size']):
+                update = tagged(vector, options['retag'])
+                metadata = (update or vector).get('metadata') or {}
+                languages[metadata.get('language')] += 1
+                topics[metadata.get('topic')] += 1
+                if update:
+                    updates.append(update)
+        except Exception as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f'Languages: {dict(languages)}')
+        self.stdout.write(f'Topics: {dict(topics)}')
+        if options['dry_run']:
+            self.stdout.write(f'{len(updates)} chunks would be updated')
+            return
+
+        for batch in batched(updates, options['page_size']):
+            store.upsert(batch, namespace=options['namespace'])
+        store.flush()
+        if CHUNK_STORE_PATH:
+            ChunkStore(CHUNK_STORE_PATH).put(updates)
+
+        if LEXICAL_INDEX_PATH:
+            try:
+                chunks = LexicalIndex(LEXICAL_INDEX_PATH).chunks
+            except FileNotFoundError:
+                chunks = None
+            if chunks:
+                write_lexical_index(LEXICAL_INDEX_PATH, [tagged(c, options['retag']) or c for c in chunks])
+        self.stdout.write(self.style.SUCCESS(f'Tagged {len(updates)} chunks'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.warmup import WARMUP_ANSWERS, WARMUP_FILE, run_warmup
+
+
+class Command(BaseCommand):
+    help = 'Precompute embeddings, context and optionally answers for the startup button prompts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--answers', action='store_true', default=WARMUP_ANSWERS,
+                            help='Also generate and store full answers')
+        parser.add_argument('--prompt', action='append', default=[],
+                            help='Extra prompt to precompute (repeatable)')
+        parser.add_argument('--output', default=WARMUP_FILE,
+                            help='File the workers load the warm set from (default: WARMUP_FILE)')
+
+    def handle(self, *args, **options):
+        try:
+            entries = run_warmup(answers=options['answers'], extra=options['prompt'], path=options['output'])
+        except Exception as e:
+            raise CommandError(f'Warmup failed: {e}')
+        for entry in entries:
+            status = 'answer' if entry['lines'] else ('context' if entry['context'] else 'no context')
+            self.stdout.write(f"  [{status}] {entry['prompt']}")
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(entries)} prompts to {options['output']}"))
+        else:
+            self.stdout.write(self.style.WARNING('No --output or WARMUP_FILE set; workers will not see this warm set'))
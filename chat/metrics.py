@@ -0,0 +1,192 @@
+# chat/metrics.py
+#
+# In-process metrics for the chat pipeline, rendered in the Prometheus text
+# format by the /chat-bot-metrics/ view. Each worker process keeps its own
+# numbers, so scrape every worker (or aggregate in Prometheus by instance).
+
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{_labels(key)} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{le="+Inf"}} {self.count}')
+            lines.append(f'{self.name}_sum {self.sum!r}')
+            lines.append(f'{self.name}_count {self.count}')
+        return lines
+
+
+class Gauge:
+    """Value read at scrape time from `collect`, which returns a number or a
+    {labels tuple: number} dict. `metric_type='counter'` exposes totals kept
+    elsewhere."""
+
+    def __init__(self, name, help_text, collect, metric_type='gauge'):
+        self.name = name
+        self.help = help_text
+        self.collect = collect
+        self.type = metric_type
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f'{self.name}{_labels(key)} {_number(value)}')
+        return lines
+
+
+registry = []
+
+
+def register(metric):
+    registry.append(metric)
+    return metric
+
+
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+EMBEDDING_SECONDS = register(Histogram(
+    'chat_embedding_seconds', 'OpenAI embedding request latency (cache misses only)'))
+VECTOR_QUERY_SECONDS = register(Histogram(
+    'chat_vector_query_seconds', 'Vector store query latency'))
+LEXICAL_QUERY_SECONDS = register(Histogram(
+    'chat_lexical_query_seconds', 'Lexical (BM25) index search latency',
+    (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)))
+TIME_TO_FIRST_TOKEN_SECONDS = register(Histogram(
+    'chat_time_to_first_token_seconds', 'Time from request start to the first streamed line'))
+STREAM_SECONDS = register(Histogram(
+    'chat_stream_seconds', 'Time from request start to the end of the stream'))
+STREAM_CHUNKS = register(Histogram(
+    'chat_stream_chunks', 'NDJSON lines streamed per response', (1, 5, 10, 25, 50, 100, 250, 500)))
+STREAM_BYTES = register(Histogram(
+    'chat_stream_bytes', 'Bytes streamed per response', (256, 1024, 4096, 16384, 65536)))
+CONTEXT_TOKENS = register(Histogram(
+    'chat_context_tokens', 'Tokens of retrieved context per request', (0, 100, 250, 500, 1000, 1500, 2000, 4000)))
+CONTEXT_CHUNKS = register(Histogram(
+    'chat_context_chunks', 'Retrieved chunks used per request', (0, 1, 2, 5, 10, 20, 50)))
+REQUESTS = register(Counter(
+    'chat_requests_total', 'Chat requests by how they were answered'))
+ERRORS = register(Counter(
+    'chat_errors_total', 'Errors in the chat pipeline by stage'))
+DEGRADED = register(Counter(
+    'chat_degraded_replies_total', 'Replies served from local templates instead of the model, by kind'))
+CHUNK_STORE_FALLBACKS = register(Counter(
+    'chat_chunk_store_fallbacks_total', 'ID-only vector queries repeated with metadata, by reason'))
+
+
+def _cache_gauges():
+    # Imported lazily so this module stays free of heavier dependencies
+    from .answer_cache import answer_cache
+    from .embedding_cache import embedding_cache
+
+    embedding, answer = embedding_cache.stats(), answer_cache.stats()
+    return {
+        (('cache', 'embedding'),): embedding['hit_rate'],
+        (('cache', 'answer'),): answer['hit_rate'],
+    }
+
+
+CACHE_HIT_RATE = register(Gauge('chat_cache_hit_rate', 'Hit rate since process start', _cache_gauges))
+
+
+def _admission_stats(field):
+    def collect():
+        from .admission import admission
+
+        return {
+            (('upstream', name), ('model', model or '')): stats[field]
+            for (name, model), stats in admission.stats().items()
+        }
+    return collect
+
+
+UPSTREAM_IN_FLIGHT = register(Gauge(
+    'chat_upstream_in_flight', 'Upstream calls holding an admission slot', _admission_stats('active')))
+UPSTREAM_QUEUED = register(Gauge(
+    'chat_upstream_queued', 'Upstream calls waiting for an admission slot', _admission_stats('queued')))
+UPSTREAM_REJECTED = register(Gauge(
+    'chat_upstream_rejected_total', 'Upstream calls turned away by admission control',
+    _admission_stats('rejected'), 'counter'))
+
+
+def _circuit_states():
+    from .breakers import CLOSED, HALF_OPEN, OPEN, breakers
+
+    codes = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+    return {(('upstream', name),): codes[breaker.state] for name, breaker in breakers.items()}
+
+
+CIRCUIT_STATE = register(Gauge(
+    'chat_circuit_state', 'Circuit breaker state per upstream (0 closed, 1 half-open, 2 open)', _circuit_states))
@@ -1,3 +1,14 @@
+import uuid
+
 from django.db import models
 
-# Create your models here.
+
+class Conversation(models.Model):
+    """Server-side message history for session-mode chat requests"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    messages = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return f'{self.id} ({len(self.messages)} messages)'
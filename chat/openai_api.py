@@ -0,0 +1,102 @@
+# chat/openai_api.py
+#
+# OpenAI endpoints and embedding helpers. Kept free of Django imports so the
+# ingestion scripts can use the same pooled, cached calls as the chat views.
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+from . import upstream
+from .admission import UpstreamBusy, admission
+from .breakers import breakers
+from .embedding_cache import embedding_cache
+from .metrics import EMBEDDING_SECONDS
+
+OPENAI_API_KEY = config('OPENAI_API_KEY')
+OPENAI_BASE_URL = config('OPENAI_BASE_URL', default='https://api.openai.com/v1').rstrip('/')
+OPENAI_EMBEDDINGS_URL = f'{OPENAI_BASE_URL}/embeddings'
+OPENAI_CHAT_URL = f'{OPENAI_BASE_URL}/chat/completions'
+EMBEDDING_MODEL = 'text-embedding-ada-002'
+
+
+def openai_headers():
+    return {
+        'Authorization': f'Bearer {OPENAI_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+
+# Helper to fetch embeddings for a single query
+def get_embedding(text):
+    cached = embedding_cache.get(text, EMBEDDING_MODEL)
+    if cached is not None:
+        return cached
+    
+    body = {
+        'model': EMBEDDING_MODEL,
+        'input': text
+    }
+    
+    try:
+        with breakers['embedding'].guard():
+            with admission.slot('openai', EMBEDDING_MODEL), EMBEDDING_SECONDS.time():
+                response = upstream.post('openai', OPENAI_EMBEDDINGS_URL, json=body, headers=openai_headers())
+            if response.status_code == 200:
+                embedding = response.json().get('data')[0].get('embedding', [])
+            else:
+                raise Exception(f"OpenAI Embedding Error: {response.status_code}")
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to generate embedding: {str(e)}")
+    
+    if embedding:
+        embedding_cache.set(text, EMBEDDING_MODEL, embedding)
+    return embedding
+
+
+async def aget_embedding(text):
+    cached = await embedding_cache.aget(text, EMBEDDING_MODEL)
+    if cached is not None:
+        return cached
+
+    body = {
+        'model': EMBEDDING_MODEL,
+        'input': text
+    }
+
+    try:
+        with breakers['embedding'].guard():
+            async with admission.aslot('openai', EMBEDDING_MODEL):
+                with EMBEDDING_SECONDS.time():
+                    response = await upstream.apost('openai', OPENAI_EMBEDDINGS_URL, json=body, headers=openai_headers())
+            if response.status_code == 200:
+                embedding = response.json().get('data')[0].get('embedding', [])
+            else:
+                raise Exception(f"OpenAI Embedding Error: {response.status_code}")
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to generate embedding: {str(e)}")
+
+    if embedding:
+        await embedding_cache.aset(text, EMBEDDING_MODEL, embedding)
+    return embedding
+
+
+
+
+def embed_batch(texts, model=EMBEDDING_MODEL):
+    """Embed many texts in one request, retrying on rate limits and 5xx"""
+    response = upstream.post_with_retry(
+        'openai',
+        OPENAI_EMBEDDINGS_URL,
+        json={'model': model, 'input': list(texts)},
+        headers=openai_headers()
+    )
+    if response.status_code != 200:
+        raise Exception(f"OpenAI Embedding Error: {response.status_code}")
+    data = sorted(response.json().get('data', []), key=lambda item: item.get('index', 0))
+    if len(data) != len(texts):
+        raise Exception(f"OpenAI returned {len(data)} embeddings for {len(texts)} inputs")
+    return [item['embedding'] for item in data]
@@ -0,0 +1,132 @@
+# chat/pipeline.py
+#
+# Helpers for the chat request pipeline. With PIPELINE_CONCURRENT the
+# embedding and retrieval for the new message start as soon as the body is
+# parsed and run alongside the conversation lookup, while a connection to
+# OpenAI is opened if the pool has gone idle. Greetings and language switches
+# can skip retrieval altogether. Every request returns its stage timings in a
+# Server-Timing header, feeds the metrics in chat/metrics.py and logs one
+# structured JSON line when its stream ends.
+
+import json
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+from . import metrics
+from .embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+PIPELINE_CONCURRENT = config('PIPELINE_CONCURRENT', default=False, cast=bool)
+PIPELINE_WORKERS = config('PIPELINE_WORKERS', default=16, cast=int)
+SKIP_RETRIEVAL_FOR_SMALLTALK = config('SKIP_RETRIEVAL_FOR_SMALLTALK', default=False, cast=bool)
+
+# Threads for the sync view; the async view uses tasks on the event loop
+pipeline_pool = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix='chat-pipeline')
+
+GREETINGS = {
+    'hi', 'hello', 'hey', 'good morning', 'good afternoon', 'good evening', 'thanks', 'thank you',
+    'ok', 'okay', 'bye', 'goodbye', 'muraho', 'mwaramutse', 'mwiriwe', 'bite', 'amakuru',
+    'murakoze', 'urakoze', 'yego', 'oya', 'bonjour', 'salut', 'merci',
+}
+LANGUAGES = r'(?:english|kinyarwanda|french|francais|français|icyongereza|igifaransa)'
+# "I want to continue in English", "Nshaka gukomeza mu Kinyarwanda", "english please"
+LANGUAGE_SWITCH = re.compile(
+    r'^(?:(?:i want to|i would like to|i d like to|can we|can you|let s|please|nshaka|ndashaka)\s+)?'
+    r'(?:(?:continue|speak|talk|chat|reply|answer|switch|gukomeza|kuvuga)\s+)?'
+    rf'(?:(?:in|mu|to|en)\s+)?{LANGUAGES}(?:\s+please)?$'
+)
+
+
+def is_smalltalk(text):
+    """Greeting or language-switch turn that needs no retrieved context"""
+    text = re.sub(r'[^\w\s]', ' ', normalize_text(text or ''))
+    text = ' '.join(text.split())
+    return text in GREETINGS or bool(LANGUAGE_SWITCH.match(text))
+
+
+def peek_last_message(data):
+    """The new message's text, read straight from the request body"""
+    if not isinstance(data, dict):
+        return None
+    if 'messages' in data:
+        messages = data.get('messages')
+        message = messages[-1] if isinstance(messages, list) and messages else None
+        message = message.get('content') if isinstance(message, dict) else None
+    else:
+        message = data.get('message')
+        if isinstance(message, dict):
+            message = message.get('content')
+    return message if isinstance(message, str) and message else None
+
+
+class StageTimer:
+    """Per-request stage durations in milliseconds, plus request fields
+    (outcome, model, context size, ...) for the structured log line"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.fields = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (time.perf_counter() - start) * 1000
+
+    def mark(self, name):
+        """Record the time elapsed since the request started"""
+        self.stages[name] = (time.perf_counter() - self.started) * 1000
+
+    def header(self):
+        return ', '.join(f'{name};dur={ms:.1f}' for name, ms in self.stages.items())
+
+    def finish(self, chunks, size):
+        """Record a completed stream in the metrics and the request log"""
+        self.mark('total')
+        if 'first_token' in self.stages:
+            metrics.TIME_TO_FIRST_TOKEN_SECONDS.observe(self.stages['first_token'] / 1000)
+        metrics.STREAM_SECONDS.observe(self.stages['total'] / 1000)
+        metrics.STREAM_CHUNKS.observe(chunks)
+        metrics.STREAM_BYTES.observe(size)
+        metrics.REQUESTS.inc(outcome=self.fields.get('outcome', 'unknown'))
+        logger.info(json.dumps({
+            'event': 'chat_request',
+            'pipeline': 'concurrent' if PIPELINE_CONCURRENT else 'serial',
+            **self.fields,
+            'chunks': chunks,
+            'bytes': size,
+            'stages_ms': {name: round(ms, 1) for name, ms in self.stages.items()},
+        }))
+
+
+def timed_stream(stream, timer):
+    """Pass a response stream through, recording first-token time and size"""
+    chunks = size = 0
+    for line in stream:
+        if not chunks:
+            timer.mark('first_token')
+        chunks += 1
+        size += len(line.encode('utf-8'))
+        yield line
+    timer.finish(chunks, size)
+
+
+async def atimed_stream(stream, timer):
+    chunks = size = 0
+    async for line in stream:
+        if not chunks:
+            timer.mark('first_token')
+        chunks += 1
+        size += len(line.encode('utf-8'))
+        yield line
+    timer.finish(chunks, size)
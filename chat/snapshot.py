@@ -0,0 +1,190 @@
+# chat/snapshot.py
+#
+# Single-file snapshots of the local vector index. One file holds every
+# section a worker needs (vectors, ANN arrays, chunk IDs, texts and metadata)
+# behind a table of contents:
+#
+#   magic  b'ISHSNAP\0'
+#   u32    format version
+#   u64    table of contents length
+#   ...    table of contents (JSON): snapshot version, creation time, count
+#          and {section: offset, dtype, shape}
+#   ...    sections, each 64-byte aligned, offsets relative to the first
+#
+# Chunks are stored as one JSON record each in a byte blob, located through
+# an offsets table, and decoded only when a match is returned. Opening a
+# snapshot maps the file and reads the table of contents: no parsing or
+# copying, so worker start is milliseconds and the pages are shared by
+# every process through the OS page cache.
+#
+# A directory holds numbered snapshots and a CURRENT file naming the live
+# one. Publishing replaces CURRENT atomically; readers notice the change on
+# their next query and map the new file, while requests still on the old one
+# finish on their existing mapping.
+
+import json
+import os
+import struct
+import time
+
+import numpy as np
+from decouple import AutoConfig
+config = AutoConfig()
+
+# Older snapshots kept next to the current one, for rollback
+LOCAL_SNAPSHOT_KEEP = config('LOCAL_SNAPSHOT_KEEP', default=2, cast=int)
+
+MAGIC = b'ISHSNAP\0'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIQ')
+ALIGN = 64
+CURRENT_FILE = 'CURRENT'
+
+
+def snapshot_name(version):
+    return f'snapshot-{version:06d}.idx'
+
+
+def _aligned(size):
+    return -(-size // ALIGN) * ALIGN
+
+
+class Records:
+    """Read-only sequence of JSON records stored in a snapshot"""
+
+    def __init__(self, offsets, blob):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('record index out of range')
+        return json.loads(self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes())
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def encode_records(records):
+    """(offsets, blob) arrays for a list of JSON-serializable records"""
+    encoded = [json.dumps(r, ensure_ascii=False, separators=(',', ':')).encode('utf-8') for r in records]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+def current_version(path):
+    name = read_current(path)
+    return int(name.split('-')[1].split('.')[0]) if name else 0
+
+
+def read_current(path):
+    try:
+        with open(os.path.join(path, CURRENT_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_snapshot(path, arrays, records, keep=LOCAL_SNAPSHOT_KEEP):
+    """Write `arrays` ({section: ndarray}) and `records` as the next snapshot
+    in `path`, publish it and return its version"""
+    os.makedirs(path, exist_ok=True)
+    version = current_version(path) + 1
+    arrays = dict(arrays)
+    arrays['record_offsets'], arrays['records'] = encode_records(records)
+
+    sections, offset = {}, 0
+    for name, array in arrays.items():
+        sections[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset = _aligned(offset + array.nbytes)
+    toc = json.dumps({
+        'version': version,
+        'created_at': time.time(),
+        'count': len(arrays['record_offsets']) - 1,
+        'sections': sections,
+    }).encode('utf-8')
+    start = _aligned(HEADER.size + len(toc))
+
+    name = snapshot_name(version)
+    tmp_path = os.path.join(path, f'.{name}.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(toc)))
+        f.write(toc)
+        for section, array in arrays.items():
+            f.seek(start + sections[section]['offset'])
+            np.ascontiguousarray(array).tofile(f)
+        f.truncate(start + offset)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, name))
+    publish(path, name)
+    prune(path, version, keep)
+    return version
+
+
+def publish(path, name):
+    """Point CURRENT at `name` (atomic: readers see the old or the new one)"""
+    tmp_path = os.path.join(path, f'.{CURRENT_FILE}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(path, CURRENT_FILE))
+
+
+def prune(path, version, keep):
+    for name in os.listdir(path):
+        if name.startswith('snapshot-') and name.endswith('.idx'):
+            if int(name.split('-')[1].split('.')[0]) <= version - keep - 1:
+                # Processes that still map it keep their pages until they switch
+                os.remove(os.path.join(path, name))
+
+
+class Snapshot:
+    def __init__(self, filename):
+        self.filename = filename
+        self.buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+        magic, format_version, toc_size = HEADER.unpack(self.buffer[:HEADER.size].tobytes())
+        if magic != MAGIC:
+            raise ValueError(f'{filename} is not an index snapshot')
+        if format_version != FORMAT_VERSION:
+            raise ValueError(f'{filename} has snapshot format {format_version}, expected {FORMAT_VERSION}')
+        toc = json.loads(self.buffer[HEADER.size:HEADER.size + toc_size].tobytes())
+        start = _aligned(HEADER.size + toc_size)
+
+        self.version = toc['version']
+        self.created_at = toc['created_at']
+        self.arrays = {
+            name: np.ndarray(tuple(s['shape']), dtype=np.dtype(s['dtype']), buffer=self.buffer,
+                             offset=start + s['offset'])
+            for name, s in toc['sections'].items()
+        }
+        self.records = Records(self.arrays.pop('record_offsets'), self.arrays.pop('records'))
+        if len(self.records) != toc['count']:
+            raise ValueError(f'{filename} is truncated')
+
+    @classmethod
+    def current(cls, path):
+        """The snapshot CURRENT points at; FileNotFoundError when there is none"""
+        name = read_current(path)
+        if not name:
+            raise FileNotFoundError(f'No index snapshot in {path}')
+        return cls(os.path.join(path, name))
+
+
+def current_stamp(path):
+    """Changes whenever a snapshot is published (cheap enough to check per query)"""
+    try:
+        stat = os.stat(os.path.join(path, CURRENT_FILE))
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
@@ -0,0 +1,96 @@
+# chat/tagging.py
+#
+# Language and topic tags for chunks, and the matching retrieval filters.
+# Ingestion stores `language` (en, rw, fr) and `topic` (srh, mental_health,
+# nutrition, game) in each chunk's metadata; with RETRIEVAL_FILTERS the chat
+# view detects the same fields on the question and only searches chunks that
+# match, plus the untagged ones ('und' / 'general'). Detection is a marker-word
+# count, cheap enough to run on every request.
+
+import re
+
+from decouple import AutoConfig, Csv
+config = AutoConfig()
+
+from .embedding_cache import normalize_text
+from .language import detect_language
+
+# Fields to filter retrieval by: '', 'language' or 'language,topic'
+RETRIEVAL_FILTERS = config('RETRIEVAL_FILTERS', default='', cast=Csv())
+
+UNKNOWN_LANGUAGE = 'und'
+GENERAL_TOPIC = 'general'
+# Metadata fields set by chunk_tags, in the order indexes group chunks by
+TAG_FIELDS = ('language', 'topic')
+
+TOPIC_MARKERS = {
+    'srh': {
+        'sexual', 'sex', 'reproductive', 'contraception', 'contraceptive', 'condom', 'condoms', 'hiv', 'aids',
+        'sti', 'stis', 'pregnancy', 'pregnant', 'menstruation', 'menstrual', 'period', 'periods', 'puberty',
+        'imyororokere', 'agakingirizo', 'udukingirizo', 'kuboneza', 'urubyaro', 'inda', 'imihango', 'sida',
+        'ubwangavu', 'ubugimbi', 'imibonano', 'préservatif', 'préservatifs', 'grossesse', 'sexuelle',
+        'sexuelles', 'vih', 'puberté', 'menstruations',
+    },
+    'mental_health': {
+        'mental', 'stress', 'anxiety', 'depression', 'depressed', 'sad', 'sadness', 'suicide', 'trauma',
+        'lonely', 'worried', 'agahinda', 'ihungabana', 'kwiheba', 'umutwe', 'ubwoba', 'guhangayika',
+        'mentale', 'anxiété', 'dépression', 'tristesse', 'traumatisme',
+    },
+    'nutrition': {
+        'nutrition', 'food', 'foods', 'diet', 'eat', 'eating', 'vitamin', 'vitamins', 'protein', 'meal',
+        'meals', 'imirire', 'ibiryo', 'indyo', 'kurya', 'intungamubiri', 'alimentation', 'manger',
+        'nourriture', 'repas', 'vitamines',
+    },
+    'game': {
+        'game', 'card', 'cards', 'play', 'playing', 'player', 'players', 'points', 'rules', 'turn', 'deck',
+        'umukino', 'ikarita', 'amakarita', 'gukina', 'umukinnyi', 'abakinnyi', 'amanota', 'amategeko',
+        'jeu', 'carte', 'cartes', 'joueur', 'joueurs', 'jouer',
+    },
+}
+TOPICS = tuple(TOPIC_MARKERS)
+
+
+def detect_topic(text, default=None):
+    """The topic with the most marker words; `default` when none or a tie"""
+    words = re.findall(r"[^\W\d_]+", normalize_text(text or ''))
+    scores = sorted(((sum(w in TOPIC_MARKERS[t] for w in words), t) for t in TOPICS), reverse=True)
+    (best, topic), (runner_up, _) = scores[0], scores[1]
+    return topic if best and best > runner_up else default
+
+
+def chunk_tags(text):
+    """Metadata tags stored with a chunk at ingestion"""
+    return {
+        'language': detect_language(text, default=UNKNOWN_LANGUAGE),
+        'topic': detect_topic(text, default=GENERAL_TOPIC),
+    }
+
+
+def query_filter(text, fields=RETRIEVAL_FILTERS):
+    """{field: [values]} for the question, or None when nothing is detected.
+
+    Untagged chunks always stay in: a question in Kinyarwanda also sees
+    chunks whose language could not be told.
+    """
+    detected = {}
+    if 'language' in fields:
+        language = detect_language(text, default=None)
+        if language:
+            detected['language'] = [language, UNKNOWN_LANGUAGE]
+    if 'topic' in fields:
+        topic = detect_topic(text)
+        if topic:
+            detected['topic'] = [topic, GENERAL_TOPIC]
+    return detected or None
+
+
+def matches_filter(metadata, filter):
+    return all(metadata.get(field) in values for field, values in filter.items())
+
+
+def pinecone_filter(filter):
+    return {field: {'$in': list(values)} for field, values in filter.items()}
+
+
+def filter_key(filter):
+    return tuple(sorted((field, tuple(values)) for field, values in filter.items()))
@@ -1,3 +1,620 @@
-from django.test import TestCase
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.test import AsyncRequestFactory, RequestFactory, SimpleTestCase
+
+from chat import warmup
+from chat.admission import ADMISSION_MAX_QUEUE, Limiter, UpstreamBusy, parse_limits
+from chat.ann import IvfIndex, build_ivf
+from chat.async_views import areplay, arecord_turn, handle_chat_bot_request_async
+from chat.breakers import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+from chat.checkpoints import Checkpoint
+from chat.documents import chunk_pages, split_text
+from chat.history import HistoryManager
+from chat.ingestion import ingest
+from chat.lexical import (BM25_B, BM25_K1, LexicalIndex, LexicalSearch, fuse, tokenize,
+                         update_lexical_index, write_lexical_index)
+from chat.local_index import LEGACY_CHUNKS_FILE, LEGACY_VECTORS_FILE, LocalVectorIndex, normalize_rows
+from chat.snapshot import CURRENT_FILE, Snapshot, read_current, snapshot_name, write_snapshot
+from chat.vectorstore import LocalStore, MemoryStore
+from chat.views import handle_chat_bot_request, ndjson, record_turn
+
+
+def fake_entries(prompts, answers=False, previous=None):
+    return [
+        {'prompt': prompt, 'model': warmup.WARMUP_MODEL, 'embedding': [0.0], 'context': 'context', 'lines': None}
+        for prompt in prompts
+    ]
+
+
+@mock.patch('chat.warmup.build_entries', fake_entries)
+class WarmupFileTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'warmup.json')
+
+    def write_with_command(self, *prompts):
+        args = [arg for prompt in prompts for arg in ('--prompt', prompt)]
+        call_command('warmup', *args, '--output', self.path, stdout=StringIO())
+
+    def test_worker_accepts_file_written_by_command(self):
+        self.write_with_command('How many cards are there?')
+        worker = warmup.WarmSet()
+        self.assertTrue(worker.load(self.path))
+        self.assertIsNotNone(worker.lookup('How many cards are there?'))
+        for prompt in warmup.warmup_prompts():
+            self.assertIsNotNone(worker.lookup(prompt))
+
+    def test_worker_refresh_keeps_command_prompts(self):
+        self.write_with_command('How many cards are there?')
+        self.assertTrue(warmup.warm_set.load(self.path))
+        warmup.run_warmup(extra=warmup.warm_set.prompts, path=self.path)
+        worker = warmup.WarmSet()
+        self.assertTrue(worker.load(self.path))
+        self.assertIsNotNone(worker.lookup('How many cards are there?'))
+
+    def test_file_for_another_model_is_ignored(self):
+        self.write_with_command()
+        with mock.patch('chat.warmup.WARMUP_MODEL', 'another-model'):
+            self.assertFalse(warmup.WarmSet().load(self.path))
+
+
+INVALID_PAYLOADS = [
+    {'message': 123},
+    {'message': {'content': ['a']}},
+    {'message': ''},
+    {'messages': [{'content': ['a']}]},
+    {'messages': ['hi']},
+    {'messages': [{'role': 'user', 'content': 'hi'}, 'hi']},
+    {'messages': [{'role': 'user'}]},
+    {'messages': []},
+    [{'role': 'user', 'content': 'hi'}],
+    None,
+]
+
+
+@mock.patch('chat.views.conversation_store')
+class ChatRequestValidationTests(SimpleTestCase):
+    def test_sync_view_rejects_invalid_payloads(self, store):
+        for payload in INVALID_PAYLOADS:
+            with self.subTest(payload=payload):
+                request = RequestFactory().post('/chat-bot/', json.dumps(payload), content_type='application/json')
+                self.assertEqual(handle_chat_bot_request(request).status_code, 400)
+        store.load.assert_not_called()
+
+    def test_async_view_rejects_invalid_payloads(self, store):
+        for payload in INVALID_PAYLOADS:
+            with self.subTest(payload=payload):
+                request = AsyncRequestFactory().post('/chat-bot/', json.dumps(payload), content_type='application/json')
+                self.assertEqual(async_to_sync(handle_chat_bot_request_async)(request).status_code, 400)
+        store.load.assert_not_called()
+
+
+@mock.patch('chat.views.conversation_store')
+class RecordTurnTests(SimpleTestCase):
+    message = {'role': 'user', 'content': 'hi'}
+
+    def test_completed_turn_is_saved(self, store):
+        list(record_turn(iter([ndjson('Hel'), ndjson('lo')]), 'c1', self.message))
+        store.append.assert_called_once_with('c1', [self.message, {'role': 'assistant', 'content': 'Hello'}])
+
+    def test_disconnect_keeps_user_message(self, store):
+        stream = record_turn(iter([ndjson('Hel'), ndjson('lo')]), 'c1', self.message)
+        next(stream)
+        stream.close()
+        store.append.assert_called_once_with('c1', [self.message])
+
+    def test_async_disconnect_keeps_user_message(self, store):
+        async def consume_one():
+            stream = arecord_turn(areplay([ndjson('Hel'), ndjson('lo')]), 'c1', self.message)
+            await stream.__anext__()
+            await stream.aclose()
+
+        async_to_sync(consume_one)()
+        store.append.assert_called_once_with('c1', [self.message])
+
+
+class LocalStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = LocalStore(directory.name)
+
+    def test_deleting_everything_leaves_an_empty_index(self):
+        self.store.upsert([
+            {'id': 'a', 'values': [1.0, 0.0, 0.0], 'metadata': {'language': 'en'}},
+            {'id': 'b', 'values': [0.0, 1.0, 0.0]},
+        ])
+        self.store.flush()
+        self.store.delete(['a', 'b'])
+        self.store.flush()
+        self.assertEqual(self.store.query([1.0, 0.0, 0.0], top_k=5), [])
+        self.assertEqual(self.store.query([1.0, 0.0, 0.0], top_k=5, filter={'language': ['en']}), [])
+        self.assertEqual(self.store.stats()['total_vector_count'], 0)
+
+
+class HistoryWindowTests(SimpleTestCase):
+    def conversation(self, turns):
+        return [
+            {'role': 'user' if i % 2 == 0 else 'assistant', 'content': f'message {i} ' + 'word ' * 50}
+            for i in range(turns)
+        ]
+
+    @mock.patch('chat.history.summarize_messages', side_effect=Exception('upstream down'))
+    def test_window_stays_bounded_when_summaries_fail(self, summarize):
+        history = HistoryManager(max_messages=8, token_budget=300, step=2)
+        for turns in (10, 20, 40):
+            messages = self.conversation(turns)
+            window = history.window(messages)
+            self.assertLessEqual(len(window), 8)
+            self.assertEqual(window[-1], messages[-1])
+        # Let the scheduled summaries fail while summarize_messages is patched
+        history._executor.shutdown()
+
+    @mock.patch('chat.history.summarize_messages', return_value='earlier turns')
+    def test_window_starts_with_the_cached_summary(self, summarize):
+        history = HistoryManager(max_messages=4, token_budget=10000, step=2)
+        messages = self.conversation(10)
+        history.window(messages)
+        history._executor.shutdown()
+        window = history.window(messages)
+        self.assertEqual(window[0]['role'], 'system')
+        self.assertIn('earlier turns', window[0]['content'])
+        self.assertEqual(window[1:], messages[-4:])
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached')
+        time.sleep(0.001)
+
+
+class AdmissionTests(SimpleTestCase):
+    def test_full_limiter_rejects_without_waiting(self):
+        limiter = Limiter(('openai', None), max_concurrent=1, max_queue=0)
+        permit = limiter.acquire()
+        with self.assertRaisesRegex(UpstreamBusy, 'no free slot'):
+            limiter.acquire(wait=False)
+        with self.assertRaisesRegex(UpstreamBusy, 'queue full'):
+            limiter.acquire()
+        permit.release()
+        permit.release()
+        self.assertEqual(limiter.stats(), {'active': 0, 'queued': 0, 'admitted': 1, 'rejected': 2})
+
+    def test_waiters_are_admitted_in_arrival_order(self):
+        limiter = Limiter(('openai', None), max_concurrent=1, max_queue=3)
+        permit = limiter.acquire()
+        order = []
+
+        def wait_in_line(name):
+            limiter.acquire().release()
+            order.append(name)
+
+        threads = []
+        for i in range(3):
+            threads.append(threading.Thread(target=wait_in_line, args=(i,)))
+            threads[-1].start()
+            wait_until(lambda: limiter.stats()['queued'] == i + 1)
+        permit.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, [0, 1, 2])
+        self.assertEqual(limiter.stats()['active'], 0)
+
+    def test_queue_timeout(self):
+        limiter = Limiter(('pinecone', None), max_concurrent=1, max_queue=1, timeout=0.01)
+        permit = limiter.acquire()
+        with self.assertRaisesRegex(UpstreamBusy, 'queue timeout'):
+            limiter.acquire()
+        self.assertEqual(limiter.stats()['queued'], 0)
+        permit.release()
+        limiter.acquire().release()
+
+    def test_cancelled_async_waiter_does_not_leak_a_slot(self):
+        limiter = Limiter(('openai', None), max_concurrent=1, max_queue=1)
+
+        async def scenario():
+            permit = await limiter.aacquire()
+            waiter = asyncio.create_task(limiter.aacquire())
+            await asyncio.sleep(0)
+            self.assertEqual(limiter.stats()['queued'], 1)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            permit.release()
+            (await limiter.aacquire()).release()
+
+        async_to_sync(scenario)()
+        self.assertEqual(limiter.stats()['active'], 0)
+
+    def test_parse_limits(self):
+        self.assertEqual(parse_limits(['openai:gpt-4o=16/32', 'pinecone=64']), {
+            ('openai', 'gpt-4o'): (16, 32),
+            ('pinecone', None): (64, ADMISSION_MAX_QUEUE),
+        })
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker('completion', failure_threshold=2, recovery_seconds=30, enabled=True)
+
+    def fail_call(self):
+        with self.assertRaises(ValueError), self.breaker.guard():
+            raise ValueError('upstream error')
+
+    def elapse_recovery(self):
+        self.breaker.opened_at -= self.breaker.recovery_seconds
+
+    def test_opens_after_consecutive_failures(self):
+        self.fail_call()
+        with self.breaker.guard() as call:
+            call.fail()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertTrue(self.breaker.is_open())
+        with self.assertRaises(CircuitOpen), self.breaker.guard():
+            pass
+
+    def test_success_resets_the_failure_count(self):
+        self.fail_call()
+        with self.breaker.guard():
+            pass
+        self.fail_call()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_open_lets_one_probe_through(self):
+        self.fail_call()
+        self.fail_call()
+        self.elapse_recovery()
+        self.assertFalse(self.breaker.is_open())
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertTrue(self.breaker.is_open())
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_failed_probe_reopens(self):
+        self.fail_call()
+        self.fail_call()
+        self.elapse_recovery()
+        self.fail_call()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertTrue(self.breaker.is_open())
+
+    def test_busy_and_cancelled_calls_are_not_failures(self):
+        self.fail_call()
+        self.fail_call()
+        self.elapse_recovery()
+        with self.assertRaises(UpstreamBusy), self.breaker.guard():
+            raise UpstreamBusy(('openai', None), 'queue full')
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.assertRaises(asyncio.CancelledError), self.breaker.guard():
+            raise asyncio.CancelledError()
+        # The probe slot is free again
+        self.assertTrue(self.breaker.allow())
+
+
+LEXICAL_CHUNKS = [
+    {'id': 'rules', 'metadata': {'text': 'Ishema card game rules: each player gets five cards', 'language': 'en'}},
+    {'id': 'umukino', 'metadata': {'text': "Amategeko y'umukino w'amakarita ya Ishema", 'language': 'rw'}},
+    {'id': 'nutrition', 'metadata': {'text': 'Eat fruit and vegetables every day', 'language': 'en'}},
+    {'id': 'health', 'metadata': {'text': 'Health services for young people, every day of the week', 'language': 'en'}},
+]
+
+
+class LexicalTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        write_lexical_index(self.path, LEXICAL_CHUNKS)
+
+    def test_scores_follow_bm25(self):
+        index = LexicalIndex(self.path)
+        lengths = {c['id']: len(tokenize(c['metadata']['text'])) for c in LEXICAL_CHUNKS}
+        average = sum(lengths.values()) / len(lengths)
+        df = 2  # 'every' is in two of the four chunks
+        idf = math.log(1 + (4 - df + 0.5) / (df + 0.5))
+        scores = {m['id']: m['score'] for m in index.search('every')}
+        self.assertEqual(set(scores), {'nutrition', 'health'})
+        for doc in ('nutrition', 'health'):
+            expected = idf * (BM25_K1 + 1) / (1 + BM25_K1 * (1 - BM25_B + BM25_B * lengths[doc] / average))
+            # Normalized by the question's total IDF, here the one term
+            self.assertAlmostEqual(scores[doc], expected / idf, places=5)
+
+    def test_rare_terms_rank_first_and_filters_apply(self):
+        index = LexicalIndex(self.path)
+        self.assertEqual(index.search('ishema card rules')[0]['id'], 'rules')
+        self.assertEqual([m['id'] for m in index.search('ishema', filter={'language': ['rw']})], ['umukino'])
+        self.assertEqual(index.search('unknown words only'), [])
+
+    def test_search_threshold_and_filter_fallback(self):
+        search = LexicalSearch(self.path)
+        with mock.patch('chat.lexical.LEXICAL_THRESHOLD', 0.5):
+            self.assertEqual([m['id'] for m in search.search('five cards', filter={'language': ['rw']})], ['rules'])
+            self.assertEqual(search.search('how do I play'), [])
+        self.assertIsNone(LexicalSearch('').search('ishema'))
+
+    def test_update_replaces_and_deletes_chunks(self):
+        update_lexical_index(self.path, [{'id': 'nutrition', 'metadata': {'text': 'Drink clean water'}}], deleted=['rules'])
+        index = LexicalIndex(self.path)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.search('water')[0]['id'], 'nutrition')
+        self.assertEqual(index.search('fruit'), [])
+        self.assertNotIn('rules', [m['id'] for m in index.search('five cards')])
+
+    def test_fuse_favours_matches_found_by_both(self):
+        vector = [{'id': 'a', 'score': 0.9}, {'id': 'b', 'score': 0.8}]
+        lexical = [{'id': 'c', 'score': 2.0}, {'id': 'b', 'score': 1.0}]
+        fused = fuse(vector, lexical, k=60)
+        self.assertEqual([m['id'] for m in fused], ['b', 'a', 'c'])
+        self.assertAlmostEqual(fused[0]['score'], 2 / 62)
+        self.assertAlmostEqual(fused[1]['score'], 1 / 61)
+
+
+def clustered_vectors(count, dimension=32, clusters=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension))
+    return (centers[rng.integers(clusters, size=count)] + 0.3 * rng.normal(size=(count, dimension))).astype(np.float32)
+
+
+class AnnTests(SimpleTestCase):
+    def test_ivf_recall_against_exact_search(self):
+        matrix = normalize_rows(clustered_vectors(3000))
+        index = IvfIndex(build_ivf(matrix, lists=32), len(matrix))
+        queries = normalize_rows(matrix[::100] + 0.1)
+        found = 0
+        for query in queries:
+            exact = set(np.argsort(-(matrix @ query))[:10])
+            rows, scores = index.search(query, matrix, 10, nprobe=8, rerank=100)
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+            np.testing.assert_allclose(scores, matrix[rows] @ query, rtol=1e-5)
+            found += len(exact & set(rows))
+        self.assertGreaterEqual(found / (10 * len(queries)), 0.9)
+
+    def test_int8_codes_approximate_the_vectors(self):
+        matrix = normalize_rows(clustered_vectors(500))
+        arrays = build_ivf(matrix, lists=8)
+        decoded = arrays['ann_codes'].astype(np.float32) * arrays['ann_scales'][:, None]
+        np.testing.assert_allclose(decoded, matrix[arrays['ann_rows']], atol=0.01)
+
+
+class LocalStoreParityTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        vectors = clustered_vectors(600, seed=1)
+        self.records = [
+            {'id': f'chunk-{i}', 'values': vector.tolist(),
+             'metadata': {'text': f'chunk {i}', 'language': ('en', 'rw', None)[i % 3]}}
+            for i, vector in enumerate(vectors)
+        ]
+        self.memory = MemoryStore()
+        self.memory.upsert(self.records)
+        self.local = LocalStore(directory.name)
+        self.local.upsert(self.records)
+        self.local.flush()
+        self.queries = [r['values'] for r in self.records[::60]]
+
+    def assert_same_matches(self, filter=None, min_overlap=1.0):
+        overlap = 0
+        for query in self.queries:
+            expected = self.memory.query(query, top_k=10, filter=filter)
+            matches = self.local.query(query, top_k=10, filter=filter)
+            self.assertEqual(len(matches), len(expected))
+            overlap += len({m['id'] for m in matches} & {m['id'] for m in expected})
+            by_id = {m['id']: m for m in expected}
+            for match in matches:
+                self.assertEqual(match['metadata'], self.records[int(match['id'].split('-')[1])]['metadata'])
+                if match['id'] in by_id:
+                    self.assertAlmostEqual(match['score'], by_id[match['id']]['score'], places=5)
+        self.assertGreaterEqual(overlap / (10 * len(self.queries)), min_overlap)
+
+    def test_exact_search_matches_memory_store(self):
+        self.assert_same_matches()
+        self.assert_same_matches({'language': ['rw']})
+        self.assert_same_matches({'language': ['en', 'rw']})
+
+    @mock.patch('chat.local_index.LOCAL_ANN_MIN_VECTORS', 0)
+    @mock.patch('chat.local_index.LOCAL_ANN', True)
+    def test_ann_search_matches_memory_store(self):
+        self.local.replace(self.records)
+        self.assertIsNotNone(self.local.index().ann)
+        self.assert_same_matches(min_overlap=0.9)
+        self.assert_same_matches({'language': ['en']}, min_overlap=0.9)
+
+
+class SnapshotTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+
+    def test_round_trip(self):
+        vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+        records = [{'id': 'a'}, {'id': 'b', 'metadata': {'text': 'umukino'}}, {'id': 'c'}]
+        self.assertEqual(write_snapshot(self.path, {'vectors': vectors}, records), 1)
+        snapshot = Snapshot.current(self.path)
+        self.assertEqual(snapshot.version, 1)
+        np.testing.assert_array_equal(snapshot.arrays['vectors'], vectors)
+        self.assertEqual(list(snapshot.records), records)
+        self.assertEqual(snapshot.records[-1], {'id': 'c'})
+
+    def test_publish_swaps_current_and_prunes_old_snapshots(self):
+        for i in range(4):
+            write_snapshot(self.path, {'vectors': np.full((1, 2), i, dtype=np.float32)}, [{'id': i}], keep=1)
+        self.assertEqual(read_current(self.path), snapshot_name(4))
+        self.assertEqual(sorted(n for n in os.listdir(self.path) if n.startswith('snapshot-')),
+                         [snapshot_name(3), snapshot_name(4)])
+        self.assertEqual(Snapshot.current(self.path).records[0], {'id': 3})
+
+    def test_readers_switch_on_publish_and_old_mappings_stay_valid(self):
+        writer, reader = LocalStore(self.path), LocalStore(self.path)
+        writer.upsert([{'id': 'a', 'values': [1.0, 0.0]}])
+        writer.flush()
+        old = reader.index()
+        writer.upsert([{'id': 'b', 'values': [0.0, 1.0]}])
+        writer.flush()
+        self.assertEqual([m['id'] for m in reader.query([0.0, 1.0], top_k=1)], ['b'])
+        self.assertEqual(reader.index().version, old.version + 1)
+        # A request still holding the previous index finishes on it
+        self.assertEqual([m['id'] for m in old.query([0.0, 1.0], top_k=5)], ['a'])
+
+    def test_unfinished_write_is_not_visible(self):
+        write_snapshot(self.path, {'vectors': np.zeros((1, 2), dtype=np.float32)}, [{'id': 'a'}])
+        with open(os.path.join(self.path, f'.{snapshot_name(2)}.tmp'), 'wb') as f:
+            f.write(b'partial')
+        with open(os.path.join(self.path, f'.{CURRENT_FILE}.tmp'), 'w') as f:
+            f.write(snapshot_name(2))
+        self.assertEqual(Snapshot.current(self.path).version, 1)
+
+    def test_rejects_files_that_are_not_snapshots(self):
+        filename = os.path.join(self.path, snapshot_name(1))
+        with open(filename, 'wb') as f:
+            f.write(b'not a snapshot at all, just some bytes')
+        with self.assertRaises(ValueError):
+            Snapshot(filename)
+
+    def test_legacy_layout_is_read_then_replaced(self):
+        np.save(os.path.join(self.path, LEGACY_VECTORS_FILE), normalize_rows([[1.0, 0.0], [0.0, 1.0]]))
+        with open(os.path.join(self.path, LEGACY_CHUNKS_FILE), 'w') as f:
+            json.dump([{'id': 'a', 'metadata': {}}, {'id': 'b', 'metadata': {}}], f)
+        self.assertEqual(LocalVectorIndex(self.path).query([0.0, 1.0], top_k=1)[0]['id'], 'b')
+        store = LocalStore(self.path)
+        store.upsert([{'id': 'c', 'values': [1.0, 1.0]}])
+        store.flush()
+        self.assertFalse(os.path.exists(os.path.join(self.path, LEGACY_VECTORS_FILE)))
+        self.assertEqual(len(store.index()), 3)
+
+
+def fake_vector(text):
+    return [float(len(text)), 1.0, 0.0]
+
+
+class CheckpointTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.work_dir = directory.name
+
+    def open(self, fingerprint='v1'):
+        return Checkpoint('doc', fingerprint, work_dir=self.work_dir)
+
+    def test_state_survives_reopening(self):
+        checkpoint = self.open()
+        checkpoint.save_chunks([('first', {'page': 1}), ('second', None)])
+        checkpoint.append_embeddings(['a', 'b'], [[1.0, 2.0], [3.0, 4.0]])
+        checkpoint.append_upserted(['a'])
+        checkpoint = self.open()
+        self.assertTrue(checkpoint.has_chunks())
+        self.assertEqual(list(checkpoint.load_chunks()), [('first', {'page': 1}), ('second', {})])
+        self.assertEqual(list(checkpoint.iter_embeddings()), [('a', [1.0, 2.0]), ('b', [3.0, 4.0])])
+        self.assertEqual(checkpoint.upserted_ids(), {'a'})
+
+    def test_changed_source_discards_the_state(self):
+        self.open().append_embeddings(['a'], [[1.0, 2.0]])
+        checkpoint = self.open('v2')
+        self.assertFalse(checkpoint.has_chunks())
+        self.assertEqual(checkpoint.embedded_ids(), [])
+
+    def test_torn_writes_are_cut_off_on_open(self):
+        checkpoint = self.open()
+        checkpoint.append_embeddings(['a', 'b'], [[1.0, 2.0], [3.0, 4.0]])
+        checkpoint.append_upserted(['a'])
+        # Crash mid-batch: a row without its ID, half a row, torn ID lines
+        with open(os.path.join(checkpoint.dir, 'embeddings.f32'), 'ab') as f:
+            f.write(np.array([5.0, 6.0, 7.0], dtype=np.float32).tobytes())
+        with open(os.path.join(checkpoint.dir, 'embeddings.ids'), 'a') as f:
+            f.write('c')
+        with open(os.path.join(checkpoint.dir, 'upserted.ids'), 'a') as f:
+            f.write('b')
+
+        checkpoint = self.open()
+        self.assertEqual(checkpoint.embedded_ids(), ['a', 'b'])
+        self.assertEqual(checkpoint.upserted_ids(), {'a'})
+        checkpoint.append_embeddings(['c'], [[5.0, 6.0]])
+        checkpoint.append_upserted(['b'])
+        self.assertEqual(list(checkpoint.iter_embeddings())[-1], ('c', [5.0, 6.0]))
+        self.assertEqual(checkpoint.upserted_ids(), {'a', 'b'})
+
+    def test_interrupted_ingest_resumes_without_re_embedding(self):
+        records = [{'id': f'chunk-{i}', 'text': 'x' * (i + 1), 'metadata': {}} for i in range(6)]
+        embedded = []
+
+        def embed_batch(texts, fail_on=None):
+            if fail_on and fail_on in texts:
+                raise ConnectionError('rate limited')
+            embedded.extend(texts)
+            return [fake_vector(text) for text in texts]
+
+        store = MemoryStore()
+        options = {'store': store, 'embed_batch_size': 2, 'concurrency': 1, 'log': lambda message: None}
+        with mock.patch('chat.ingestion.embed_batch', lambda texts: embed_batch(texts, fail_on='xxxxx')):
+            with self.assertRaises(ConnectionError):
+                ingest(records, checkpoint=self.open(), **options)
+        before = list(embedded)
+        with mock.patch('chat.ingestion.embed_batch', embed_batch):
+            ingest(records, checkpoint=self.open(), **options)
+
+        self.assertEqual(sorted(embedded), sorted(r['text'] for r in records))
+        self.assertTrue(before)
+        self.assertEqual(store.stats()['total_vector_count'], 6)
+        self.assertEqual(self.open().upserted_ids(), {r['id'] for r in records})
+
+
+try:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+except ImportError:
+    RecursiveCharacterTextSplitter = None
+
+# Output of langchain's RecursiveCharacterTextSplitter for the same settings
+SPLITTER_SAMPLES = [
+    ("Ishema ryanjye ni umukino w'amakarita.\n\nBuri mukinnyi ahabwa amakarita atanu.\n"
+     "Umukino urangira iyo amakarita ashize.", 60, 10,
+     ["Ishema ryanjye ni umukino w'amakarita.", 'Buri mukinnyi ahabwa amakarita atanu.',
+      'Umukino urangira iyo amakarita ashize.']),
+    ('one two three four five six seven eight nine ten eleven twelve', 20, 8,
+     ['one two three four', 'four five six seven', 'seven eight nine', 'nine ten eleven', 'eleven twelve']),
+    ('abcdefghijklmnopqrstuvwxyz', 10, 3, ['abcdefghij', 'hijklmnopq', 'opqrstuvwx', 'vwxyz']),
+    ('Short paragraph.\n\n' + 'word ' * 30 + '\n\nLast line', 40, 0,
+     ['Short paragraph.', *['word word word word word word word word'] * 3, 'word word word word word word',
+      'Last line']),
+]
+
+
+class ChunkerTests(SimpleTestCase):
+    def test_matches_langchain_splitter_output(self):
+        for text, chunk_size, chunk_overlap, expected in SPLITTER_SAMPLES:
+            with self.subTest(text=text[:20], chunk_size=chunk_size):
+                self.assertEqual(list(split_text(text, chunk_size, chunk_overlap)), expected)
+
+    @skipUnless(RecursiveCharacterTextSplitter, 'langchain-text-splitters is not installed')
+    def test_parity_with_langchain_on_random_text(self):
+        rng = random.Random(0)
+        words = ['ishema', 'umukino', 'amakarita', 'health', 'a', 'x' * 40, 'y' * 130]
+        for _ in range(300):
+            text = ''.join(rng.choice(words) + rng.choice([' ', ' ', '\n', '\n\n', '  '])
+                           for _ in range(rng.randint(1, 150)))
+            chunk_size, chunk_overlap = rng.choice([(20, 5), (50, 10), (100, 0), (500, 50)])
+            splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+            self.assertEqual(list(split_text(text, chunk_size, chunk_overlap)), splitter.split_text(text))
+
+    def test_chunks_keep_their_page_metadata(self):
+        pages = [('first page ' * 10, {'page': 1}), ('second', {'page': 2})]
+        chunks = list(chunk_pages(pages, chunk_size=40, chunk_overlap=0))
+        self.assertEqual([metadata for _, metadata in chunks], [{'page': 1}] * 3 + [{'page': 2}])
+        self.assertTrue(all(len(text) <= 40 for text, _ in chunks))
@@ -0,0 +1,38 @@
+# chat/tokens.py
+#
+# Token counting for prompt budgets. Uses tiktoken when it is installed;
+# otherwise a character-based estimate that errs on the high side (Kinyarwanda
+# text tokenizes to more tokens per character than English).
+
+import math
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Estimate used without tiktoken
+CHARS_PER_TOKEN = 3
+# Per-message framing overhead of the chat format
+MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=8)
+def _encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+
+def count_tokens(text, model='gpt-4o'):
+    if not text:
+        return 0
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def count_message_tokens(messages, model='gpt-4o'):
+    return sum(MESSAGE_OVERHEAD + count_tokens(str(m.get('content') or ''), model) for m in messages)
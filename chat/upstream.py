@@ -0,0 +1,193 @@
+# chat/upstream.py
+
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+# Connection pool sizing, shared by every upstream session
+UPSTREAM_POOL_CONNECTIONS = config('UPSTREAM_POOL_CONNECTIONS', default=4, cast=int)
+UPSTREAM_POOL_MAXSIZE = config('UPSTREAM_POOL_MAXSIZE', default=16, cast=int)
+# Async clients hold one connection per in-flight stream, so allow many more
+UPSTREAM_ASYNC_MAX_CONNECTIONS = config('UPSTREAM_ASYNC_MAX_CONNECTIONS', default=500, cast=int)
+
+# (connect, read) timeouts per upstream host
+UPSTREAM_TIMEOUTS = {
+    'openai': (
+        config('OPENAI_CONNECT_TIMEOUT', default=5, cast=float),
+        config('OPENAI_READ_TIMEOUT', default=30, cast=float),
+    ),
+    'pinecone': (
+        config('PINECONE_CONNECT_TIMEOUT', default=5, cast=float),
+        config('PINECONE_READ_TIMEOUT', default=10, cast=float),
+    ),
+}
+
+# Retries for bulk callers (ingestion); the chat hot path never retries
+UPSTREAM_RETRIES = config('UPSTREAM_RETRIES', default=5, cast=int)
+UPSTREAM_BACKOFF = config('UPSTREAM_BACKOFF', default=1.0, cast=float)
+UPSTREAM_BACKOFF_MAX = config('UPSTREAM_BACKOFF_MAX', default=60.0, cast=float)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Idle seconds after which pooled connections are assumed closed and worth
+# re-opening ahead of a request (httpx drops idle connections after 5s)
+UPSTREAM_IDLE_SECONDS = config('UPSTREAM_IDLE_SECONDS', default=5.0, cast=float)
+
+_sessions = {}
+_sessions_pid = None
+_sessions_lock = threading.Lock()
+
+# httpx async clients are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+# Last request time per upstream, to decide whether a preconnect is useful
+_last_used = {}
+
+
+def _touch(name):
+    _last_used[name] = time.monotonic()
+
+
+def is_idle(name):
+    return time.monotonic() - _last_used.get(name, float('-inf')) > UPSTREAM_IDLE_SECONDS
+
+
+def _build_session():
+    adapter = HTTPAdapter(
+        pool_connections=UPSTREAM_POOL_CONNECTIONS,
+        pool_maxsize=UPSTREAM_POOL_MAXSIZE,
+    )
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+
+def get_session(name):
+    """Return the keep-alive session for an upstream, one per process.
+
+    Sessions are rebuilt after a fork so workers never share sockets
+    inherited from the parent.
+    """
+    global _sessions_pid
+    with _sessions_lock:
+        if _sessions_pid != os.getpid():
+            _sessions.clear()
+            _sessions_pid = os.getpid()
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = _build_session()
+        return session
+
+
+def post(name, url, **kwargs):
+    """POST through the pooled session for `name` using its default timeout."""
+    kwargs.setdefault('timeout', UPSTREAM_TIMEOUTS.get(name))
+    _touch(name)
+    return get_session(name).post(url, **kwargs)
+
+
+def retry_delay(attempt, response=None):
+    """Seconds to wait before retry `attempt`, honouring Retry-After"""
+    retry_after = response is not None and response.headers.get('Retry-After')
+    if retry_after:
+        try:
+            return min(float(retry_after), UPSTREAM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    delay = min(UPSTREAM_BACKOFF * 2 ** attempt, UPSTREAM_BACKOFF_MAX)
+    # Full jitter so parallel workers do not retry in lockstep
+    return delay * random.uniform(0.5, 1.0)
+
+
+def post_with_retry(name, url, retries=UPSTREAM_RETRIES, **kwargs):
+    """POST with exponential backoff on 429/5xx and connection errors"""
+    for attempt in range(retries + 1):
+        try:
+            response = post(name, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            response = None
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+        time.sleep(retry_delay(attempt, response))
+
+
+def get(name, url, **kwargs):
+    """GET through the pooled session for `name` using its default timeout."""
+    kwargs.setdefault('timeout', UPSTREAM_TIMEOUTS.get(name))
+    _touch(name)
+    return get_session(name).get(url, **kwargs)
+
+
+def preconnect(name, url):
+    """Open a pooled connection to `url`'s host with a HEAD request unless
+    one was used recently; return whether a connection was opened"""
+    if not is_idle(name):
+        return False
+    _touch(name)
+    try:
+        get_session(name).head(url, timeout=UPSTREAM_TIMEOUTS.get(name)).close()
+    except requests.RequestException:
+        return False
+    return True
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def get_async_client(name):
+    """Return the keep-alive async client for an upstream on the running loop"""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(name)
+    if client is None:
+        connect, read = UPSTREAM_TIMEOUTS.get(name, (None, None))
+        client = clients[name] = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=UPSTREAM_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_POOL_MAXSIZE,
+            ),
+            timeout=httpx.Timeout(read, connect=connect),
+        )
+    return client
+
+
+async def apost(name, url, **kwargs):
+    """Async POST through the pooled client for `name`"""
+    _touch(name)
+    return await get_async_client(name).post(url, **kwargs)
+
+
+def astream(name, url, **kwargs):
+    """Async streaming POST, used as `async with astream(...) as response`"""
+    _touch(name)
+    return get_async_client(name).stream('POST', url, **kwargs)
+
+
+async def apreconnect(name, url):
+    """Async counterpart of preconnect"""
+    if not is_idle(name):
+        return False
+    _touch(name)
+    try:
+        await get_async_client(name).head(url)
+    except httpx.HTTPError:
+        return False
+    return True
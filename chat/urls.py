@@ -1,9 +1,19 @@
 # chat/urls.py
 
 from django.urls import path
-from .views import handle_chat_bot_request, load_chat_bot_base_configuration
+from decouple import AutoConfig
+
+from .views import chat_bot_metrics, handle_chat_bot_request, load_chat_bot_base_configuration
+from .async_views import handle_chat_bot_request_async
+
+config = AutoConfig()
+
+# Under ASGI ('asgi' server mode) the chat endpoint streams from the event loop
+SERVER_MODE = config('SERVER_MODE', default='wsgi')
+chat_bot_view = handle_chat_bot_request_async if SERVER_MODE == 'asgi' else handle_chat_bot_request
 
 urlpatterns = [
-    path('chat-bot/', handle_chat_bot_request, name='chat-bot'),
-    path('chat-bot-config/', load_chat_bot_base_configuration, name='chat-bot-config')
+    path('chat-bot/', chat_bot_view, name='chat-bot'),
+    path('chat-bot-config/', load_chat_bot_base_configuration, name='chat-bot-config'),
+    path('chat-bot-metrics/', chat_bot_metrics, name='chat-bot-metrics')
 ]
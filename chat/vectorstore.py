@@ -0,0 +1,385 @@
+# chat/vectorstore.py
+#
+# One retrieval interface for serving and ingestion. Every backend speaks
+# Pinecone's match format ({'id', 'score', 'metadata'}) so callers do not
+# care where vectors live:
+#
+#   pinecone  Pinecone data-plane REST API over the pooled upstream sessions
+#   local     memory-mapped NumPy index (chat/local_index.py)
+#   memory    in-process dict, for tests and offline experiments
+
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+from itertools import islice
+
+import numpy as np
+
+from decouple import AutoConfig
+config = AutoConfig()
+
+from . import metrics, upstream
+from .admission import admission
+from .chunk_store import CHUNK_STORE_PATH, VECTOR_QUERY_IDS_ONLY, chunk_store
+from .local_index import LocalVectorIndex, normalize_rows, write_local_index
+from .snapshot import current_stamp
+from .tagging import matches_filter, pinecone_filter
+
+logger = logging.getLogger(__name__)
+
+VECTOR_BACKEND = config('VECTOR_BACKEND', default='pinecone')
+PINECONE_URL = config('PINECONE_URL', default='')
+PINECONE_API_KEY = config('PINECONE_API_KEY', default='')
+PINECONE_NAMESPACE = config('PINECONE_NAMESPACE', default='')
+LOCAL_INDEX_PATH = config('LOCAL_INDEX_PATH', default='')
+UPSERT_BATCH_SIZE = config('UPSERT_BATCH_SIZE', default=100, cast=int)
+
+
+def batched(items, size):
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class VectorStore:
+    """Common query/upsert/delete/stats interface.
+
+    Vectors passed to upsert are dicts with 'id', 'values' and 'metadata'.
+    A query `filter` is {field: [allowed values]} (chat/tagging.py).
+    """
+
+    def query(self, vector, top_k=50, include_metadata=True, namespace=None, filter=None):
+        raise NotImplementedError
+
+    async def aquery(self, vector, top_k=50, include_metadata=True, namespace=None, filter=None):
+        return self.query(vector, top_k=top_k, include_metadata=include_metadata, namespace=namespace, filter=filter)
+
+    def upsert(self, vectors, namespace=None):
+        raise NotImplementedError
+
+    def delete(self, ids, namespace=None):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def flush(self):
+        """Persist buffered writes; a no-op for stores that write through"""
+
+    def key(self):
+        """Identifies where vectors are stored, for ingestion manifests"""
+        return f'{type(self).__name__}:{id(self)}'
+
+
+class PineconeRestStore(VectorStore):
+    """With a `chunks` store (chat/chunk_store.py), queries fetch IDs and
+    scores only and take the metadata from it"""
+
+    def __init__(self, host=None, api_key=None, namespace=PINECONE_NAMESPACE, batch_size=UPSERT_BATCH_SIZE,
+                 chunks=None):
+        # PINECONE_URL historically points at the /query endpoint
+        host = host or PINECONE_URL.rsplit('/query', 1)[0]
+        if host and '://' not in host:
+            host = f'https://{host}'
+        self.host = host.rstrip('/')
+        self.api_key = api_key or PINECONE_API_KEY
+        self.namespace = namespace
+        self.batch_size = batch_size
+        if chunks is None and VECTOR_QUERY_IDS_ONLY and CHUNK_STORE_PATH:
+            chunks = chunk_store
+        self.chunks = chunks
+
+    def headers(self):
+        return {
+            'Content-Type': 'application/json',
+            'Api-Key': self.api_key
+        }
+
+    def key(self):
+        return f'pinecone:{self.host}'
+
+    def _namespace(self, namespace):
+        return self.namespace if namespace is None else namespace
+
+    def _check(self, response, action):
+        if response.status_code != 200:
+            raise Exception(f"Pinecone {action} error: {response.status_code}")
+        return response.json()
+
+    def query_body(self, vector, top_k, include_metadata, namespace, filter=None):
+        body = {
+            'vector': vector,
+            'topK': top_k,
+            'includeMetadata': include_metadata
+        }
+        namespace = self._namespace(namespace)
+        if namespace:
+            body['namespace'] = namespace
+        if filter:
+            body['filter'] = pinecone_filter(filter)
+        return body
+
+    def lookup(self, matches):
+        """ID-only `matches` with their metadata from the chunk store, or None
+        when some are missing there (the query is then repeated with metadata)"""
+        try:
+            matches, missing = self.chunks.fill(matches)
+        except sqlite3.Error as e:
+            logger.warning('Chunk store lookup failed, querying with metadata: %s', e)
+            metrics.CHUNK_STORE_FALLBACKS.inc(reason='error')
+            return None
+        if missing:
+            logger.warning('%d matched chunks are not in the chunk store (e.g. %s), querying with metadata',
+                           len(missing), missing[0])
+            metrics.CHUNK_STORE_FALLBACKS.inc(reason='missing')
+            return None
+        return matches
+
+    def query(self, vector, top_k=50, include_metadata=True, namespace=None, filter=None):
+        if include_metadata and self.chunks is not None:
+            matches = self.lookup(self._query(vector, top_k, False, namespace, filter))
+            if matches is not None:
+                return matches
+        return self._query(vector, top_k, include_metadata, namespace, filter)
+
+    async def aquery(self, vector, top_k=50, include_metadata=True, namespace=None, filter=None):
+        if include_metadata and self.chunks is not None:
+            matches = await self._aquery(vector, top_k, False, namespace, filter)
+            # The chunk store is SQLite: look up off the event loop
+            matches = await asyncio.to_thread(self.lookup, matches)
+            if matches is not None:
+                return matches
+        return await self._aquery(vector, top_k, include_metadata, namespace, filter)
+
+    def _query(self, vector, top_k, include_metadata, namespace, filter):
+        with admission.slot('pinecone'):
+            response = upstream.post(
+                'pinecone',
+                f'{self.host}/query',
+                json=self.query_body(vector, top_k, include_metadata, namespace, filter),
+                headers=self.headers()
+            )
+        return self._check(response, 'query').get('matches') or []
+
+    async def _aquery(self, vector, top_k, include_metadata, namespace, filter):
+        async with admission.aslot('pinecone'):
+            response = await upstream.apost(
+                'pinecone',
+                f'{self.host}/query',
+                json=self.query_body(vector, top_k, include_metadata, namespace, filter),
+                headers=self.headers()
+            )
+        return self._check(response, 'query').get('matches') or []
+
+    def upsert(self, vectors, namespace=None):
+        count = 0
+        for batch in batched(vectors, self.batch_size):
+            response = upstream.post_with_retry(
+                'pinecone',
+                f'{self.host}/vectors/upsert',
+                json={'vectors': batch, 'namespace': self._namespace(namespace)},
+                headers=self.headers()
+            )
+            count += self._check(response, 'upsert').get('upsertedCount', len(batch))
+        return count
+
+    def delete(self, ids, namespace=None):
+        for batch in batched(ids, 1000):
+            response = upstream.post_with_retry(
+                'pinecone',
+                f'{self.host}/vectors/delete',
+                json={'ids': batch, 'namespace': self._namespace(namespace)},
+                headers=self.headers()
+            )
+            self._check(response, 'delete')
+
+    def stats(self):
+        response = upstream.post('pinecone', f'{self.host}/describe_index_stats', json={}, headers=self.headers())
+        return self._check(response, 'stats')
+
+    def iter_vectors(self, namespace=None, page_size=100):
+        """Yield every stored vector by paging through IDs (serverless indexes)"""
+        namespace = self._namespace(namespace)
+        token = None
+        while True:
+            params = {'namespace': namespace, 'limit': page_size}
+            if token:
+                params['paginationToken'] = token
+            response = upstream.get('pinecone', f'{self.host}/vectors/list', params=params, headers=self.headers())
+            page = self._check(response, 'list')
+            ids = [v['id'] for v in page.get('vectors', [])]
+            if ids:
+                response = upstream.get(
+                    'pinecone',
+                    f'{self.host}/vectors/fetch',
+                    params={'ids': ids, 'namespace': namespace},
+                    headers=self.headers()
+                )
+                fetched = self._check(response, 'fetch').get('vectors', {})
+                for vector_id in ids:
+                    if vector_id in fetched:
+                        yield fetched[vector_id]
+            token = page.get('pagination', {}).get('next')
+            if not token:
+                return
+
+
+class MemoryStore(VectorStore):
+    def __init__(self):
+        self.records = {}
+        self._lock = threading.Lock()
+
+    def query(self, vector, top_k=50, include_metadata=True, namespace=None, filter=None):
+        with self._lock:
+            records = list(self.records.items())
+        if filter:
+            records = [(i, record) for i, record in records if matches_filter(record[1], filter)]
+        if not records:
+            return []
+        matrix = normalize_rows([values for _, (values, _) in records])
+        scores = matrix @ normalize_rows(vector)
+        order = np.argsort(-scores)[:top_k]
+        matches = []
+        for i in order:
+            vector_id, (_, metadata) = records[i]
+            match = {'id': vector_id, 'score': float(scores[i])}
+            if include_metadata:
+                match['metadata'] = metadata
+            matches.append(match)
+        return matches
+
+    def upsert(self, vectors, namespace=None):
+        vectors = list(vectors)
+        with self._lock:
+            for vector in vectors:
+                self.records[vector['id']] = (list(vector['values']), vector.get('metadata') or {})
+        return len(vectors)
+
+    def delete(self, ids, namespace=None):
+        with self._lock:
+            for vector_id in ids:
+                self.records.pop(vector_id, None)
+
+    def stats(self):
+        with self._lock:
+            dimension = len(next(iter(self.records.values()))[0]) if self.records else 0
+            return {'total_vector_count': len(self.records), 'dimension': dimension}
+
+
+class LocalStore(VectorStore):
+    """Read-optimized: queries hit the mmap, writes are buffered and applied
+    by writing a new snapshot on flush (or before the next read). Snapshots
+    published by another process are picked up on the next query."""
+
+    def __init__(self, path=None):
+        self.path = path or LOCAL_INDEX_PATH
+        self._index = None
+        self._stamp = None
+        self._pending = {}
+        self._lock = threading.RLock()
+
+    def key(self):
+        return f'local:{os.path.abspath(self.path)}'
+
+    def index(self):
+        with self._lock:
+            if self._pending:
+                self.flush()
+            stamp = current_stamp(self.path)
+            if self._index is None or stamp != self._stamp:
+                self._index = LocalVectorIndex(self.path)
+                self._stamp = stamp
+            return self._index
+
+    def query(self, vector, top_k=50, include_metadata=True, namespace=None, filter=None):
+        return self.index().query(vector, top_k=top_k, include_metadata=include_metadata, filter=filter)
+
+    def _records(self):
+        try:
+            index = LocalVectorIndex(self.path)
+        except FileNotFoundError:
+            return {}
+        return {
+            chunk['id']: (index.vectors[i], chunk['metadata'])
+            for i, chunk in enumerate(index.chunks)
+        }
+
+    def _write(self, records):
+        ids = list(records)
+        vectors = [records[i][0] for i in ids]
+        metadatas = [records[i][1] for i in ids]
+        write_local_index(self.path, ids, vectors, metadatas)
+        self._index = None
+
+    def replace(self, vectors):
+        """Rewrite the index with exactly these vectors"""
+        with self._lock:
+            self._pending.clear()
+            self._write({v['id']: (v['values'], v.get('metadata') or {}) for v in vectors})
+
+    def upsert(self, vectors, namespace=None):
+        vectors = list(vectors)
+        with self._lock:
+            for vector in vectors:
+                self._pending[vector['id']] = (vector['values'], vector.get('metadata') or {})
+        return len(vectors)
+
+    def delete(self, ids, namespace=None):
+        with self._lock:
+            for vector_id in ids:
+                # None marks a deletion
+                self._pending[vector_id] = None
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            records = self._records()
+            for vector_id, record in self._pending.items():
+                if record is None:
+                    records.pop(vector_id, None)
+                else:
+                    records[vector_id] = record
+            self._pending.clear()
+            self._write(records)
+
+    def iter_vectors(self, namespace=None, page_size=None):
+        """Yield every stored vector, like PineconeRestStore.iter_vectors"""
+        index = self.index()
+        for i, chunk in enumerate(index.chunks):
+            yield {'id': chunk['id'], 'values': index.vectors[i].tolist(), 'metadata': chunk['metadata']}
+
+    def stats(self):
+        try:
+            index = self.index()
+        except FileNotFoundError:
+            return {'total_vector_count': 0, 'dimension': 0}
+        dimension = index.vectors.shape[1] if len(index) else 0
+        return {'total_vector_count': len(index), 'dimension': dimension}
+
+
+BACKENDS = {
+    'pinecone': PineconeRestStore,
+    'local': LocalStore,
+    'memory': MemoryStore,
+}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_vector_store(backend=None):
+    """Shared store for a backend, VECTOR_BACKEND by default"""
+    backend = backend or VECTOR_BACKEND
+    with _stores_lock:
+        store = _stores.get(backend)
+        if store is None:
+            if backend not in BACKENDS:
+                raise ValueError(f"Unknown vector backend '{backend}', expected one of {sorted(BACKENDS)}")
+            store = _stores[backend] = BACKENDS[backend]()
+        return store
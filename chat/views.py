@@ -1,16 +1,41 @@
-import requests
 import json
+import logging
+import threading
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from django.http import JsonResponse, StreamingHttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 
 from decouple import AutoConfig
 config = AutoConfig()
 
-PINECONE_URL = config('PINECONE_URL')
-PINECONE_API_KEY = config('PINECONE_API_KEY')
-OPENAI_API_KEY = config('OPENAI_API_KEY')
+from . import metrics, upstream
+from .admission import ADMISSION_RETRY_AFTER, UpstreamBusy, admission
+from .breakers import CircuitOpen, breakers
+from .answer_cache import answer_cache
+from .context import build_context
+from .conversations import conversation_store
+from .degraded import degraded_reply, is_degraded, template
+from .history import history_manager
+from .lexical import fuse, lexical_search
+from .tagging import query_filter
+from .openai_api import OPENAI_BASE_URL, OPENAI_CHAT_URL, get_embedding, openai_headers
+from .pipeline import (
+    PIPELINE_CONCURRENT,
+    SKIP_RETRIEVAL_FOR_SMALLTALK,
+    StageTimer,
+    is_smalltalk,
+    peek_last_message,
+    pipeline_pool,
+    timed_stream,
+)
+from .warmup import warm_set
+from .vectorstore import get_vector_store
+
+logger = logging.getLogger(__name__)
+
+# Bearer token required by the metrics endpoint; empty leaves it open
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
 
 # Threshold for Pinecone match scores
 PINECONE_THRESHOLD = 0.77
@@ -34,214 +59,412 @@ Chatbot Name: ISHEMA RYANJYE
 We're dedicated to connecting you with reliable sexual and reproductive health services and supporting the ISHEMA RYANJYE card game community.
 """
 
-# Helper to fetch embeddings
-def get_embedding(text):
-    headers = {
-        'Authorization': f'Bearer {OPENAI_API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    body = {
-        'model': 'text-embedding-ada-002',
-        'input': text
+ERROR_MESSAGE = 'An unexpected error occurred.'
+BUSY_MESSAGE = 'I am helping many people right now. Please try again in a moment.'
+
+
+# Build the context string from vector store matches
+def extract_context(data, timer=None):
+    matches, threshold = data.get('matches') or [], PINECONE_THRESHOLD
+    lexical = data.get('lexical')
+    if lexical:
+        # Hybrid: vector matches over the cutoff and lexical matches over
+        # theirs, ranked together by reciprocal rank fusion
+        matches, threshold = fuse([m for m in matches if m.get('score', 0) >= threshold], lexical), 0
+    # Deduplicated, best-first and capped at CONTEXT_TOKEN_BUDGET
+    context, stats = build_context(matches, threshold)
+    metrics.CONTEXT_TOKENS.observe(stats['tokens'])
+    metrics.CONTEXT_CHUNKS.observe(stats['chunks'])
+    if timer:
+        timer.fields.update({f'context_{key}': value for key, value in stats.items()})
+        if lexical is not None:
+            timer.fields['lexical_matches'] = len(lexical)
+    logger.debug(
+        'Context: %d chunks, %d tokens (%d duplicates dropped, %d over budget)',
+        stats['chunks'], stats['tokens'], stats['duplicates'], stats['over_budget']
+    )
+    return context
+
+
+def build_enhanced_messages(messages, context):
+    return [
+        {'role': 'system', 'content': SYSTEM_PROMPT},
+        *messages,
+        {'role': 'system', 'content': f'Relevant info: {context or "No context available."}'}
+    ]
+
+
+def completion_body(model, enhanced_messages):
+    return {
+        'model': model,
+        'messages': enhanced_messages,
+        'temperature': 0.1,
+        'top_p': 0.2,
+        'stream': True,
+        'max_tokens': 300
     }
+
+
+def no_content_message(context):
+    return (
+        "I'm unable to provide a detailed answer based on the current database content." 
+        if context else 
+        "I don't know the answer to that."
+    )
+
+
+# Pull the delta text out of one line of an OpenAI SSE stream
+def parse_stream_line(line):
+    if not line.startswith('data: '):
+        return None
+    data = line[6:]
+    if data.strip() == '[DONE]':
+        return None
+    try:
+        chunk = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    return chunk.get('choices', [{}])[0].get('delta', {}).get('content', '') or None
+
+
+# One NDJSON line of the response stream
+def ndjson(content):
+    return f'{json.dumps({"content": content})}\n'
+
+
+def validate_messages(data):
+    """Return (messages, last_message, error) for a chat request payload.
+
+    The payload must be an object whose 'messages' are objects with string
+    content, the last one non-empty.
+    """
+    if not isinstance(data, dict):
+        return [], None, 'Invalid messages format'
+    messages = data.get('messages', [])
+    if not messages or not isinstance(messages, list):
+        return messages, None, 'Invalid messages format'
+    if not all(isinstance(m, dict) and isinstance(m.get('content'), str) for m in messages):
+        return messages, None, 'Invalid messages format'
     
+    # Get the last user message
+    last_message = messages[-1]['content']
+    if not last_message:
+        return messages, None, 'No valid message content found'
+    return messages, last_message, None
+
+
+def request_payload(data):
+    """The payload as validated: a session-mode message ({'message'}) becomes
+    a one-item 'messages' list, before any stored history is added"""
+    if not isinstance(data, dict) or 'messages' in data or 'message' not in data:
+        return data
+    message = data['message']
+    if not isinstance(message, dict):
+        message = {'role': 'user', 'content': message}
+    return {**data, 'messages': [message]}
+
+
+def session_request(data):
+    """Resolve a validated session-mode payload ({'message', optional
+    'conversation_id'}) into (conversation_id, payload with the full
+    'messages' list). Stateless payloads ({'messages'}) are returned
+    unchanged without an ID."""
+    payload = request_payload(data)
+    if payload is data:
+        return None, data
+    conversation_id, history = conversation_store.load(data.get('conversation_id'))
+    return conversation_id, {**payload, 'messages': [*history, *payload['messages']]}
+
+
+def turn_messages(message, lines):
+    """The user message and the streamed reply, as stored in a conversation"""
+    reply = ''.join(json.loads(line)['content'] for line in lines)
+    if reply == ERROR_MESSAGE or is_degraded(reply):
+        return [message]
+    return [message, {'role': 'assistant', 'content': reply}]
+
+
+def save_turn(conversation_id, messages):
     try:
-        response = requests.post(
-            'https://api.openai.com/v1/embeddings',
-            json=body, 
-            headers=headers,
-            timeout=30
-        )
-        if response.status_code == 200:
-            return response.json().get('data')[0].get('embedding', [])
-        else:
-            raise Exception(f"OpenAI Embedding Error: {response.status_code}")
+        conversation_store.append(conversation_id, messages)
     except Exception as e:
-        raise Exception(f"Failed to generate embedding: {str(e)}")
+        # The answer has already been sent; don't cut the stream short
+        logger.warning('Failed to save conversation turn: %s', e)
+        metrics.ERRORS.inc(stage='conversation_save')
+
+
+def record_turn(stream, conversation_id, message):
+    """Pass the stream through, then save the turn to the conversation. If
+    the client goes away mid-answer the user message is still saved, without
+    the partial reply."""
+    lines = []
+    completed = False
+    try:
+        for line in stream:
+            lines.append(line)
+            yield line
+        completed = True
+    finally:
+        save_turn(conversation_id, turn_messages(message, lines) if completed else [message])
+
 
-# Helper to query Pinecone
-def query_pinecone(query_embedding):
+def degraded_stream(question, context=None):
+    """A degraded reply (chat/degraded.py) as a one-line stream, with no upstream call"""
+    metrics.DEGRADED.inc(kind='context_only' if context else 'unavailable')
+    yield ndjson(degraded_reply(question, context))
+
+
+def busy_response(busy):
+    """503 for a request turned away by admission control"""
+    logger.warning('Chat request rejected: %s', busy)
+    metrics.REQUESTS.inc(outcome='busy')
+    return JsonResponse({'content': BUSY_MESSAGE}, status=503, headers={'Retry-After': str(ADMISSION_RETRY_AFTER)})
+
+
+def streaming_response(stream, conversation_id=None):
     headers = {
-        'Content-Type': 'application/json',
-        'Api-Key': PINECONE_API_KEY
-    }
-    body = {
-        'vector': query_embedding,
-        'topK': 50,
-        'includeMetadata': True
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
     }
+    if conversation_id:
+        headers['X-Conversation-Id'] = conversation_id
+    return StreamingHttpResponse(
+        stream,
+        content_type='text/event-stream',
+        headers=headers
+    )
 
+
+# Helper to query the vector store (Pinecone unless VECTOR_BACKEND says otherwise)
+def retrieve_context(query_embedding, timer=None, lexical=None, filter=None):
     try:
-        response = requests.post(PINECONE_URL, json=body, headers=headers)
-        
-        if response.status_code != 200:
-            raise Exception(f"Pinecone API error: {response.status_code}")
-            
-        data = response.json()
-        
-        if 'matches' in data and data['matches']:
-            # Filter matches by threshold
-            relevant_matches = [
-                match for match in data['matches'] 
-                if match.get('score', 0) >= PINECONE_THRESHOLD
-            ]
-            
-            if relevant_matches:
-                contexts = []
-                for match in relevant_matches:
-                    metadata = match.get('metadata', {})
-                    content = metadata.get('text') or metadata.get('content') or metadata.get('page_content')
-                    if content:
-                        contexts.append(str(content).strip())
-                
-                return '\n'.join(contexts) if contexts else None
-        
-        return None
-            
+        with breakers['vector'].guard(), metrics.VECTOR_QUERY_SECONDS.time():
+            matches = get_vector_store().query(query_embedding, top_k=50, filter=filter)
+            if filter and not usable(matches):
+                # Nothing relevant in the question's language/topic: search everything
+                matches = get_vector_store().query(query_embedding, top_k=50)
+                if timer:
+                    timer.fields['filter_fallback'] = True
+        return extract_context({'matches': matches, 'lexical': lexical}, timer)
+    except UpstreamBusy:
+        raise
+    except Exception as e:
+        raise Exception(f"Failed to query vector store: {str(e)}")
+
+
+def usable(matches):
+    return any(m.get('score', 0) >= PINECONE_THRESHOLD for m in matches)
+
+
+def prepare_context(last_message, timer, cancelled=None):
+    """Return (warm entry, embedding, context) for the new message.
+
+    A prefetch whose result will not be used sets `cancelled`; the remaining
+    upstream calls are then skipped.
+    """
+    warm = warm_set.lookup(last_message)
+    if warm:
+        # Precomputed button prompt: no embedding or Pinecone call needed
+        timer.fields['retrieval'] = 'warm'
+        return warm, warm['embedding'], warm['context']
+    if SKIP_RETRIEVAL_FOR_SMALLTALK and is_smalltalk(last_message):
+        timer.fields['retrieval'] = 'skipped'
+        return None, None, None
+    timer.fields['retrieval'] = 'vector'
+    filter = query_filter(last_message)
+    if filter:
+        timer.fields['filter'] = filter
+    with timer.stage('lexical'):
+        lexical = lexical_search.search(last_message, filter=filter)
+    try:
+        if cancelled and cancelled.is_set():
+            return None, None, None
+        with timer.stage('embed'):
+            embedding = get_embedding(last_message)
+        if cancelled and cancelled.is_set():
+            return None, None, None
+        with timer.stage('retrieve'):
+            context = retrieve_context(embedding, timer, lexical, filter)
+    except UpstreamBusy:
+        raise
     except Exception as e:
-        raise Exception(f"Failed to query Pinecone: {str(e)}")
+        if not lexical:
+            raise
+        return None, None, lexical_fallback(e, lexical, timer)
+    return None, embedding, context
+
+
+def lexical_fallback(error, lexical, timer):
+    """Context from the lexical matches alone, when embedding or vector search failed"""
+    logger.warning('Vector retrieval failed, using lexical matches only: %s', error)
+    metrics.ERRORS.inc(stage='retrieval')
+    timer.fields['retrieval'] = 'lexical'
+    return extract_context({'lexical': lexical}, timer)
+
+
+def generate_stream(model, enhanced_messages, pinecone_context, on_complete=None, question=None, permit=None):
+    """Stream an OpenAI completion as NDJSON lines.
+
+    `on_complete` receives the emitted lines once the model streamed a full answer.
+    If the completion fails (or its circuit is open) a degraded reply for
+    `question` is streamed instead. `permit` is the admission slot for the
+    completion, released when the stream ends.
+    """
+    try:
+        yield from _generate_stream(model, enhanced_messages, pinecone_context, on_complete, question)
+    finally:
+        if permit:
+            permit.release()
+
 
+def _generate_stream(model, enhanced_messages, pinecone_context, on_complete, question):
+    streamed = []
+    completed = False
+    try:
+        with breakers['completion'].guard() as call:
+            response = upstream.post(
+                'openai',
+                OPENAI_CHAT_URL,
+                json=completion_body(model, enhanced_messages),
+                headers=openai_headers(),
+                stream=True
+            )
+            
+            if response.status_code != 200:
+                response.close()
+                call.fail()
+                logger.warning('OpenAI completion error: %s', response.status_code)
+                metrics.ERRORS.inc(stage='completion_status')
+            else:
+                # Read to the end (past [DONE]) so the connection returns to the pool
+                for line in response.iter_lines():
+                    if line:
+                        content = parse_stream_line(line.decode('utf-8'))
+                        if content:
+                            streamed.append(ndjson(content))
+                            yield streamed[-1]
+                completed = True
+    
+    except CircuitOpen:
+        pass
+    except Exception as e:
+        logger.warning('OpenAI completion stream failed: %s', e)
+        metrics.ERRORS.inc(stage='completion_stream')
+    
+    if completed and streamed:
+        if on_complete:
+            on_complete(streamed)
+    elif completed:
+        yield ndjson(no_content_message(pinecone_context))
+    elif streamed:
+        metrics.DEGRADED.inc(kind='interrupted')
+        yield ndjson(f"\n\n{template('interrupted', question)}")
+    else:
+        yield from degraded_stream(question, pinecone_context)
 
 
 @csrf_exempt
 @api_view(['POST'])
 def handle_chat_bot_request(request):
     try:
-        # Extract messages from request
-        messages = request.data.get('messages', [])
-        model = request.data.get('model', 'gpt-4o')
+        timer = StageTimer()
+        with timer.stage('parse'):
+            body = request.data
+        
+        # Concurrent pipeline: retrieval for the new message and the OpenAI
+        # connection warm-up run while the conversation is loaded
+        retrieval = None
+        cancelled = threading.Event()
+        peeked_message = peek_last_message(body) if PIPELINE_CONCURRENT else None
+        if peeked_message:
+            pipeline_pool.submit(upstream.preconnect, 'openai', OPENAI_BASE_URL)
+            retrieval = pipeline_pool.submit(prepare_context, peeked_message, timer, cancelled)
         
-        if not messages or not isinstance(messages, list):
-            return Response({'error': 'Invalid messages format'}, status=400)
+        # Validate the new message before any conversation is loaded or started
+        _, last_message, error = validate_messages(request_payload(body))
+        if retrieval and (error or last_message != peeked_message):
+            # Not used (bad request, or prefetched for another message): stop it
+            cancelled.set()
+            retrieval.cancel()
+            retrieval = None
+        if error:
+            metrics.REQUESTS.inc(outcome='bad_request')
+            return Response({'error': error}, status=400)
         
-        # Get the last user message
-        last_message = messages[-1].get('content') if messages else None
-        if not last_message:
-            return Response({'error': 'No valid message content found'}, status=400)
+        # Session mode: the history is stored server-side under a conversation ID
+        with timer.stage('session'):
+            conversation_id, data = session_request(body)
+        messages = data['messages']
+        model = data.get('model', 'gpt-4o')
+        timer.fields.update(model=model, messages=len(messages))
         
-        # Generate embedding for the last user message
-        embedding = get_embedding(last_message)
+        def respond(stream, outcome):
+            timer.fields['outcome'] = outcome
+            if conversation_id:
+                stream = record_turn(stream, conversation_id, messages[-1])
+            response = streaming_response(timed_stream(stream, timer), conversation_id)
+            response['Server-Timing'] = timer.header()
+            return response
         
-        # Query Pinecone for relevant context
-        pinecone_context = query_pinecone(embedding)
+        # Embedding and vector store context for the last user message
+        try:
+            if retrieval:
+                warm, embedding, pinecone_context = retrieval.result()
+            else:
+                warm, embedding, pinecone_context = prepare_context(last_message, timer)
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            # Embedding or vector search is down: no grounded answer is possible
+            logger.warning('Retrieval failed: %s', e)
+            metrics.ERRORS.inc(stage='retrieval')
+            return respond(degraded_stream(last_message), 'degraded')
+        if warm and warm['lines'] and len(messages) == 1 and model == warm['model']:
+            return respond(iter(warm['lines']), 'warm')
+        
+        # Replay a cached answer to a near-identical question with the same context
+        if embedding is not None:
+            cache_bucket = answer_cache.bucket(model, pinecone_context, messages[:-1])
+            cached_lines = answer_cache.get(cache_bucket, embedding)
+            if cached_lines:
+                return respond(iter(cached_lines), 'answer_cache')
+            on_complete = lambda lines: answer_cache.set(cache_bucket, embedding, lines)
+        else:
+            on_complete = None
+        
+        # Completion backend down: answer from the retrieved context alone
+        if breakers['completion'].is_open():
+            return respond(degraded_stream(last_message, pinecone_context), 'degraded')
         
         # Enhanced messages with system prompt
-        enhanced_messages = [
-            {'role': 'system', 'content': SYSTEM_PROMPT},
-            *messages,
-            {'role': 'system', 'content': f'Relevant info: {pinecone_context or "No context available."}'}
-        ]
+        enhanced_messages = build_enhanced_messages(history_manager.window(messages, model), pinecone_context)
         
         # Stream OpenAI response
-        def generate_stream():
-            try:
-                headers = {
-                    'Authorization': f'Bearer {OPENAI_API_KEY}',
-                    'Content-Type': 'application/json'
-                }
-                
-                openai_body = {
-                    'model': model,
-                    'messages': enhanced_messages,
-                    'temperature': 0.1,
-                    'top_p': 0.2,
-                    'stream': True,
-                    'max_tokens': 300
-                }
-                
-                response = requests.post(
-                    'https://api.openai.com/v1/chat/completions',
-                    json=openai_body,
-                    headers=headers,
-                    stream=True,
-                    timeout=30
-                )
-                
-                if response.status_code != 200:
-                    yield f'{json.dumps({"content": "I encountered an issue processing your request. Please try again."})}\n'
-                    return
-                
-                has_content = False
-                for line in response.iter_lines():
-                    if line:
-                        line = line.decode('utf-8')
-                        if line.startswith('data: '):
-                            data = line[6:]
-                            if data.strip() == '[DONE]':
-                                break
-                            try:
-                                chunk = json.loads(data)
-                                content = chunk.get('choices', [{}])[0].get('delta', {}).get('content', '')
-                                if content:
-                                    has_content = True
-                                    yield f'{json.dumps({"content": content})}\n'
-                            except json.JSONDecodeError:
-                                continue
-                
-                # Fallback if no content was streamed
-                if not has_content:
-                    fallback_message = (
-                        "I'm unable to provide a detailed answer based on the current database content." 
-                        if pinecone_context else 
-                        "I don't know the answer to that."
-                    )
-                    yield f'{json.dumps({"content": fallback_message})}\n'
-                    
-            except Exception as e:
-                # Fallback response using OpenAI non-streaming
-                fallback_messages = [
-                    {
-                        'role': 'system',
-                        'content': 'Respond only using database content. Do not guess or provide unrelated information. Keep responses short, focused, and concise. Ask for clarification if needed.'
-                    },
-                    {
-                        'role': 'user',
-                        'content': 'An error occurred, and no context is available. How would you respond?'
-                    }
-                ]
-                
-                try:
-                    fallback_headers = {
-                        'Authorization': f'Bearer {OPENAI_API_KEY}',
-                        'Content-Type': 'application/json'
-                    }
-                    fallback_body = {
-                        'model': model,
-                        'messages': fallback_messages,
-                        'temperature': 0.01,
-                        'top_p': 0.01,
-                        'max_tokens': 100
-                    }
-                    
-                    fallback_response = requests.post(
-                        'https://api.openai.com/v1/chat/completions',
-                        json=fallback_body,
-                        headers=fallback_headers,
-                        timeout=30
-                    )
-                    
-                    if fallback_response.status_code == 200:
-                        fallback_content = fallback_response.json().get('choices', [{}])[0].get('message', {}).get('content', 'An unexpected error occurred.')
-                    else:
-                        fallback_content = 'An unexpected error occurred.'
-                        
-                    yield f'{json.dumps({"content": fallback_content})}\n'
-                    
-                except:
-                    yield f'{json.dumps({"content": "An unexpected error occurred."})}\n'
-        
-        return StreamingHttpResponse(
-            generate_stream(),
-            content_type='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'X-Accel-Buffering': 'no',
-            }
-        )
+        permit = admission.acquire('openai', model)
+        return respond(generate_stream(
+            model, enhanced_messages, pinecone_context,
+            on_complete=on_complete, question=last_message, permit=permit
+        ), 'generated')
         
+    except UpstreamBusy as busy:
+        return busy_response(busy)
     except Exception as error:
-        return Response({'content': 'An unexpected error occurred.'}, status=500)
+        logger.exception('Chat request failed')
+        metrics.ERRORS.inc(stage='request')
+        metrics.REQUESTS.inc(outcome='error')
+        return Response({'content': ERROR_MESSAGE}, status=500)
+
+
 
+# Startup buttons; their prompts are precomputed by chat.warmup
+COMMON_BUTTONS = [
+    {'buttonText': 'English', 'buttonPrompt': 'I want to continue in English'},
+    {'buttonText': 'Kinyarwanda', 'buttonPrompt': 'Nshaka gukomeza mu Kinyarwanda'},
+    {'buttonText': 'Cards game', 'buttonPrompt': 'Tell me about the ISHEMA RYANJYE card game'},
+    {'buttonText': 'SRH', 'buttonPrompt': 'Tell me about sexual and reproductive health services.'},
+    {'buttonText': 'Mental Health', 'buttonPrompt': 'Can you provide information about mental health support?'},
+    {'buttonText': 'Nutrition', 'buttonPrompt': 'Can you provide information about nutrition?'}
+]
 
 
 @api_view(['GET'])
@@ -254,14 +477,14 @@ def load_chat_bot_base_configuration(request):
         'StartUpMessage': (
             "Hello! I am ISHEMA RYANJYE Bot. I'm here to help you with health information and our card game. "
         ),
-        'commonButtons': [
-            {'buttonText': 'English', 'buttonPrompt': 'I want to continue in English'},
-            {'buttonText': 'Kinyarwanda', 'buttonPrompt': 'Nshaka gukomeza mu Kinyarwanda'},
-            {'buttonText': 'Cards game', 'buttonPrompt': 'Tell me about the ISHEMA RYANJYE card game'},
-            {'buttonText': 'SRH', 'buttonPrompt': 'Tell me about sexual and reproductive health services.'},
-            {'buttonText': 'Mental Health', 'buttonPrompt': 'Can you provide information about mental health support?'},
-            {'buttonText': 'Nutrition', 'buttonPrompt': 'Can you provide information about nutrition?'}
-        ]
+        'commonButtons': COMMON_BUTTONS
     }
     
     return JsonResponse(response)
+
+
+def chat_bot_metrics(request):
+    """Pipeline metrics in the Prometheus text format"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return HttpResponse(status=403)
+    return HttpResponse(metrics.render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,189 @@
+# chat/warmup.py
+#
+# Precomputed embeddings, context and (optionally) full answers for the
+# startup button prompts, so the first message of most conversations is
+# served without any upstream call. The set is rebuilt periodically; answers
+# are only regenerated for prompts whose retrieved context changed.
+#
+# WARMUP_FILE shares one set between workers. It records its prompt list, so
+# prompts added by `manage.py warmup --prompt` survive the workers' refreshes.
+
+import json
+import logging
+import os
+import threading
+import time
+
+from decouple import AutoConfig, Csv
+config = AutoConfig()
+
+from .answer_cache import KNOWLEDGE_BASE_VERSION, fingerprint
+from .embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ON_START = config('WARMUP_ON_START', default=False, cast=bool)
+WARMUP_ANSWERS = config('WARMUP_ANSWERS', default=False, cast=bool)
+WARMUP_MODEL = config('WARMUP_MODEL', default='gpt-4o')
+# Extra prompts to precompute, separated by '|'
+WARMUP_EXTRA_PROMPTS = config('WARMUP_EXTRA_PROMPTS', default='', cast=Csv(delimiter='|'))
+WARMUP_REFRESH_SECONDS = config('WARMUP_REFRESH_SECONDS', default=3600, cast=int)
+# Shared file written by `manage.py warmup` and loaded by every worker
+WARMUP_FILE = config('WARMUP_FILE', default='')
+# How often workers that do not warm themselves look for a rewritten file
+WARMUP_FILE_POLL_SECONDS = 60
+
+
+def warmup_prompts(extra=()):
+    from .views import COMMON_BUTTONS
+
+    prompts = [button['buttonPrompt'] for button in COMMON_BUTTONS]
+    prompts += [prompt for prompt in [*WARMUP_EXTRA_PROMPTS, *extra] if prompt]
+    return list(dict.fromkeys(prompts))
+
+
+def warmup_signature(prompts):
+    """Changes whenever the prompt list, model or knowledge base version does"""
+    return fingerprint(sorted(prompts), WARMUP_MODEL, KNOWLEDGE_BASE_VERSION)
+
+
+class WarmSet:
+    def __init__(self):
+        self.entries = {}
+        self.prompts = []
+        self.answers = False
+        self.signature = None
+        self.built_at = 0.0
+        self._lock = threading.Lock()
+
+    def lookup(self, text):
+        return self.entries.get(normalize_text(text))
+
+    def replace(self, entries, signature, built_at=None, answers=False):
+        with self._lock:
+            self.entries = {normalize_text(entry['prompt']): entry for entry in entries}
+            self.prompts = [entry['prompt'] for entry in entries]
+            self.answers = answers
+            self.signature = signature
+            self.built_at = built_at or time.time()
+
+    def save(self, path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'signature': self.signature,
+                'built_at': self.built_at,
+                'prompts': self.prompts,
+                'answers': self.answers,
+                'entries': list(self.entries.values()),
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Load a saved set if it is current and covers every prompt this
+        process knows about; return success"""
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        prompts = data.get('prompts') or []
+        # Built for another model or knowledge base version
+        if data.get('signature') != warmup_signature(prompts):
+            return False
+        if not set(warmup_prompts()) <= set(prompts):
+            return False
+        self.replace(data['entries'], data['signature'], data.get('built_at'), data.get('answers', False))
+        return True
+
+
+warm_set = WarmSet()
+
+
+def build_entries(prompts, answers=False, previous=None):
+    from .lexical import lexical_search
+    from .tagging import query_filter
+    from .views import build_enhanced_messages, generate_stream, get_embedding, retrieve_context
+
+    previous = previous or {}
+    entries = []
+    for prompt in prompts:
+        embedding = get_embedding(prompt)
+        filter = query_filter(prompt)
+        context = retrieve_context(embedding, lexical=lexical_search.search(prompt, filter=filter), filter=filter)
+        entry = {
+            'prompt': prompt,
+            'model': WARMUP_MODEL,
+            'embedding': embedding,
+            'context': context,
+            'lines': None,
+        }
+
+        old = previous.get(normalize_text(prompt))
+        if answers and old and old.get('lines') and old.get('context') == context:
+            # Index unchanged for this prompt, keep the answer we have
+            entry['lines'] = old['lines']
+        elif answers:
+            completed = []
+            messages = build_enhanced_messages([{'role': 'user', 'content': prompt}], context)
+            for _ in generate_stream(WARMUP_MODEL, messages, context, on_complete=completed.extend):
+                pass
+            entry['lines'] = completed or None
+        entries.append(entry)
+    return entries
+
+
+def run_warmup(answers=WARMUP_ANSWERS, extra=(), path=WARMUP_FILE):
+    prompts = warmup_prompts(extra)
+    signature = warmup_signature(prompts)
+    started = time.perf_counter()
+    previous = warm_set.entries if warm_set.signature == signature else None
+    entries = build_entries(prompts, answers=answers, previous=previous)
+    warm_set.replace(entries, signature, answers=answers)
+    if path:
+        warm_set.save(path)
+    logger.info('Warmed %d prompts in %.2fs', len(entries), time.perf_counter() - started)
+    return entries
+
+
+def _warmup_loop():
+    while True:
+        if WARMUP_FILE and warm_set.load(WARMUP_FILE):
+            # Another process built it recently; only rebuild once it is stale
+            wait = WARMUP_REFRESH_SECONDS - (time.time() - warm_set.built_at)
+            if wait > 0:
+                time.sleep(wait)
+                continue
+        try:
+            # Keep the prompts and answers of the set being refreshed
+            run_warmup(answers=WARMUP_ANSWERS or warm_set.answers, extra=warm_set.prompts)
+        except Exception as e:
+            logger.warning('Warmup failed: %s', e)
+        time.sleep(WARMUP_REFRESH_SECONDS)
+
+
+def _reload_loop():
+    """Follow WARMUP_FILE as rewritten by `manage.py warmup` or warming workers"""
+    mtime = None
+    while True:
+        try:
+            current = os.stat(WARMUP_FILE).st_mtime_ns
+        except OSError:
+            current = None
+        if current is not None and current != mtime and warm_set.load(WARMUP_FILE):
+            mtime = current
+        time.sleep(WARMUP_FILE_POLL_SECONDS)
+
+
+def start_background_warmup():
+    """Start the periodic warmup thread when WARMUP_ON_START is set; otherwise
+    only follow WARMUP_FILE, when there is one"""
+    if WARMUP_ON_START:
+        target = _warmup_loop
+    elif WARMUP_FILE:
+        target = _reload_loop
+    else:
+        return None
+    thread = threading.Thread(target=target, name='chat-warmup', daemon=True)
+    thread.start()
+    return thread
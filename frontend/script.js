@@ -6,6 +6,8 @@ let messageInput = document.querySelector('.lwh-open-cbot #message');
 let content = [];
 let botConfigData = '';
 let conversationTranscript = [];
+// Session mode: the server keeps the history, we only send the new message
+let conversationId = null;
 
 const resizeHandle = document.querySelector('.resize-handle');
 const chatbot = document.querySelector('.custom-chatbot');
@@ -205,6 +207,24 @@ function lwhOpenCbotcopyText(event) {
         });
 }
 
+// Read the NDJSON stream ({"content": ...} per line) into one string
+async function lwhOpenCbotreadReply(response) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    let reply = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        buffered += decoder.decode(value || new Uint8Array(), { stream: !done });
+        const lines = buffered.split('\n');
+        buffered = done ? '' : lines.pop();
+        lines.filter(line => line.trim()).forEach(line => {
+            reply += JSON.parse(line).content || '';
+        });
+        if (done) return reply;
+    }
+}
+
 async function lwhOpenCbotfetchData() {
     button.disabled = true;
     try {
@@ -214,37 +234,40 @@ async function lwhOpenCbotfetchData() {
                 'Content-Type': 'application/json'
             },
             body: JSON.stringify({
-                "last_prompt": content[content.length - 1].message,
-                "conversation_history": content.map(item => ({
-                    "role": item.role,
-                    "content": item.message
-                }))
+                "conversation_id": conversationId,
+                "message": content[content.length - 1].message
             })
         });
         if (response.ok) {
-            data = await response.json();
-            console.log(data, "Data from api");
+            conversationId = response.headers.get('X-Conversation-Id') || conversationId;
+            data = await lwhOpenCbotreadReply(response);
             button.disabled = false;
-            if (!data.success) {
+            if (!data) {
                 lwhOpenCbotremoveTypingAnimation()
                 lwhOpenCbotshowPopup('Oops! Something went wrong!', '#991a1a');
                 throw new Error("Something went wrong. Please Try Again!");
             }
+        } else if (response.status === 503) {
+            // Server busy: show its message so the user can resend shortly
+            const busy = await response.json();
+            button.disabled = false;
+            lwhOpenCbotreplaceTypingAnimationWithMessage('ai', busy.content);
+            return;
         } else {
             lwhOpenCbotshowPopup('Oops! Something went wrong!', '#991a1a');
             throw new Error("Request failed. Please try again!");
         }
         content.push({
             role: 'assistant',
-            message: data.result,
+            message: data,
         });
         let timestamp = new Date().toLocaleString();
         conversationTranscript.push({
             sender: 'bot',
             time: timestamp,
-            message: data.result,
+            message: data,
         });
-        lwhOpenCbotreplaceTypingAnimationWithMessage('ai', data.result);
+        lwhOpenCbotreplaceTypingAnimationWithMessage('ai', data);
     } catch (error) {
         lwhOpenCbotremoveTypingAnimation();
         lwhOpenCbotshowPopup('Oops! Something went wrong!', '#991a1a');
@@ -1,50 +1,39 @@
 #!/usr/bin/env python3
-from langchain_community.document_loaders import UnstructuredPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai.embeddings import OpenAIEmbeddings
-from langchain_pinecone import PineconeVectorStore
 from dotenv import load_dotenv
+import argparse
 import os
+import time
 from pinecone import Pinecone, ServerlessSpec
 
 # Load environment variables
 load_dotenv()
 
+from chat.checkpoints import Checkpoint, source_fingerprint
+from chat.documents import CHUNK_OVERLAP, CHUNK_SIZE, PARSE_WORKERS, parse_documents
+from chat.ingestion import INGEST_MANIFEST_PATH, Manifest, SyncBatch, document_key, sync_document
+from chat.openai_api import get_embedding
+from chat.vectorstore import VECTOR_BACKEND, PineconeRestStore, get_vector_store
+
 # Fetch keys from environment variables
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 PINECONE_API_KEY = os.getenv('PINECONE_API_KEY')
 PINECONE_ENVIRONMENT = os.getenv('PINECONE_ENVIRONMENT')
 INDEX_NAME = "ishema-ryanjye-hpo"  # Use existing index
+PDF_PATH = "COUNSELLING_CARD_IN_KINYARWANDA[1].pdf"  # Default document when no paths are given
 
 # Print configuration info
 print("=== Configuration Check ===")
 print(f"OpenAI API Key: {'✓ Set' if OPENAI_API_KEY else '✗ Missing'}")
 print(f"Pinecone API Key: {'✓ Set' if PINECONE_API_KEY else '✗ Missing'}")
 print(f"Pinecone Environment: {PINECONE_ENVIRONMENT if PINECONE_ENVIRONMENT else '✗ Missing'}")
+print(f"Vector Backend: {VECTOR_BACKEND}")
 print(f"Target Index Name: {INDEX_NAME}")
 print("============================\n")
 
-def main():
+def ensure_pinecone_index():
+    """Create the Pinecone index if needed and return its data-plane host"""
     global INDEX_NAME  # Allow modification of INDEX_NAME within function
     
-    # Load PDF using UnstructuredPDFLoader
-    print("Loading data from PDF...")
-    loader = UnstructuredPDFLoader("COUNSELLING_CARD_IN_KINYARWANDA[1].pdf")  # Update with your file path
-    data = loader.load()
-
-    print(f'Loaded {len(data)} document(s) from the PDF.')
-    print(f'Sample content: {data[0].page_content[:200]}')
-
-    # Split data into smaller chunks
-    print("Splitting data into smaller chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=50)
-    texts = text_splitter.split_documents(data)
-    print(f'Created {len(texts)} chunks from the document.')
-
-    # Generate embeddings
-    print("Generating embeddings...")
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-
     # Initialize Pinecone
     print("Initializing Pinecone...")
     pc = Pinecone(api_key=PINECONE_API_KEY)
@@ -114,49 +103,84 @@ def main():
         print(f"Index '{INDEX_NAME}' already exists.")
     
     print(f"Accessing the index: {INDEX_NAME}")
-    index = pc.Index(name=INDEX_NAME)
+    return pc.describe_index(INDEX_NAME).host
+
+def iter_documents(paths, checkpoints, workers):
+    """Yield (path, chunks), reusing checkpointed chunks and parsing the rest in parallel"""
+    to_parse = []
+    for path in paths:
+        if checkpoints[path].has_chunks():
+            print(f"Reusing parsed chunks for {path} from {checkpoints[path].dir}")
+            yield path, list(checkpoints[path].load_chunks())
+        else:
+            to_parse.append(path)
+    if not to_parse:
+        return
+
+    print(f"Parsing {len(to_parse)} document(s) with {workers} worker(s)...")
+    started = time.perf_counter()
+    for path, chunks in parse_documents(to_parse, workers=workers):
+        checkpoints[path].save_chunks(chunks)
+        print(f"Parsed {path}: {len(chunks)} chunks ({time.perf_counter() - started:.2f}s)")
+        yield path, chunks
+
+def main():
+    parser = argparse.ArgumentParser(description='Parse, chunk, embed and store documents')
+    parser.add_argument('paths', nargs='*', default=[PDF_PATH], help='PDF or text files to ingest')
+    parser.add_argument('--workers', type=int, default=PARSE_WORKERS, help='Parsing processes')
+    args = parser.parse_args()
+
+    # Progress is checkpointed so an interrupted run picks up where it stopped
+    checkpoints = {
+        path: Checkpoint(document_key(path), source_fingerprint(path, CHUNK_SIZE, CHUNK_OVERLAP))
+        for path in args.paths
+    }
+
+    if VECTOR_BACKEND == 'pinecone':
+        store = PineconeRestStore(host=ensure_pinecone_index())
+    else:
+        store = get_vector_store()
     
     # Check current index stats before adding data
-    stats = index.describe_index_stats()
+    stats = store.stats()
     print(f"Index stats before loading data: {stats}")
     print(f"Current vector count in index: {stats.get('total_vector_count', 0)}")
 
-    # Store embeddings in Pinecone using PineconeVectorStore
-    print(f"Storing embeddings in Pinecone index '{INDEX_NAME}'...")
-    print(f"Number of text chunks to store: {len(texts)}")
+    # Only new or changed chunks are embedded; chunks that disappeared are deleted.
+    # Each document is synced as soon as it is parsed while the pool keeps parsing.
+    print(f"Syncing chunks into {VECTOR_BACKEND} index '{INDEX_NAME}' (manifest: {INGEST_MANIFEST_PATH})...")
     
     try:
-        # Store the embeddings
-        vector_store = PineconeVectorStore.from_texts(
-            texts=[text.page_content for text in texts],
-            embedding=embeddings,
-            index_name=INDEX_NAME
-        )
+        # The index is written once, after the last document
+        batch = SyncBatch(store, Manifest())
+        added = removed = 0
+        for path, texts in iter_documents(args.paths, checkpoints, args.workers):
+            print(f"Number of text chunks in {path}: {len(texts)}")
+            counts = sync_document(path, texts, checkpoint=checkpoints[path], batch=batch)
+            added += counts[0]
+            removed += counts[1]
+        batch.finish()
         print("Embeddings stored successfully!")
         
         # Wait a moment for indexing to complete
-        import time
-        print("Waiting 3 seconds for indexing to complete...")
-        time.sleep(3)
+        if added or removed:
+            print("Waiting 3 seconds for indexing to complete...")
+            time.sleep(3)
         
         # Check index stats after loading data
-        stats_after = index.describe_index_stats()
+        stats_after = store.stats()
         print(f"Index stats after loading data: {stats_after}")
         print(f"Final vector count in index: {stats_after.get('total_vector_count', 0)}")
         
         # Test a simple query to verify data is accessible
         print("\nTesting index with a sample query...")
-        test_embedding = embeddings.embed_query("how to play")
-        query_result = index.query(
-            vector=test_embedding,
-            top_k=3,
-            include_metadata=True
-        )
-        print(f"Sample query returned {len(query_result.get('matches', []))} matches")
+        test_embedding = get_embedding("how to play")
+        matches = store.query(test_embedding, top_k=3)
+        print(f"Sample query returned {len(matches)} matches")
         
-        if query_result.get('matches'):
+        if matches:
             print("Sample match content preview:")
-            for i, match in enumerate(query_result['matches'][:2]):
+            for i, match in enumerate(matches[:2]):
                 content = match.get('metadata', {}).get('text', 'No content found')[:200]
                 print(f"  Match {i+1}: {content}...")
         else:
@@ -164,9 +188,10 @@ def main():
             
     except Exception as e:
         print(f"Error storing embeddings: {e}")
+        print("Run the script again to resume from the last completed batch.")
         return
 
-    print(f"\nData has been successfully indexed in Pinecone index '{INDEX_NAME}'.")
+    print(f"\nData has been successfully indexed in {VECTOR_BACKEND} index '{INDEX_NAME}'.")
 
 if __name__ == "__main__":
     main()
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.capture.CaptureMiddleware',  # No-op unless CAPTURE_ENABLED
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add WhiteNoise for static files
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -58,6 +59,8 @@ MIDDLEWARE = [
 ]
 
 CORS_ALLOW_ALL_ORIGINS = True
+# Session-mode responses carry the conversation ID in a header
+CORS_EXPOSE_HEADERS = ['X-Conversation-Id']
 
 ROOT_URLCONF = 'ml_chatbot.urls'
 
@@ -90,6 +93,11 @@ DATABASES = {
     )
 }
 
+# Conversation saves read then write inside one transaction; SQLite must take
+# the write lock up front or concurrent saves fail with "database is locked"
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('OPTIONS', {}).update(transaction_mode='IMMEDIATE', timeout=20)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -135,3 +143,18 @@ STATICFILES_DIRS = [
 
 # Static files storage for production
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+
+# Logging: the chat app logs pipeline timings and one structured line per request
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'chat': {
+            'handlers': ['console'],
+            'level': config('CHAT_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ml_chatbot.settings')
 
 application = get_wsgi_application()
+
+# Precompute the startup button prompts in the background (WARMUP_ON_START)
+from chat.warmup import start_background_warmup  # noqa: E402
+start_background_warmup()
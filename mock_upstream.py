@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI and Pinecone HTTP APIs used by the chatbot.
+Used by the benchmark scripts so they can run without network access.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+EMBEDDING_DIMENSION = 1536
+MOCK_ANSWER = 'ISHEMA RYANJYE is a card game about sexual and reproductive health.'
+MOCK_CONTEXT = 'Ishema ryanjye ni umukino w\'amakarita.'
+# Below the relevance threshold, sized like real chunks: query responses
+# carry as many as topK asks for, as Pinecone's do
+MOCK_FILLER = ' '.join(['Amakuru y\'inyongera ku buzima bw\'imyororokere.'] * 20)
+MOCK_VECTORS = [
+    {'id': 'mock-0', 'values': [0.001] * EMBEDDING_DIMENSION, 'metadata': {'text': MOCK_CONTEXT}},
+    *({'id': f'mock-{i}', 'values': [0.001] * EMBEDDING_DIMENSION, 'metadata': {'text': f'{i}. {MOCK_FILLER}'}}
+      for i in range(1, 50)),
+]
+
+
+class MockUpstreamHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.0
+    # Fraction of POSTs answered with 429, to exercise retry paths
+    error_rate = 0.0
+    # Streamed completion speed (0 = as fast as possible) and length
+    token_rate = 0.0
+    answer_tokens = 0
+    # POSTs served at once before answering 429, like a rate-limited account (0 = unlimited)
+    capacity = 0
+    state = {'upserted': 0}
+    counts = {}
+    counts_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, words):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, word in enumerate(words):
+            if self.token_rate and i:
+                time.sleep(1 / self.token_rate)
+            delta = {'content': word if i == 0 else f' {word}'}
+            self._write_chunk(f'data: {json.dumps({"choices": [{"delta": delta}]})}\n\n')
+        self._write_chunk('data: [DONE]\n\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+
+    def _answer_words(self):
+        words = MOCK_ANSWER.split(' ')
+        if self.answer_tokens:
+            words = [words[i % len(words)] for i in range(self.answer_tokens)]
+        return words
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path.endswith('/vectors/list'):
+            self._send_json({'vectors': [{'id': v['id']} for v in MOCK_VECTORS], 'pagination': {}})
+        elif url.path.endswith('/vectors/fetch'):
+            ids = set(params.get('ids', []))
+            self._send_json({'vectors': {v['id']: v for v in MOCK_VECTORS if v['id'] in ids}})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+    def do_HEAD(self):
+        # Connection warm-up probes
+        with self.counts_lock:
+            self.counts['HEAD'] = self.counts.get('HEAD', 0) + 1
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        body = self._read_body()
+        with self.counts_lock:
+            self.counts[self.path] = self.counts.get(self.path, 0) + 1
+            self.state['in_flight'] = self.state.get('in_flight', 0) + 1
+            over_capacity = self.capacity and self.state['in_flight'] > self.capacity
+            if over_capacity:
+                self.counts['429'] = self.counts.get('429', 0) + 1
+        try:
+            if over_capacity:
+                self._send_json({'error': 'rate limited'}, status=429)
+            else:
+                self._handle_post(body)
+        finally:
+            with self.counts_lock:
+                self.state['in_flight'] -= 1
+
+    def _handle_post(self, body):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self._send_json({'error': 'rate limited'}, status=429)
+            return
+
+        if self.path.endswith('/embeddings'):
+            inputs = body.get('input', '')
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._send_json({
+                'data': [
+                    {'index': i, 'embedding': [0.001] * EMBEDDING_DIMENSION}
+                    for i in range(len(inputs))
+                ]
+            })
+        elif self.path.endswith('/chat/completions'):
+            if body.get('stream'):
+                self._send_stream(self._answer_words())
+            else:
+                content = ' '.join(self._answer_words())
+                self._send_json({'choices': [{'message': {'role': 'assistant', 'content': content}}]})
+        elif self.path.endswith('/vectors/upsert'):
+            with self.counts_lock:
+                self.state['upserted'] += len(body.get('vectors', []))
+            self._send_json({'upsertedCount': len(body.get('vectors', []))})
+        elif self.path.endswith('/vectors/delete'):
+            self._send_json({})
+        elif self.path.endswith('/describe_index_stats'):
+            self._send_json({'dimension': EMBEDDING_DIMENSION, 'totalVectorCount': self.state['upserted']})
+        elif self.path.endswith('/query'):
+            matches = []
+            for i, vector in enumerate(MOCK_VECTORS[:body.get('topK', 10)]):
+                match = {'id': vector['id'], 'score': 0.9 if i == 0 else round(0.7 - i * 0.005, 3)}
+                if body.get('includeMetadata'):
+                    match['metadata'] = vector['metadata']
+                matches.append(match)
+            self._send_json({'matches': matches})
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+
+
+def start_mock_server(host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, token_rate=0.0, answer_tokens=0,
+                      capacity=0):
+    """Start the mock server in a daemon thread and return it.
+
+    `latency` delays every POST, `token_rate` paces streamed completions in
+    tokens per second and `answer_tokens` sets their length. Beyond `capacity`
+    concurrent POSTs, requests get a 429.
+    """
+    handler = type('Handler', (MockUpstreamHandler,), {
+        'latency': latency,
+        'error_rate': error_rate,
+        'token_rate': token_rate,
+        'answer_tokens': answer_tokens,
+        'capacity': capacity,
+        'counts': {},
+        'state': {'upserted': 0},
+        'counts_lock': threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    # Requests served per path
+    server.counts = handler.counts
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def server_url(server):
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='Delay per POST in seconds')
+    parser.add_argument('--token-rate', type=float, default=0.0, help='Streamed tokens per second (0 = unpaced)')
+    parser.add_argument('--answer-tokens', type=int, default=0, help='Tokens per streamed answer')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of POSTs answered with 429')
+    parser.add_argument('--capacity', type=int, default=0, help='Concurrent POSTs before answering 429')
+    args = parser.parse_args()
+    server = start_mock_server(
+        port=args.port, latency=args.latency, error_rate=args.error_rate,
+        token_rate=args.token_rate, answer_tokens=args.answer_tokens, capacity=args.capacity
+    )
+    print(f"Mock upstream listening on {server_url(server)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,62 +1,50 @@
-import os
+import argparse
 import json
-import pinecone
-from decouple import config
-from openai import OpenAI
 
-# Initialize OpenAI client
-client = OpenAI(api_key=config('OPENAI_API_KEY'))
+from chat.checkpoints import Checkpoint, source_fingerprint
+from chat.ingestion import EMBED_BATCH_SIZE, INGEST_CONCURRENCY, Manifest, document_key, sync_document
+from chat.vectorstore import UPSERT_BATCH_SIZE, get_vector_store
 
-# Initialize Pinecone
-pinecone.init(
-    api_key=config('PINECONE_API_KEY'),
-    environment=config('PINECONE_ENVIRONMENT')
-)
+# Vector store selected by VECTOR_BACKEND (Pinecone REST by default, using PINECONE_URL)
+index = get_vector_store()
 
-# Get or create index
-index_name = config('INDEX_NAME')
-dimension = 1536  # This is the dimension for text-embedding-ada-002
-
-# Check if index exists, if not create it
-if index_name not in pinecone.list_indexes():
-    pinecone.create_index(
-        name=index_name,
-        dimension=dimension,
-        metric='cosine'
-    )
-
-# Connect to the index
-index = pinecone.Index(index_name)
-
-def get_embedding(text):
-    """Get embedding from OpenAI"""
-    response = client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=text
-    )
-    return response.data[0].embedding
-
-def upsert_to_pinecone(texts, metadata_list=None):
-    """Upsert texts to Pinecone with optional metadata"""
+def upsert_to_pinecone(texts, metadata_list=None, document='populate_pinecone_samples',
+                       embed_batch_size=EMBED_BATCH_SIZE, upsert_batch_size=UPSERT_BATCH_SIZE,
+                       concurrency=INGEST_CONCURRENCY, checkpoint=None):
+    """Sync texts (with optional metadata) as one document: only new texts are
+    embedded, and texts dropped since the last run are deleted"""
     if metadata_list is None:
         metadata_list = [{} for _ in texts]
     
-    # Get embeddings for all texts
-    embeddings = [get_embedding(text) for text in texts]
-    
-    # Prepare vectors for upsert
-    vectors = []
-    for i, (embedding, metadata) in enumerate(zip(embeddings, metadata_list)):
-        vector = {
-            'id': f'vec_{i}',
-            'values': embedding,
-            'metadata': {**metadata, 'text': texts[i]}
-        }
-        vectors.append(vector)
-    
-    # Upsert to Pinecone
-    index.upsert(vectors=vectors, namespace='default')
-    print(f"Upserted {len(vectors)} vectors to Pinecone")
+    # Upsert to the vector store, in the namespace the chat endpoint queries
+    added, removed, unchanged = sync_document(
+        document,
+        zip(texts, metadata_list),
+        store=index,
+        manifest=Manifest(),
+        embed_batch_size=embed_batch_size,
+        upsert_batch_size=upsert_batch_size,
+        concurrency=concurrency,
+        checkpoint=checkpoint
+    )
+    print(f"Upserted {added} vectors to the vector store ({removed} removed, {unchanged} unchanged)")
+
+def read_input(path):
+    """Texts and metadata from a JSONL file ({"text": ..., "metadata": {...}}) or one text per line"""
+    texts, metadata_list = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                texts.append(record['text'])
+                metadata_list.append(record.get('metadata', {}))
+            else:
+                texts.append(line)
+                metadata_list.append({})
+    return texts, metadata_list
 
 # Example usage with some sample data
 sample_texts = [
@@ -87,10 +75,28 @@ sample_metadata = [
 ]
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Embed texts and upsert them into the vector store')
+    parser.add_argument('--input', help='JSONL or plain-text file to load instead of the sample data')
+    parser.add_argument('--batch-size', type=int, default=EMBED_BATCH_SIZE, help='Texts per embedding request')
+    parser.add_argument('--upsert-batch-size', type=int, default=UPSERT_BATCH_SIZE, help='Vectors per upsert request')
+    parser.add_argument('--concurrency', type=int, default=INGEST_CONCURRENCY, help='Embedding requests in flight')
+    args = parser.parse_args()
+    
+    texts, metadata_list = read_input(args.input) if args.input else (sample_texts, sample_metadata)
+    # Large input files are checkpointed so an interrupted run can resume
+    checkpoint = Checkpoint(document_key(args.input), source_fingerprint(args.input)) if args.input else None
+    
     print("Starting Pinecone population...")
-    upsert_to_pinecone(sample_texts, sample_metadata)
+    upsert_to_pinecone(
+        texts, metadata_list,
+        document=args.input or 'populate_pinecone_samples',
+        embed_batch_size=args.batch_size,
+        upsert_batch_size=args.upsert_batch_size,
+        concurrency=args.concurrency,
+        checkpoint=checkpoint
+    )
     print("Pinecone population completed!")
     
     # Verify the index stats
     print("\nIndex Stats:")
-    print(index.describe_index_stats()) 
\ No newline at end of file
+    print(index.stats())
\ No newline at end of file
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Replay captured chat traffic (see CAPTURE_ENABLED) against a server and
+compare the latency distributions of two runs.
+
+Usage: python replay_requests.py replay captures/requests.jsonl --target http://localhost:8000 --output before.jsonl
+       python replay_requests.py replay captures/requests.jsonl --local --mode asgi --speed 10 --output after.jsonl
+       python replay_requests.py compare before.jsonl after.jsonl
+
+Requests are sent at their captured inter-arrival times divided by --speed
+(--speed 0 sends them back to back). Turns of a captured conversation are
+replayed in order within one new conversation on the target.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmark_chat import percentile, report, send, start_app
+from mock_upstream import start_mock_server, server_url
+
+
+def load_capture(path, limit=None):
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            # Skip lines that are not capture records rather than fail later
+            if isinstance(record, dict) and record.get('payload') and isinstance(record.get('ts'), (int, float)):
+                records.append(record)
+    records.sort(key=lambda r: r['ts'])
+    return records[:limit] if limit else records
+
+
+def replay(records, url, speed, concurrency, timeout):
+    """Send `records` on their captured schedule; return (results, elapsed)"""
+    local = threading.local()
+    conversations = {}
+    previous_turn = {}
+    results = [None] * len(records)
+    start_ts = records[0]['ts'] if records else 0
+
+    def run(index, record, scheduled, waits_for, done):
+        if not hasattr(local, 'http'):
+            local.http = requests.Session()
+        lag = time.perf_counter() - scheduled
+        if waits_for:
+            waits_for.wait()
+        start = time.perf_counter()
+        try:
+            payload = dict(record['payload'])
+            key = record.get('conversation')
+            if 'message' in payload and conversations.get(key):
+                payload['conversation_id'] = conversations[key]
+            result, conversation_id = send(local.http, f"{url}{record.get('path', '/chat-bot/')}", payload, timeout)
+            if key and conversation_id:
+                conversations[key] = conversation_id
+        except Exception as e:
+            # A malformed record or an unexpected client error fails only this request
+            result = (type(e).__name__, None, time.perf_counter() - start, 0)
+        finally:
+            done.set()
+        results[index] = {
+            'index': index,
+            'offset_ms': round((record['ts'] - start_ts) * 1000, 1),
+            'lag_ms': round(lag * 1000, 1),
+            'outcome': result[0],
+            'ttft_ms': round(result[1] * 1000, 1) if result[1] is not None else None,
+            'total_ms': round(result[2] * 1000, 1),
+            'lines': result[3],
+            'captured_ttft_ms': record.get('ttft_ms'),
+            'captured_total_ms': record.get('total_ms'),
+        }
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, record in enumerate(records):
+            scheduled = started + ((record['ts'] - start_ts) / speed if speed else 0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # Chain the turns of each conversation
+            key = record.get('conversation')
+            done = threading.Event()
+            waits_for = previous_turn.get(key) if key else None
+            if key:
+                previous_turn[key] = done
+            pool.submit(run, index, record, scheduled, waits_for, done)
+    return results, time.perf_counter() - started
+
+
+def as_tuples(results):
+    return [
+        (r['outcome'], (r['ttft_ms'] or 0) / 1000, r['total_ms'] / 1000, r['lines'])
+        for r in results
+    ]
+
+
+def load_results(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(baseline, candidate):
+    print(f"{'':<14}{'baseline':>12}{'candidate':>12}{'change':>10}")
+
+    def row(label, a, b):
+        change = f'{(b - a) / a * 100:+.1f}%' if a else ''
+        print(f"{label:<14}{a:>12.1f}{b:>12.1f}{change:>10}")
+
+    for field in ('ttft_ms', 'total_ms'):
+        a = sorted(r[field] for r in baseline if r['outcome'] == 'ok' and r[field] is not None)
+        b = sorted(r[field] for r in candidate if r['outcome'] == 'ok' and r[field] is not None)
+        for p in (50, 95, 99):
+            row(f'{field[:-3]} p{p} ms', percentile(a, p), percentile(b, p))
+
+    def error_rate(results):
+        return sum(r['outcome'] != 'ok' for r in results) / len(results) * 100 if results else 0.0
+
+    print(f"{'errors %':<14}{error_rate(baseline):>12.1f}{error_rate(candidate):>12.1f}")
+    print(f"{'requests':<14}{len(baseline):>12}{len(candidate):>12}")
+
+    # Same captured request in both runs
+    paired = {r['index']: r for r in baseline if r['outcome'] == 'ok'}
+    deltas = [
+        r['ttft_ms'] - paired[r['index']]['ttft_ms']
+        for r in candidate
+        if r['outcome'] == 'ok' and r['index'] in paired
+    ]
+    if deltas:
+        print(f"Median per-request TTFT change: {statistics.median(deltas):+.1f} ms over {len(deltas)} requests")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('replay', help='Replay a capture file')
+    run.add_argument('capture')
+    run.add_argument('--target', default='http://localhost:8000', help='Server to replay against')
+    run.add_argument('--local', action='store_true',
+                     help='Start this tree under gunicorn against the mock upstream instead')
+    run.add_argument('--mode', choices=['wsgi', 'asgi'], default='wsgi')
+    run.add_argument('--workers', type=int, default=2)
+    run.add_argument('--env', action='append', default=[], metavar='KEY=VALUE', help='Extra server setting (--local)')
+    run.add_argument('--answer-cache', action='store_true', help='Leave the answer cache enabled (--local)')
+    run.add_argument('--latency', type=float, default=0.05, help='Mock delay per upstream POST (--local)')
+    run.add_argument('--token-rate', type=float, default=50.0, help='Mock streamed tokens per second (--local)')
+    run.add_argument('--answer-tokens', type=int, default=40, help='Mock tokens per answer (--local)')
+    run.add_argument('--speed', type=float, default=1.0, help='Time compression; 0 sends back to back')
+    run.add_argument('--concurrency', type=int, default=200, help='Most requests in flight')
+    run.add_argument('--limit', type=int, help='Replay only the first N requests')
+    run.add_argument('--timeout', type=float, default=60.0)
+    run.add_argument('--output', help='Write per-request results here (JSONL)')
+
+    diff = commands.add_parser('compare', help='Compare two replay result files')
+    diff.add_argument('baseline')
+    diff.add_argument('candidate')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        compare(load_results(args.baseline), load_results(args.candidate))
+        return
+
+    records = load_capture(args.capture, args.limit)
+    if not records:
+        sys.exit(f"No replayable requests in {args.capture}")
+    span = records[-1]['ts'] - records[0]['ts']
+
+    upstream = process = None
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            url = args.target.rstrip('/')
+            if args.local:
+                upstream = start_mock_server(latency=args.latency, token_rate=args.token_rate,
+                                             answer_tokens=args.answer_tokens)
+                process, url = start_app(args, server_url(upstream), workdir)
+            print(
+                f"=== {len(records)} requests captured over {span:.1f} s, "
+                f"speed {args.speed or 'max'}, against {url} ==="
+            )
+            results, elapsed = replay(records, url, args.speed, args.concurrency, args.timeout)
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+            if upstream:
+                upstream.shutdown()
+
+    report(as_tuples(results), elapsed)
+    lags = sorted(r['lag_ms'] for r in results)
+    print(f"schedule lag p95 {percentile(lags, 95):8.1f} ms")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(r) + '\n' for r in results)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -23,14 +23,28 @@ def main():
     
     print(f"Final port to use: {port}")
     
+    # 'wsgi' runs sync workers; 'asgi' runs uvicorn workers with the async chat view
+    server_mode = os.environ.get('SERVER_MODE', 'wsgi')
+    workers = os.environ.get('WEB_CONCURRENCY', '4')  # Render recommends multiple workers
+    print(f"Server mode: {server_mode}")
+    
     # Start gunicorn (migrations and collectstatic are handled in build.sh for Render)
     print("Starting gunicorn...")
-    cmd = [
-        'gunicorn',
-        '--bind', f'0.0.0.0:{port}',
-        '--workers', '4',  # Render recommends multiple workers
-        'ml_chatbot.wsgi:application'
-    ]
+    if server_mode == 'asgi':
+        cmd = [
+            'gunicorn',
+            '--bind', f'0.0.0.0:{port}',
+            '--workers', workers,
+            '--worker-class', 'uvicorn.workers.UvicornWorker',
+            'ml_chatbot.asgi:application'
+        ]
+    else:
+        cmd = [
+            'gunicorn',
+            '--bind', f'0.0.0.0:{port}',
+            '--workers', workers,
+            'ml_chatbot.wsgi:application'
+        ]
     
     os.execvp('gunicorn', cmd)
 
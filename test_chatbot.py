@@ -13,6 +13,14 @@ BASE_URL = "http://localhost:8000"
 CHAT_ENDPOINT = f"{BASE_URL}/chat-bot/"
 CONFIG_ENDPOINT = f"{BASE_URL}/chat-bot-config/"
 
+def read_reply(response):
+    """Join the streamed NDJSON lines ({"content": ...}) into the full reply"""
+    return ''.join(
+        json.loads(line).get('content', '')
+        for line in response.iter_lines(decode_unicode=True)
+        if line
+    )
+
 def test_api_call(message, description=""):
     """Make an API call and return the result"""
     print(f"\n{'='*60}")
@@ -23,15 +31,16 @@ def test_api_call(message, description=""):
     try:
         response = requests.post(
             CHAT_ENDPOINT,
-            json={"message": message},
+            json={"messages": [{"role": "user", "content": message}]},
             headers={"Content-Type": "application/json"},
+            stream=True,
             timeout=30
         )
         
         if response.status_code == 200:
-            result = response.json()
+            result = read_reply(response)
             print(f"✅ SUCCESS (Status: {response.status_code})")
-            print(f"Response: {result.get('result', 'No result field')}")
+            print(f"Response: {result or 'No content'}")
             return result
         else:
             print(f"❌ FAILED (Status: {response.status_code})")
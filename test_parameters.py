@@ -14,32 +14,38 @@ def test_parameters():
     # Make a test call
     response = requests.post(
         "http://localhost:8000/chat-bot/",
-        json={"message": "how to play ishema ryanjye card game"},
-        headers={"Content-Type": "application/json"}
+        json={"messages": [{"role": "user", "content": "how to play ishema ryanjye card game"}]},
+        headers={"Content-Type": "application/json"},
+        stream=True
     )
     
     if response.status_code == 200:
-        result = response.json()
+        # The reply streams as NDJSON lines of {"content": ...}
+        result = ''.join(
+            json.loads(line).get('content', '')
+            for line in response.iter_lines(decode_unicode=True)
+            if line
+        )
         print("✅ API Call Successful")
-        print(f"Response: {result.get('result', 'No result')[:200]}...")
+        print(f"Response: {result[:200]}...")
+        print(f"Server-Timing: {response.headers.get('Server-Timing', 'not set')}")
         
         print(f"\n📊 CURRENT PARAMETER SETTINGS:")
         print("=" * 40)
         print("🎯 Pinecone Parameters:")
-        print("   • topK: 5 (returns top 5 most similar matches)")
+        print("   • topK: 50, score threshold 0.77 (PINECONE_THRESHOLD)")
         print("   • includeMetadata: True (includes text content)")
-        print("   • metric: cosine similarity")
+        print("   • context capped at CONTEXT_TOKEN_BUDGET tokens")
         
         print("\n🤖 OpenAI Parameters:")
-        print("   • model: gpt-3.5-turbo")
-        print("   • temperature: 0.7 (moderate creativity)")
-        print("   • top_p: Not set (using default)")
-        print("   • max_tokens: Not set (using default)")
+        print("   • model: gpt-4o (or the request's \"model\")")
+        print("   • temperature: 0.1")
+        print("   • top_p: 0.2")
+        print("   • max_tokens: 300")
         
         print("\n⚙️ To adjust these parameters:")
-        print("   • Edit chat/views.py line ~125 for Pinecone topK")
-        print("   • Edit chat/views.py line ~300 for OpenAI temperature")
-        print("   • Add top_p, max_tokens to openai_body for more control")
+        print("   • Edit retrieve_context in chat/views.py for Pinecone topK")
+        print("   • Edit completion_body in chat/views.py for OpenAI sampling")
         
     else:
         print(f"❌ API Call Failed: {response.status_code}")